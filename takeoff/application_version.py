@@ -1,7 +1,8 @@
 import re
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from typing import Optional
 
-from takeoff.util import get_tag
+from takeoff.util import GitInfo, get_tag
 
 
 @dataclass(frozen=True)
@@ -9,6 +10,7 @@ class ApplicationVersion(object):
     environment: str
     version: str
     branch: str
+    git_info: Optional[GitInfo] = field(default=None, compare=False, repr=False)
 
     @property
     def on_feature_branch(self) -> bool:
@@ -17,7 +19,7 @@ class ApplicationVersion(object):
 
     @property
     def on_release_tag(self):
-        tag = get_tag()
+        tag = self.git_info.tag if self.git_info else get_tag()
         return tag is not None
 
     @property
@@ -1,7 +1,7 @@
 import logging
 import pprint
 from dataclasses import dataclass
-from typing import List, Set
+from typing import List, Optional, Set
 
 import voluptuous as vol
 from azure.mgmt.eventhub import EventHubManagementClient
@@ -18,6 +18,7 @@ from takeoff.context import Context, ContextKey
 from takeoff.credentials.secret import Secret
 from takeoff.schemas import TAKEOFF_BASE_SCHEMA
 from takeoff.step import Step
+from takeoff.tracing import traced
 
 logger = logging.getLogger(__name__)
 
@@ -93,10 +94,15 @@ class ConfigureEventHub(Step):
     Optionally propagate the consumer- or producer secrets to Databricks as secret.
     """
 
+    produces = frozenset(
+        {ContextKey.EVENTHUB_PRODUCER_POLICY_SECRETS, ContextKey.EVENTHUB_CONSUMER_GROUP_SECRETS}
+    )
+
     def __init__(self, env: ApplicationVersion, config: dict):
         super().__init__(env, config)
         self.vault_name, self.vault_client = KeyVaultClient.vault_and_client(self.config, self.env)
         self.eventhub_client = self._get_eventhub_client()
+        self._databricks_secrets: Optional[CreateDatabricksSecretFromValue] = None
 
     def schema(self) -> vol.Schema:
         return SCHEMA
@@ -265,7 +271,9 @@ class ConfigureEventHub(Step):
             secrets: A list of secrets
             application_name: The name of this application
         """
-        databricks_secrets = CreateDatabricksSecretFromValue(self.env, self.config)
+        if not self._databricks_secrets:
+            self._databricks_secrets = CreateDatabricksSecretFromValue(self.env, self.config)
+        databricks_secrets = self._databricks_secrets
         databricks_secrets._create_scope(self.application_name)
         databricks_secrets._add_secrets(self.application_name, secrets)
 
@@ -343,8 +351,11 @@ class ConfigureEventHub(Step):
         credentials = ActiveDirectoryUserCredentials(
             vault_name=self.vault_name, vault_client=self.vault_client
         ).credentials(self.config)
-        return EventHubManagementClient(
-            credentials, SubscriptionId(self.vault_name, self.vault_client).subscription_id(self.config)
+        return traced(
+            EventHubManagementClient(
+                credentials, SubscriptionId(self.vault_name, self.vault_client).subscription_id(self.config)
+            ),
+            "eventhub",
         )
 
     def create_eventhub_consumer_groups(self, consumer_groups: List[EventHubConsumerGroup]):
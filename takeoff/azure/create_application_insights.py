@@ -11,9 +11,11 @@ from takeoff.azure.credentials.active_directory_user import ActiveDirectoryUserC
 from takeoff.azure.credentials.keyvault import KeyVaultClient
 from takeoff.azure.credentials.subscription_id import SubscriptionId
 from takeoff.azure.util import get_resource_group_name
+from takeoff.credentials.client_pool import ClientPool
 from takeoff.credentials.secret import Secret
 from takeoff.schemas import TAKEOFF_BASE_SCHEMA
 from takeoff.step import Step
+from takeoff.tracing import traced
 
 logger = logging.getLogger(__name__)
 
@@ -84,14 +86,21 @@ class CreateApplicationInsights(Step):
         Returns:
             An Application Insights management client
         """
-        azure_user_credentials = ActiveDirectoryUserCredentials(
-            vault_name=self.vault_name, vault_client=self.vault_client
-        ).credentials(self.config)
-
-        return ApplicationInsightsManagementClient(
-            azure_user_credentials,
-            SubscriptionId(self.vault_name, self.vault_client).subscription_id(self.config),
-        )
+
+        def create():
+            azure_user_credentials = ActiveDirectoryUserCredentials(
+                vault_name=self.vault_name, vault_client=self.vault_client
+            ).credentials(self.config)
+
+            return traced(
+                ApplicationInsightsManagementClient(
+                    azure_user_credentials,
+                    SubscriptionId(self.vault_name, self.vault_client).subscription_id(self.config),
+                ),
+                "applicationinsights",
+            )
+
+        return ClientPool().get((self.vault_name, "applicationinsights"), create)
 
     def _find_existing_instance(
         self, client: ApplicationInsightsManagementClient, name: str
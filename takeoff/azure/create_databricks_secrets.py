@@ -9,7 +9,10 @@ from databricks_cli.secrets.api import SecretApi
 from takeoff.application_version import ApplicationVersion
 from takeoff.azure.credentials.databricks import Databricks
 from takeoff.azure.credentials.keyvault import KeyVaultClient
-from takeoff.azure.credentials.keyvault_credentials_provider import KeyVaultCredentialsMixin
+from takeoff.azure.credentials.keyvault_credentials_provider import (
+    DEFAULT_KEYVAULT_CONCURRENCY,
+    KeyVaultCredentialsMixin,
+)
 from takeoff.credentials.DeploymentYamlEnvironmentVariablesMixin import (
     DeploymentYamlEnvironmentVariablesMixin,
 )
@@ -105,7 +108,8 @@ class CreateDatabricksSecretsFromVault(Step, CreateDatabricksSecretsMixin):
 
     def _combine_secrets(self):
         vault_secrets = KeyVaultCredentialsMixin(self.vault_name, self.vault_client).get_keyvault_secrets(
-            self.application_name
+            self.application_name,
+            self.config["azure"].get("keyvault_concurrency", DEFAULT_KEYVAULT_CONCURRENCY),
         )
         deployment_secrets = DeploymentYamlEnvironmentVariablesMixin(
             self.env, self.config
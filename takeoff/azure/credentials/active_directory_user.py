@@ -1,6 +1,7 @@
 from msrestazure.azure_active_directory import UserPassCredentials
 
 from takeoff.azure.credentials.keyvault_credentials_provider import KeyVaultCredentialsMixin
+from takeoff.credentials.client_pool import ClientPool
 from takeoff.util import current_filename
 
 
@@ -11,7 +12,13 @@ class ActiveDirectoryUserCredentials(KeyVaultCredentialsMixin):
     """
 
     def credentials(self, config: dict) -> UserPassCredentials:
-        credential_kwargs = super()._transform_key_to_credential_kwargs(
-            config["azure"]["keyvault_keys"][current_filename(__file__)]
-        )
-        return UserPassCredentials(**credential_kwargs)
+        """Returns the AAD credentials. These are shared for the whole run, so the access token they
+        acquire is reused by every step."""
+
+        def create():
+            credential_kwargs = self._transform_key_to_credential_kwargs(
+                config["azure"]["keyvault_keys"][current_filename(__file__)]
+            )
+            return UserPassCredentials(**credential_kwargs)
+
+        return ClientPool().get((self.vault_name, "active_directory_user"), create)
@@ -1,12 +1,17 @@
 from databricks_cli.sdk import ApiClient
 
 from takeoff.azure.credentials.keyvault_credentials_provider import KeyVaultCredentialsMixin
+from takeoff.credentials.client_pool import ClientPool
+from takeoff.tracing import traced
 from takeoff.util import current_filename
 
 
 class Databricks(KeyVaultCredentialsMixin):
     def api_client(self, config: dict) -> ApiClient:
-        credential_kwargs = super()._transform_key_to_credential_kwargs(
-            config["azure"]["keyvault_keys"][current_filename(__file__)]
-        )
-        return ApiClient(**credential_kwargs)
+        def create():
+            credential_kwargs = self._transform_key_to_credential_kwargs(
+                config["azure"]["keyvault_keys"][current_filename(__file__)]
+            )
+            return traced(ApiClient(**credential_kwargs), "databricks", record_args=True)
+
+        return ClientPool().get((self.vault_name, "databricks"), create)
@@ -1,4 +1,6 @@
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from typing import List, Dict, Optional, Union, Tuple
 
@@ -8,7 +10,8 @@ from azure.keyvault.models import SecretBundle
 from takeoff.azure.credentials.keyvault import KeyVaultClient
 from takeoff.credentials.credential_provider import BaseProvider
 from takeoff.credentials.secret import Secret
-from takeoff.util import get_matching_group, has_prefix_match, inverse_dictionary
+from takeoff.schemas import DEFAULT_KEYVAULT_CONCURRENCY
+from takeoff.util import call_with_retries, get_matching_group, has_prefix_match, inverse_dictionary
 
 
 @dataclass(frozen=True)
@@ -22,6 +25,79 @@ class KeyVaultSecrets:
     secrets: List[Secret]
 
 
+class KeyVaultSecretCache(object):
+    """Per-run cache of the secrets in an Azure KeyVault
+
+    The vault is listed once, secret values are only fetched when they are requested and then kept
+    for the remainder of the run. There is a single cache per vault name, shared by all credential
+    providers and steps.
+    """
+
+    _caches: Dict[str, "KeyVaultSecretCache"] = {}
+    _caches_lock = threading.Lock()
+
+    def __init__(self, vault_name: str, vault_client: AzureKeyVaultClient):
+        self.vault_name = vault_name
+        self.vault_client = vault_client
+        self._secret_ids: Optional[List[str]] = None
+        self._values: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_vault(cls, vault_name: str, vault_client: AzureKeyVaultClient) -> "KeyVaultSecretCache":
+        """Returns the cache for the given vault, creating it on first use
+
+        Args:
+            vault_name: The name of the vault
+            vault_client: Client used to populate the cache if it does not exist yet
+        """
+        with cls._caches_lock:
+            if vault_name not in cls._caches:
+                cls._caches[vault_name] = cls(vault_name, vault_client)
+            return cls._caches[vault_name]
+
+    @classmethod
+    def clear(cls):
+        """Drops the caches of all vaults"""
+        with cls._caches_lock:
+            cls._caches = {}
+
+    def secret_ids(self) -> List[str]:
+        """Returns the ids of all secrets in the vault, listing the vault only the first time"""
+        with self._lock:
+            if self._secret_ids is None:
+                secrets = list(self.vault_client.get_secrets(self.vault_name))
+                self._secret_ids = KeyVaultCredentialsMixin._extract_keyvault_ids_from(secrets)
+            return list(self._secret_ids)
+
+    def get(self, secret_id: str) -> str:
+        """Returns the value of a secret, fetching it from the vault the first time
+
+        Throttled (429) and failed (5xx) requests are retried with exponential backoff.
+        """
+        with self._lock:
+            if secret_id in self._values:
+                return self._values[secret_id]
+        value = call_with_retries(lambda: self.vault_client.get_secret(self.vault_name, secret_id, "").value)
+        with self._lock:
+            return self._values.setdefault(secret_id, value)
+
+    def get_many(self, secret_ids: List[str], max_workers: int = DEFAULT_KEYVAULT_CONCURRENCY) -> List[str]:
+        """Returns the values of the given secrets, fetching up to `max_workers` secrets concurrently
+
+        Args:
+            secret_ids: The ids of the secrets to fetch
+            max_workers: The maximum number of concurrent requests to the vault
+
+        Returns:
+            The secret values, in the same order as `secret_ids`
+        """
+        if max_workers <= 1 or len(secret_ids) <= 1:
+            return [self.get(_) for _ in secret_ids]
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="takeoff-keyvault") as pool:
+            return list(pool.map(self.get, secret_ids))
+
+
 class KeyVaultCredentialsMixin(object):
     """Collection of Azure KeyVault helper functions"""
 
@@ -70,32 +146,40 @@ class KeyVaultCredentialsMixin(object):
         return credential_kwargs
 
     def _credentials(self, keys: List[str], prefix: str = None) -> Dict[str, str]:
-        """
+        """Only the values of the requested keys are fetched from the keyvault
+
         Args:
             keys (List[str]): A list containing the keys to search for in the keyvault
             prefix (str, optional): A prefix to filter keyvault keys on
 
         Returns:
-            Dict[str: Secret]: A dictionary of all secrets matching the keys and prefix, indexed on the key
+            Dict[str: str]: A dictionary of the values of all requested keys, indexed on the key
         """
-        secrets = self.get_keyvault_secrets(prefix)
-        indexed = {_.key: _ for _ in secrets}
-        return {_: self._find_secret(_, indexed) for _ in keys}
+        cache = KeyVaultSecretCache.for_vault(self.vault_name, self.vault_client)
+        available = {
+            _.databricks_secret_key: _.keyvault_id
+            for _ in self._filter_keyvault_ids(cache.secret_ids(), prefix)
+        }
+        return {_: cache.get(self._find_secret(_, available)) for _ in keys}
 
-    def _find_secret(self, secret_key, secrets: Dict[str, Secret]) -> str:
+    def _find_secret(self, secret_key, secrets: Dict[str, str]) -> str:
+        """Returns the keyvault id of the given key"""
         if secret_key not in secrets:
             raise ValueError(f"Could not find required key {secret_key}")
-        return secrets[secret_key].val
+        return secrets[secret_key]
 
-    def get_keyvault_secrets(self, prefix: Optional[str] = "") -> List[Secret]:
+    def get_keyvault_secrets(
+        self, prefix: Optional[str] = "", max_workers: int = DEFAULT_KEYVAULT_CONCURRENCY
+    ) -> List[Secret]:
         """
         Args:
             prefix (str, optional): A prefix to filter keyvault keys on. Default is the application name
+            max_workers (int, optional): The maximum number of secrets to fetch concurrently
 
         Returns:
             List[Secret]: The list of all secrets matching the prefix
         """
-        return self._retrieve_secrets(self.vault_client, self.vault_name, prefix)
+        return self._retrieve_secrets(self.vault_client, self.vault_name, prefix, max_workers)
 
     @staticmethod
     def _extract_keyvault_ids_from(secrets: List[SecretBundle]) -> List[str]:
@@ -128,16 +212,17 @@ class KeyVaultCredentialsMixin(object):
         return [IdAndKey(_, _) for _ in keyvault_ids]
 
     def _retrieve_secrets(
-        self, client: AzureKeyVaultClient, vault: str, prefix: Optional[str]
+        self,
+        client: AzureKeyVaultClient,
+        vault: str,
+        prefix: Optional[str],
+        max_workers: int = DEFAULT_KEYVAULT_CONCURRENCY,
     ) -> List[Secret]:
-        secrets = list(client.get_secrets(vault))
-        secrets_ids = self._extract_keyvault_ids_from(secrets)
-        secrets_filtered = self._filter_keyvault_ids(secrets_ids, prefix)
-
-        app_secrets = [
-            Secret(_.databricks_secret_key, client.get_secret(vault, _.keyvault_id, "").value)
-            for _ in secrets_filtered
-        ]
+        cache = KeyVaultSecretCache.for_vault(vault, client)
+        secrets_filtered = self._filter_keyvault_ids(cache.secret_ids(), prefix)
+        values = cache.get_many([_.keyvault_id for _ in secrets_filtered], max_workers)
+
+        app_secrets = [Secret(_.databricks_secret_key, value) for _, value in zip(secrets_filtered, values)]
 
         return app_secrets
 
@@ -1,12 +1,30 @@
+from typing import Optional
+
 from azure.storage.blob import BlockBlobService
 
 from takeoff.azure.credentials.keyvault_credentials_provider import KeyVaultCredentialsMixin
+from takeoff.credentials.client_pool import ClientPool
+from takeoff.tracing import traced
 from takeoff.util import current_filename
 
 
 class BlobStore(KeyVaultCredentialsMixin):
-    def service_client(self, config: dict) -> BlockBlobService:
-        credential_kwargs = super()._transform_key_to_credential_kwargs(
-            config["azure"]["keyvault_keys"][current_filename(__file__)]
-        )
-        return BlockBlobService(**credential_kwargs)
+    def service_client(self, config: dict, block_size_mb: Optional[int] = None) -> BlockBlobService:
+        """The storage account client, shared by all steps of the run
+
+        Args:
+            config: The Takeoff configuration
+            block_size_mb: Size of the blocks to upload large files in. Clients with different block sizes
+                are separate, so that setting it does not affect uploads with another block size.
+        """
+        def create():
+            credential_kwargs = self._transform_key_to_credential_kwargs(
+                config["azure"]["keyvault_keys"][current_filename(__file__)]
+            )
+            client = BlockBlobService(**credential_kwargs)
+            if block_size_mb:
+                client.MAX_BLOCK_SIZE = block_size_mb * 1024 * 1024
+                client.MAX_SINGLE_PUT_SIZE = client.MAX_BLOCK_SIZE
+            return traced(client, "storage")
+
+        return ClientPool().get((self.vault_name, "storage_account", block_size_mb), create)
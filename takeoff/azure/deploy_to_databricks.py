@@ -2,23 +2,44 @@ import json
 import logging
 import pprint
 import re
-from dataclasses import dataclass
-from typing import List, Optional
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
 import voluptuous as vol
 from databricks_cli.jobs.api import JobsApi
 from databricks_cli.runs.api import RunsApi
+from databricks_cli.sdk import ApiClient
 
 from takeoff import util
 from takeoff.application_version import ApplicationVersion
 from takeoff.azure.credentials.databricks import Databricks
 from takeoff.azure.credentials.keyvault import KeyVaultClient
+from takeoff.context import Context, ContextKey
 from takeoff.schemas import TAKEOFF_BASE_SCHEMA
 from takeoff.step import Step
-from takeoff.util import has_prefix_match, get_whl_name, get_main_py_name
+from takeoff.tracing import Tracer
+from takeoff.util import call_with_retries, get_jar_name, get_main_py_name, get_whl_name, http_status_code
 
 logger = logging.getLogger(__name__)
 
+JOB_PAGE_SIZE = 25
+RUN_PAGE_SIZE = 25
+TERMINAL_LIFE_CYCLE_STATES = ("TERMINATED", "SKIPPED", "INTERNAL_ERROR")
+# seconds between polls for cancelled runs to terminate, doubled after every poll up to the maximum
+CANCEL_POLL_SECONDS = 1.0
+CANCEL_MAX_POLL_SECONDS = 16.0
+# polls for a new run to start are at most this far apart, so the measured downtime is accurate
+STARTUP_MAX_POLL_SECONDS = 4.0
+SNAPSHOT_SUFFIX = "SNAPSHOT"
+VERSION_SUFFIX = re.compile(r"\d+\.\d+\.\d+")
+# settings the workspace adds to a job when they are not given, ignored when comparing settings
+DEFAULT_JOB_SETTINGS = {"email_notifications": {}, "max_concurrent_runs": 1, "timeout_seconds": 0}
+# settings the workspace adds to a job with a value of its own choosing, ignored when comparing settings
+WORKSPACE_JOB_SETTINGS = frozenset({"format"})
+
 SCHEMA = TAKEOFF_BASE_SCHEMA.extend(
     {
         vol.Required("task"): "deploy_to_databricks",
@@ -38,6 +59,39 @@ SCHEMA = TAKEOFF_BASE_SCHEMA.extend(
             ],
             vol.Length(min=1),
         ),
+        vol.Optional(
+            "update_mode",
+            default="recreate",
+            description=(
+                "`recreate` replaces jobs by new jobs, `reset` updates the settings of the job with the same "
+                "name in place"
+            ),
+        ): vol.All(str, vol.In(["recreate", "reset"])),
+        vol.Optional(
+            "cancel_timeout_seconds",
+            default=600,
+            description="Seconds to wait for the cancelled runs of a streaming job to terminate",
+        ): vol.All(int, vol.Range(min=0)),
+        vol.Optional("switchover", default={}): {
+            vol.Optional(
+                "enabled",
+                default=False,
+                description=(
+                    "Create the new version of a streaming job before its old runs are cancelled, and "
+                    "start it right after"
+                ),
+            ): bool,
+            vol.Optional(
+                "start_timeout_seconds",
+                default=1200,
+                description="Seconds to wait for the new run of a streaming job to be running",
+            ): vol.All(int, vol.Range(min=0)),
+        },
+        vol.Optional(
+            "max_parallel_jobs",
+            default=4,
+            description="Number of jobs to deploy at the same time, to stay within the API rate limits",
+        ): vol.All(int, vol.Range(min=1)),
         "common": {vol.Optional("databricks_fs_libraries_mount_path"): str},
     },
     extra=vol.ALLOW_EXTRA,
@@ -50,13 +104,142 @@ class JobConfig(object):
     job_id: int
 
 
+class JobIndex(object):
+    """The jobs in the Databricks workspace, by application name and version suffix
+
+    Jobs are named `{application name}-{suffix}`, where the suffix is `SNAPSHOT`, a version or a branch.
+    Both application names and branches may contain dashes, so a job is indexed under every way its name
+    can be split in two at a dash. The jobs are listed once, when the index is first used, and the index
+    is kept up to date as jobs are created and deleted. It can be used from several threads at once.
+
+    Args:
+        api_client: The client to list the jobs of the workspace with
+    """
+
+    def __init__(self, api_client: Optional[ApiClient] = None):
+        self.api_client = api_client
+        self._jobs: Optional[Dict[str, Dict[str, List[int]]]] = None
+        self._names: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def of(jobs: List[JobConfig]) -> "JobIndex":
+        """Builds an index of the given jobs, instead of the jobs in the workspace"""
+        index = JobIndex()
+        index._jobs = {}
+        for job in jobs:
+            index._add(index._jobs, job)
+        return index
+
+    def _list_jobs(self) -> Iterator[JobConfig]:
+        """Lists all jobs in the workspace, a page at a time"""
+        api_client = self.api_client
+        if api_client is None:
+            raise ValueError("An index built from a list of jobs cannot list the workspace")
+        offset = 0
+        while True:
+            page = call_with_retries(
+                lambda: api_client.perform_query(
+                    "GET", "/jobs/list", data={"offset": offset, "limit": JOB_PAGE_SIZE}
+                )
+            )
+            jobs = page.get("jobs", [])
+            for job in jobs:
+                yield JobConfig(job["settings"]["name"], job["job_id"])
+            # workspaces that do not paginate return all jobs, without `has_more`
+            if not page.get("has_more") or not jobs:
+                return
+            offset += len(jobs)
+
+    def _load(self) -> Dict[str, Dict[str, List[int]]]:
+        if self._jobs is None:
+            jobs: Dict[str, Dict[str, List[int]]] = {}
+            for job in self._list_jobs():
+                self._add(jobs, job)
+            # only set once all pages are listed, so a failed listing is retried by the next lookup
+            self._jobs = jobs
+            logger.info(f"Indexed {len(self._names)} Databricks jobs")
+        return self._jobs
+
+    @staticmethod
+    def _splits(name: str) -> Iterator[Tuple[str, str]]:
+        for i, character in enumerate(name):
+            if character == "-":
+                yield name[:i], name[i + 1:]
+
+    def _add(self, index: Dict[str, Dict[str, List[int]]], job: JobConfig):
+        self._names[job.job_id] = job.name
+        for application_name, suffix in self._splits(job.name):
+            index.setdefault(application_name, {}).setdefault(suffix, []).append(job.job_id)
+
+    def add(self, job: JobConfig):
+        """Adds a job that was created. Does nothing when the jobs have not been listed yet, as the
+        listing will include it."""
+        with self._lock:
+            if self._jobs is not None:
+                self._add(self._jobs, job)
+
+    def remove(self, job_id: int):
+        """Removes a job that was deleted"""
+        with self._lock:
+            name = self._names.pop(job_id, None)
+            if self._jobs is None or name is None:
+                return
+            for application_name, suffix in self._splits(name):
+                self._jobs[application_name][suffix].remove(job_id)
+
+    def named(self, name: str) -> List[int]:
+        """The ids of the jobs with exactly this name, in ascending order"""
+        application_name, _, suffix = name.partition("-")
+        with self._lock:
+            return sorted(self._load().get(application_name, {}).get(suffix, []))
+
+    def find(self, application_name: str, branch: str) -> List[int]:
+        """The ids of the jobs of an application with a `SNAPSHOT`, version or `branch` suffix
+
+        Args:
+            application_name: The name of the application, including the postfix of the job
+            branch: The branch or tag that is deployed
+
+        Returns:
+            The ids of the jobs, in ascending order
+        """
+        with self._lock:
+            suffixes = self._load().get(application_name, {})
+            return sorted(
+                job_id
+                for suffix, job_ids in suffixes.items()
+                if suffix in (SNAPSHOT_SUFFIX, branch) or VERSION_SUFFIX.fullmatch(suffix)
+                for job_id in job_ids
+            )
+
+
+@dataclass
+class JobDeployment(object):
+    name: str
+    job_id: Optional[int] = None
+    removed_job_ids: List[int] = field(default_factory=list)
+    started_run: bool = False
+    error: Optional[Exception] = None
+    action: str = "created"
+
+
+def _is_throttled(error: Exception) -> bool:
+    """Whether the workspace API rejected a request because of its rate limit. Requests that create jobs
+    or runs are only retried then, as a server error does not tell whether they were carried out."""
+    return http_status_code(error) == 429
+
+
 class DeployToDatabricks(Step):
+    consumes = frozenset({ContextKey.PUBLISHED_ARTIFACTS})
+
     def __init__(self, env: ApplicationVersion, config: dict):
         super().__init__(env, config)
         self.vault_name, self.vault_client = KeyVaultClient.vault_and_client(self.config, self.env)
         self.databricks_client = Databricks(self.vault_name, self.vault_client).api_client(self.config)
         self.jobs_api = JobsApi(self.databricks_client)
         self.runs_api = RunsApi(self.databricks_client)
+        self.job_index = JobIndex(self.databricks_client)
 
     def schema(self) -> vol.Schema:
         return SCHEMA
@@ -74,26 +257,248 @@ class DeployToDatabricks(Step):
         """
         return "schedule" not in job_config.keys()
 
-    def deploy_to_databricks(self):
+    def deploy_to_databricks(self) -> List[JobDeployment]:
         """
         The application parameters (cosmos and eventhub) will be removed from this file as they
         will be set as databricks secrets eventually
         If the job is a streaming job this will directly start the new job_run given the new
         configuration. If the job is batch this will not start it manually, assuming the schedule
         has been set correctly.
+
+        The jobs are deployed at the same time, at most `max_parallel_jobs` at once. All jobs are
+        deployed, after which the jobs that could not be deployed are reported together.
+
+        Raises:
+           ChildProcessError if any of the jobs could not be deployed
+        """
+        jobs = self.config["jobs"]
+        max_workers = min(self.config["max_parallel_jobs"], len(jobs))
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="databricks") as pool:
+            deployments = list(pool.map(self._deploy_job_safely, jobs))
+
+        self._report(deployments)
+        failed = [_ for _ in deployments if _.error]
+        if failed:
+            raise ChildProcessError(
+                f"Could not deploy {', '.join(_.name for _ in failed)} to Databricks"
+            ) from failed[0].error
+        return deployments
+
+    def _deploy_job_safely(self, job: dict) -> JobDeployment:
+        try:
+            return self.deploy_job(job)
+        except Exception as e:
+            logger.error(f"Deploying {self._construct_name(job['name'])} failed: {e}")
+            return JobDeployment(self._construct_name(job["name"]), error=e)
+
+    def deploy_job(self, job: dict) -> JobDeployment:
+        """Replaces the existing versions of a job by the new version
+
+        With `update_mode: reset`, a job with the same name is updated in place instead, keeping its id
+        and run history.
+
+        Args:
+            job: The configuration of the job in the deployment
+
+        Returns:
+            The job that was created or updated and the jobs that were removed
+        """
+        app_name = self._construct_name(job["name"])
+        job_name = f"{app_name}-{self.env.artifact_tag}"
+        job_config = self.create_config(job_name, job)
+        is_streaming = self._job_is_streaming(job_config)
+
+        if self.config["update_mode"] == "reset":
+            existing_job_ids = self.job_index.named(job_name)
+            if existing_job_ids:
+                return self.update_job(existing_job_ids[0], job, job_name, job_config, is_streaming)
+
+        if is_streaming and self.config["switchover"]["enabled"]:
+            return self.switch_over(job, job_name, job_config)
+
+        logger.info(f"Removing old job for {job_name}")
+        removed_job_ids = self.remove_job(self.env.artifact_tag, job_config=job, is_streaming=is_streaming)
+
+        logger.info(f"Submitting new job {job_name} with configuration:")
+        logger.info(pprint.pformat(job_config))
+        job_id = self._submit_job(job_config, is_streaming)
+        return JobDeployment(job_name, job_id, removed_job_ids or [], is_streaming)
+
+    def switch_over(self, job: dict, job_name: str, job_config: dict) -> JobDeployment:
+        """Replaces a streaming job by its new version, keeping the time the stream is down short
+
+        The new job is created while the old runs are still processing. Right after the old runs are
+        cancelled the new run is started, so that its cluster starts while the old runs shut down. The
+        time from cancelling the old runs until the new run is running is logged as the downtime. The
+        old jobs are removed once the new run is running.
+
+        Args:
+            job: The configuration of the job in the deployment
+            job_name: The name of the job
+            job_config: The rendered settings of the job
+
+        Returns:
+            The job that was created and the jobs that were removed
+
+        Raises:
+           ChildProcessError if the old runs did not terminate, or the new run did not start, in time. When
+           the old runs did not terminate, the new run is cancelled.
         """
-        for job in self.config["jobs"]:
-            app_name = self._construct_name(job["name"])
-            job_name = f"{app_name}-{self.env.artifact_tag}"
-            job_config = self.create_config(job_name, job)
-            is_streaming = self._job_is_streaming(job_config)
+        logger.info(f"Creating new job {job_name} with configuration:")
+        logger.info(pprint.pformat(job_config))
+        job_id = self._submit_job(job_config, is_streaming=False)
+
+        application_name = self._construct_name(job["name"])
+        old_job_ids = [_ for _ in self.job_index.find(application_name, self.env.artifact_tag) if _ != job_id]
+        old_run_ids = [run_id for old_job_id in old_job_ids for run_id in self._active_run_ids(old_job_id)]
+
+        with Tracer().span(f"switch over to job {job_id}", "databricks") as span:
+            stopped = time.monotonic()
+            self._cancel_runs(old_run_ids)
+            run_id = self._start_run(job_id)
+            try:
+                self._wait_for_termination(", ".join(str(_) for _ in old_job_ids), old_run_ids)
+            except ChildProcessError as e:
+                raise self._abort_switch_over(job_id, run_id, e) from e
+            span["stop_seconds"] = time.monotonic() - stopped
+            self._wait_for_start(job_id, run_id)
+            span["downtime_seconds"] = time.monotonic() - stopped
+            span["runs"] = len(old_run_ids)
+
+        logger.info(
+            f"Switched {job_name} over to run {run_id}: the old runs terminated after "
+            f"{span['stop_seconds']:.1f}s, the stream was down for {span['downtime_seconds']:.1f}s"
+        )
+        removed_job_ids = self.remove_job(self.env.artifact_tag, job, is_streaming=False, keep=job_id)
+        return JobDeployment(job_name, job_id, removed_job_ids, True)
+
+    def _abort_switch_over(self, job_id: int, run_id: int, error: ChildProcessError) -> ChildProcessError:
+        """Cancels the new run when the old runs did not terminate, as they would share the checkpoint
 
-            logger.info("Removing old job")
-            self.remove_job(self.env.artifact_tag, job_config=job, is_streaming=is_streaming)
+        Returns:
+            The error to raise, naming both the old runs and the new run
+        """
+        try:
+            self._cancel_run(run_id)
+            outcome = "was cancelled"
+        except Exception as e:
+            logger.error(f"Could not cancel run {run_id} of job {job_id}: {e}")
+            outcome = "could not be cancelled and is still running"
+        return ChildProcessError(f"{error}; the new run {run_id} of job {job_id} {outcome}")
+
+    def update_job(
+        self, job_id: int, job: dict, job_name: str, job_config: dict, is_streaming: bool
+    ) -> JobDeployment:
+        """Updates the settings of an existing job in place, when they changed
+
+        A streaming job is only restarted when its settings or its artifacts changed, or when it is not
+        running.
+
+        Args:
+            job_id: The id of the job to update
+            job: The configuration of the job in the deployment
+            job_name: The name of the job
+            job_config: The rendered settings of the job
+            is_streaming: Whether the job is a streaming job
+
+        Returns:
+            The updated job and the other versions of the job that were removed
+        """
+        logger.info(f"Removing old versions of {job_name}, except job {job_id}")
+        removed_job_ids = self.remove_job(self.env.artifact_tag, job, is_streaming, keep=job_id)
 
-            logger.info("Submitting new job with configuration:")
+        current_settings = call_with_retries(lambda: self.jobs_api.get_job(job_id))["settings"]
+        changed = not self._settings_equal(job_config, current_settings)
+        if changed:
+            logger.info(f"Updating Job with ID {job_id} with configuration:")
             logger.info(pprint.pformat(job_config))
-            self._submit_job(job_config, is_streaming)
+            call_with_retries(lambda: self.jobs_api.reset_job({"job_id": job_id, "new_settings": job_config}))
+        else:
+            logger.info(f"Settings of Job with ID {job_id} did not change")
+
+        started_run = False
+        if is_streaming:
+            if changed or self._artifacts_changed(job):
+                self._kill_it_with_fire(job_id)
+                self._start_run(job_id)
+                started_run = True
+            elif not self._active_run_ids(job_id):
+                logger.info(f"Job with ID {job_id} is not running")
+                self._start_run(job_id)
+                started_run = True
+        return JobDeployment(
+            job_name, job_id, removed_job_ids, started_run, action="updated" if changed else "unchanged"
+        )
+
+    @staticmethod
+    def _settings_equal(new_settings: dict, current_settings: dict) -> bool:
+        """Whether resetting the job to the new settings would change it. A reset replaces all settings,
+        so settings missing from the new settings count as a change, unless the workspace adds them
+        itself. Within `new_cluster`, only the keys of the new settings are compared, as the workspace
+        fills in defaults for the rest of the cluster configuration."""
+        def added_by_workspace(key: str, value: Any) -> bool:
+            if key in new_settings:
+                return False
+            if key in WORKSPACE_JOB_SETTINGS:
+                return True
+            return key in DEFAULT_JOB_SETTINGS and DEFAULT_JOB_SETTINGS[key] == value
+
+        current = {k: v for k, v in current_settings.items() if not added_by_workspace(k, v)}
+        if current.keys() != new_settings.keys():
+            return False
+        return all(
+            DeployToDatabricks._contains(v, current[k]) if k == "new_cluster" else v == current[k]
+            for k, v in new_settings.items()
+        )
+
+    @staticmethod
+    def _contains(new: Any, current: Any) -> bool:
+        """Whether the current value has all keys of the new value, with the same values"""
+        if isinstance(new, dict):
+            return isinstance(current, dict) and all(
+                k in current and DeployToDatabricks._contains(v, current[k]) for k, v in new.items()
+            )
+        if isinstance(new, list):
+            if not isinstance(current, list) or len(new) != len(current):
+                return False
+            return all(DeployToDatabricks._contains(n, c) for n, c in zip(new, current))
+        return new == current
+
+    def _artifacts_changed(self, job: dict) -> bool:
+        """Whether the artifacts of the job were changed by `publish_artifact` in this run. When they were
+        not published in this run, they are assumed to have changed."""
+        published = Context().get(ContextKey.PUBLISHED_ARTIFACTS)
+        if published is None:
+            return True
+        if job["lang"] == "python":
+            artifacts = [
+                get_whl_name(self.application_name, self.env.artifact_tag, ".whl"),
+                get_main_py_name(self.application_name, self.env.artifact_tag, ".py"),
+            ]
+        else:
+            artifacts = [get_jar_name(self.application_name, self.env.artifact_tag, ".jar")]
+        return any(published.get(_, True) for _ in artifacts)
+
+    @staticmethod
+    def _report(deployments: List[JobDeployment]):
+        for deployment in deployments:
+            if deployment.error:
+                logger.error(f"{deployment.name}: failed with {deployment.error}")
+            else:
+                logger.info(
+                    f"{deployment.name}: {deployment.action} job {deployment.job_id}"
+                    f"{' and started a run' if deployment.started_run else ''}, "
+                    f"removed jobs {deployment.removed_job_ids}"
+                )
+        succeeded = [_ for _ in deployments if not _.error]
+        actions = [_.action for _ in succeeded]
+        logger.info(
+            f"Created {actions.count('created')} jobs, "
+            f"updated {actions.count('updated')} jobs, "
+            f"left {actions.count('unchanged')} jobs unchanged, "
+            f"removed {sum(len(_.removed_job_ids) for _ in succeeded)} jobs, "
+            f"{len(deployments) - len(succeeded)} jobs failed"
+        )
 
     def create_config(self, job_name: str, job_config: dict):
         common_arguments = dict(
@@ -150,56 +555,190 @@ class DeployToDatabricks(Step):
     def _construct_job_config(config_file: str, **kwargs) -> dict:
         return util.render_file_with_jinja(config_file, kwargs, json.loads)
 
-    def remove_job(self, branch: str, job_config: dict, is_streaming: bool):
+    def remove_job(
+        self, branch: str, job_config: dict, is_streaming: bool, keep: Optional[int] = None
+    ) -> List[int]:
         """
         Removes the existing job and cancels any running job_run if the application is streaming.
         If the application is batch, it'll let the batch job finish but it will remove the job,
         making sure no other job_runs can start for that old job.
-        """
 
-        job_configs = [
-            JobConfig(_["settings"]["name"], _["job_id"]) for _ in self.jobs_api.list_jobs()["jobs"]
-        ]
-        job_ids = self._application_job_id(self._construct_name(job_config["name"]), branch, job_configs)
+        Args:
+            keep: The id of a job that is updated in place, and must not be removed
+
+        Returns:
+            The ids of the removed jobs
+        """
+        application_name = self._construct_name(job_config["name"])
+        job_ids = [_ for _ in self.job_index.find(application_name, branch) if _ != keep]
 
         if not job_ids:
-            logger.info(f"Could not find jobs in list of {pprint.pformat(job_configs)}")
+            logger.info(f"Could not find jobs of {application_name}")
 
         for job_id in job_ids:
             logger.info(f"Found Job with ID {job_id}")
             if is_streaming:
                 self._kill_it_with_fire(job_id)
             logger.info(f"Deleting Job with ID {job_id}")
-            self.jobs_api.delete_job(job_id)
+            call_with_retries(lambda: self.jobs_api.delete_job(job_id))
+            self.job_index.remove(job_id)
+        return job_ids
 
     @staticmethod
     def _application_job_id(application_name: str, branch: str, jobs: List[JobConfig]) -> List[int]:
-        snapshot = "SNAPSHOT"
-        tag = "\d+\.\d+\.\d+"
-        pattern = re.compile(rf"^({application_name})-({snapshot}|{tag}|{branch})$")
+        return JobIndex.of(jobs).find(application_name, branch)
 
-        return [_.job_id for _ in jobs if has_prefix_match(_.name, application_name, pattern)]
+    def _active_run_ids(self, job_id) -> List[int]:
+        """The ids of all active runs of a job, listed a page at a time"""
+        logger.info(f"Finding runs for job_id {job_id}")
+        run_ids: List[int] = []
+        offset = 0
+        while True:
+            page = call_with_retries(
+                lambda: self.runs_api.list_runs(
+                    job_id, active_only=True, completed_only=None, offset=offset, limit=RUN_PAGE_SIZE
+                )
+            )
+            # If the runs is empty, there are no jobs at all
+            runs = page.get("runs", [])
+            run_ids.extend(_["run_id"] for _ in runs)
+            if not page.get("has_more") or not runs:
+                return run_ids
+            offset += len(runs)
 
     def _kill_it_with_fire(self, job_id):
-        logger.info(f"Finding runs for job_id {job_id}")
-        runs = self.runs_api.list_runs(job_id, active_only=True, completed_only=None, offset=None, limit=None)
-        # If the runs is empty, there are no jobs at all
-        # TODO: Check if the has_more flag is true, this means we need to go over the pages
-        if "runs" in runs:
-            active_run_ids = [_["run_id"] for _ in runs["runs"]]
-            logger.info(f"Canceling active runs {active_run_ids}")
-            [self.runs_api.cancel_run(_) for _ in active_run_ids]
-
-    def _submit_job(self, job_config: dict, is_streaming: bool):
-        job_resp = self.jobs_api.create_job(job_config)
+        """Cancels all active runs of a job, and waits until they have terminated
+
+        A new run of a streaming job must not start while an old run still holds its checkpoint.
+
+        Raises:
+           ChildProcessError if the runs did not terminate within `cancel_timeout_seconds`
+        """
+        with Tracer().span(f"cancel runs of job {job_id}", "databricks") as span:
+            start = time.monotonic()
+            active_run_ids = self._active_run_ids(job_id)
+            span["runs"] = len(active_run_ids)
+            if not active_run_ids:
+                return
+
+            self._cancel_runs(active_run_ids)
+            cancelled = time.monotonic()
+
+            span["polls"] = self._wait_for_termination(job_id, active_run_ids)
+            span["cancel_seconds"] = cancelled - start
+            span["wait_seconds"] = time.monotonic() - cancelled
+
+        logger.info(
+            f"Canceled {len(active_run_ids)} runs of job {job_id} in {span['cancel_seconds']:.1f}s, "
+            f"they terminated {span['wait_seconds']:.1f}s later"
+        )
+
+    def _cancel_runs(self, run_ids: List[int]):
+        if not run_ids:
+            return
+        logger.info(f"Canceling active runs {run_ids}")
+        max_workers = min(self.config["max_parallel_jobs"], len(run_ids))
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="databricks-cancel") as pool:
+            list(pool.map(self._cancel_run, run_ids))
+
+    def _cancel_run(self, run_id: int):
+        call_with_retries(lambda: self.runs_api.cancel_run(run_id))
+
+    def _life_cycle_state(self, run_id: int) -> str:
+        return call_with_retries(lambda: self.runs_api.get_run(run_id))["state"]["life_cycle_state"]
+
+    def _wait_for_termination(self, job_id, run_ids: List[int]) -> int:
+        """Polls the runs until all have terminated
+
+        Returns:
+            The number of polls
+        """
+        return self._wait_for_runs(
+            run_ids,
+            lambda run_id: self._life_cycle_state(run_id) in TERMINAL_LIFE_CYCLE_STATES,
+            self.config["cancel_timeout_seconds"],
+            f"of job {job_id} did not terminate",
+        )
+
+    def _wait_for_start(self, job_id: int, run_id: int) -> int:
+        """Polls a run until it is running
+
+        Returns:
+            The number of polls
+
+        Raises:
+           ChildProcessError if the run terminated before it was running
+        """
+
+        def running(run_id: int) -> bool:
+            state = self._life_cycle_state(run_id)
+            if state in TERMINAL_LIFE_CYCLE_STATES:
+                raise ChildProcessError(
+                    f"Run {run_id} of job {job_id} ended with {state} before it was running"
+                )
+            return state == "RUNNING"
+
+        return self._wait_for_runs(
+            [run_id],
+            running,
+            self.config["switchover"]["start_timeout_seconds"],
+            f"of job {job_id} did not start",
+            max_delay=STARTUP_MAX_POLL_SECONDS,
+        )
+
+    @staticmethod
+    def _wait_for_runs(
+        run_ids: List[int],
+        done: Callable[[int], bool],
+        timeout: int,
+        failure: str,
+        max_delay: float = CANCEL_MAX_POLL_SECONDS,
+    ) -> int:
+        """Polls runs until they are done, waiting longer after every poll
+
+        Args:
+            run_ids: The runs to poll
+            done: Whether a run is done
+            timeout: The number of seconds to wait for all runs to be done
+            failure: What happened when the runs are not done in time, for the error message
+            max_delay: The maximum number of seconds between polls
+
+        Returns:
+            The number of polls
+        """
+        deadline = time.monotonic() + timeout
+        delay = CANCEL_POLL_SECONDS
+        polls = 0
+        while True:
+            polls += 1
+            run_ids = [_ for _ in run_ids if not done(_)]
+            if not run_ids:
+                return polls
+            now = time.monotonic()
+            if now >= deadline:
+                raise ChildProcessError(f"Runs {run_ids} {failure} within {timeout} seconds")
+            time.sleep(min(delay, deadline - now))
+            delay = min(delay * 2, max_delay)
+
+    def _submit_job(self, job_config: dict, is_streaming: bool) -> int:
+        job_resp = call_with_retries(lambda: self.jobs_api.create_job(job_config), _is_throttled)
         logger.info(f"Created Job with ID {job_resp['job_id']}")
+        self.job_index.add(JobConfig(job_config.get("name", ""), job_resp["job_id"]))
 
         if is_streaming:
-            resp = self.jobs_api.run_now(
-                job_id=job_resp["job_id"],
+            self._start_run(job_resp["job_id"])
+        return job_resp["job_id"]
+
+    def _start_run(self, job_id: int) -> int:
+        resp = call_with_retries(
+            lambda: self.jobs_api.run_now(
+                job_id=job_id,
                 jar_params=None,
                 notebook_params=None,
                 python_params=None,
                 spark_submit_params=None,
-            )
-            logger.info(f"Created run with ID {resp['run_id']}")
+            ),
+            _is_throttled,
+        )
+        logger.info(f"Created run with ID {resp['run_id']}")
+        return resp["run_id"]
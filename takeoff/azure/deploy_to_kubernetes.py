@@ -14,7 +14,10 @@ from kubernetes.client import CoreV1Api
 from takeoff.application_version import ApplicationVersion
 from takeoff.azure.credentials.active_directory_user import ActiveDirectoryUserCredentials
 from takeoff.azure.credentials.keyvault import KeyVaultClient
-from takeoff.azure.credentials.keyvault_credentials_provider import KeyVaultCredentialsMixin
+from takeoff.azure.credentials.keyvault_credentials_provider import (
+    DEFAULT_KEYVAULT_CONCURRENCY,
+    KeyVaultCredentialsMixin,
+)
 from takeoff.azure.credentials.subscription_id import SubscriptionId
 from takeoff.azure.util import get_resource_group_name, get_kubernetes_name
 from takeoff.context import Context, ContextKey
@@ -22,6 +25,7 @@ from takeoff.credentials.container_registry import DockerRegistry
 from takeoff.credentials.secret import Secret
 from takeoff.schemas import TAKEOFF_BASE_SCHEMA
 from takeoff.step import Step
+from takeoff.tracing import traced
 from takeoff.util import b64_encode, ensure_base64, render_string_with_jinja, run_shell_command
 
 logger = logging.getLogger(__name__)
@@ -69,10 +73,9 @@ class BaseKubernetes(Step):
             vault_name=self.vault_name, vault_client=self.vault_client
         ).credentials(self.config)
 
-        client = ContainerServiceClient(
-            credentials=credentials,
-            subscription_id=SubscriptionId(self.vault_name, self.vault_client).subscription_id(self.config),
-        )
+        subscription_id = SubscriptionId(self.vault_name, self.vault_client).subscription_id(self.config)
+        client = ContainerServiceClient(credentials=credentials, subscription_id=subscription_id)
+        client = traced(client, "containerservice")
 
         # authenticate with Kubernetes
         credential_results = client.managed_clusters.list_cluster_user_credentials(
@@ -118,11 +121,15 @@ DEPLOY_SCHEMA = TAKEOFF_BASE_SCHEMA.extend(
 class DeployToKubernetes(BaseKubernetes):
     """Deploys or updates deployments and services to/on a Kubernetes cluster"""
 
+    consumes = frozenset(
+        {ContextKey.EVENTHUB_PRODUCER_POLICY_SECRETS, ContextKey.EVENTHUB_CONSUMER_GROUP_SECRETS}
+    )
+
     def __init__(self, env: ApplicationVersion, config: dict):
         super().__init__(env, config)
 
         self.vault_name, self.vault_client = KeyVaultClient.vault_and_client(self.config, self.env)
-        self.core_v1_api = CoreV1Api()
+        self.core_v1_api = traced(CoreV1Api(), "kubernetes")
 
     def schema(self) -> vol.Schema:
         return DEPLOY_SCHEMA
@@ -288,7 +295,8 @@ class DeployToKubernetes(BaseKubernetes):
             logger.info("Docker registry secret available")
 
         secrets = KeyVaultCredentialsMixin(self.vault_name, self.vault_client).get_keyvault_secrets(
-            self.application_name
+            self.application_name,
+            self.config["azure"].get("keyvault_concurrency", DEFAULT_KEYVAULT_CONCURRENCY),
         )
 
         custom_values = self._get_custom_values()
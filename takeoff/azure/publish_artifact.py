@@ -1,20 +1,38 @@
+import base64
 import glob
+import hashlib
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Tuple
 
 import voluptuous as vol
-from azure.storage.blob import BlockBlobService
+from azure.common import AzureMissingResourceHttpError
+from azure.storage.blob import BlockBlobService, ContentSettings
 from twine.commands.upload import upload
 
 from takeoff.application_version import ApplicationVersion
 from takeoff.azure.credentials.artifact_store import ArtifactStore
 from takeoff.azure.credentials.keyvault import KeyVaultClient
 from takeoff.azure.credentials.storage_account import BlobStore
+from takeoff.context import Context, ContextKey
+from takeoff.sbt import SBT_SCHEMA, Sbt
 from takeoff.schemas import TAKEOFF_BASE_SCHEMA
 from takeoff.step import Step
-from takeoff.util import get_tag, get_whl_name, get_main_py_name, get_jar_name, run_shell_command
+from takeoff.util import (
+    get_jar_name,
+    get_main_py_name,
+    get_tag,
+    get_whl_name,
+    output_prefix,
+    run_shell_command,
+)
 
 logger = logging.getLogger(__name__)
 
+_published_artifacts_lock = threading.Lock()
+
 
 def language_must_match_target(fields):
     """Checks if incompatible lang/targets are used.
@@ -47,6 +65,20 @@ SCHEMA = vol.All(
                         "that serves as entrypoint for a databricks job"
                     ),
                 ): str,
+                vol.Optional("sbt", default={}): SBT_SCHEMA,
+                vol.Optional("cloud_storage", default={}): {
+                    vol.Optional(
+                        "skip_unchanged",
+                        default=True,
+                        description="Do not upload artifacts whose MD5 hash matches the existing blob",
+                    ): bool,
+                    vol.Optional(
+                        "max_connections", default=4, description="Number of blocks to upload at once"
+                    ): vol.All(int, vol.Range(min=1)),
+                    vol.Optional(
+                        "block_size_mb", default=8, description="Size of the blocks to upload large files in"
+                    ): vol.All(int, vol.Range(min=1, max=100)),
+                },
                 "azure": vol.All(
                     {
                         "common": {
@@ -75,6 +107,8 @@ class PublishArtifact(Step):
     as (account_name, account_key) or (sas_token).
     """
 
+    produces = frozenset({ContextKey.PUBLISHED_ARTIFACTS})
+
     def __init__(self, env: ApplicationVersion, config: dict):
         super().__init__(env, config)
         self.vault_name, self.vault_client = KeyVaultClient.vault_and_client(self.config, self.env)
@@ -121,28 +155,85 @@ class PublishArtifact(Step):
 
     def publish_python_package(self):
         """Publishes the Python wheel to all specified targets"""
-        for target in self.config["target"]:
-            if target == "pypi":
-                self.publish_to_pypi()
-            elif target == "cloud_storage":
-                self.upload_to_cloud_storage(file=self._get_wheel(), file_extension=".whl")
-                # only upload a py file if the path has been specified
-                if "python_file_path" in self.config.keys():
-                    self.upload_to_cloud_storage(
-                        file=f"{self.config['python_file_path']}", file_extension=".py"
-                    )
-            else:
-                logging.info("Invalid target for artifact")
+        self.publish_concurrently(self.config["target"], self._publish_python_target)
 
     def publish_jvm_package(self):
         """Publishes the jar to all specified targets"""
-        for target in self.config["target"]:
-            if target == "cloud_storage":
-                self.upload_to_cloud_storage(file=self._get_jar(), file_extension=".jar")
-            elif target == "ivy":
-                self.publish_to_ivy()
+        self.publish_concurrently(self.config["target"], self._publish_jvm_target)
+
+    def _publish_python_target(self, target: str):
+        if target == "pypi":
+            self.publish_to_pypi()
+        elif target == "cloud_storage":
+            uploads = [(self._get_wheel(), ".whl")]
+            # only upload a py file if the path has been specified
+            if "python_file_path" in self.config.keys():
+                uploads.append((f"{self.config['python_file_path']}", ".py"))
+            self._upload_concurrently(uploads)
+        else:
+            logging.info("Invalid target for artifact")
+
+    def _publish_jvm_target(self, target: str):
+        if target == "cloud_storage":
+            self.upload_to_cloud_storage(file=self._get_jar(), file_extension=".jar")
+        elif target == "ivy":
+            self.publish_to_ivy()
+        else:
+            logging.info("Invalid target for artifact")
+
+    def publish_concurrently(self, targets: List[str], publish: Callable[[str], None]):
+        """Publishes to all targets at the same time
+
+        The targets do not depend on each other, so a slow blob upload does not hold up `sbt publish`.
+        The output of each target is prefixed with its name. All targets run to completion, after which
+        the failed targets are reported together.
+
+        Args:
+            targets: The targets to publish to
+            publish: Publishes the artifact to a single target
+
+        Raises:
+           ChildProcessError if publishing to any of the targets was not successful
+        """
+        if len(targets) == 1:
+            publish(targets[0])
+            return
+
+        with ThreadPoolExecutor(max_workers=len(targets), thread_name_prefix="publish") as pool:
+            futures = [pool.submit(self._timed_publish, publish, target) for target in targets]
+            wait(futures)
+
+        failed = []
+        for target, future in zip(targets, futures):
+            error = future.exception()
+            if error:
+                logger.error(f"Publishing to {target} failed: {error}")
+                failed.append(target)
             else:
-                logging.info("Invalid target for artifact")
+                logger.info(f"Published to {target} in {future.result():.1f}s")
+        if failed:
+            raise ChildProcessError(f"Could not publish to {', '.join(failed)}")
+
+    @staticmethod
+    def _timed_publish(publish: Callable[[str], None], target: str) -> float:
+        start = time.monotonic()
+        with output_prefix(f"[{target}] "):
+            publish(target)
+        return time.monotonic() - start
+
+    def _upload_concurrently(self, uploads: List[Tuple[str, str]]):
+        """Uploads several files to cloud storage at the same time
+
+        Args:
+            uploads: The name and extension of each file
+        """
+        with ThreadPoolExecutor(max_workers=len(uploads), thread_name_prefix="upload") as pool:
+            futures = [
+                pool.submit(self.upload_to_cloud_storage, file=file, file_extension=extension)
+                for file, extension in uploads
+            ]
+        for future in futures:
+            future.result()
 
     def upload_to_cloud_storage(self, file: str, file_extension: str):
         """
@@ -153,7 +244,9 @@ class PublishArtifact(Step):
         Raises:
             ValueError if the filetype is not supported.
         """
-        blob_service = BlobStore(self.vault_name, self.vault_client).service_client(self.config)
+        blob_service = BlobStore(self.vault_name, self.vault_client).service_client(
+            self.config, block_size_mb=self.config["cloud_storage"]["block_size_mb"]
+        )
 
         if file_extension == ".py":
             filename = get_main_py_name(self.application_name, self.env.artifact_tag, file_extension)
@@ -164,22 +257,57 @@ class PublishArtifact(Step):
         else:
             raise ValueError(f"Unsupported filetype extension: {file_extension}")
 
-        self._upload_file_to_azure_storage_account(blob_service, file, filename)
+        changed = self._upload_file_to_azure_storage_account(blob_service, file, filename)
+        self._record_published_artifact(filename, changed)
+
+    @staticmethod
+    def _record_published_artifact(filename: str, changed: bool):
+        with _published_artifacts_lock:
+            published: Dict[str, bool] = Context().get_or_else(ContextKey.PUBLISHED_ARTIFACTS, {})
+            Context().create_or_update(ContextKey.PUBLISHED_ARTIFACTS, {**published, filename: changed})
+
+    @staticmethod
+    def _md5(path: str) -> str:
+        """The base64 encoded MD5 hash of a file, as Azure Storage reports it in `content_md5`"""
+        digest = hashlib.md5()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        return base64.b64encode(digest.digest()).decode()
+
+    @staticmethod
+    def _blob_md5(client: BlockBlobService, container: str, blob: str) -> Optional[str]:
+        try:
+            return client.get_blob_properties(container, blob).properties.content_settings.content_md5
+        except AzureMissingResourceHttpError:
+            return None
 
     def _upload_file_to_azure_storage_account(
         self, client: BlockBlobService, source: str, destination: str, container: str = None
-    ):
+    ) -> bool:
         """Upload the file to the specified Azure Storage Account.
 
         Assumption is that any cloud environment has access to a shared repository of artifacts.
+        Unless `skip_unchanged` is disabled, a blob that already has the same contents is not uploaded
+        again. Large files are uploaded in blocks of the client's block size, `max_connections` at a time.
 
         Args:
             client: Azure Storage Account client
             destination: Name of the file
             container: Name of the container the file should be uploaded to
+
+        Returns:
+            Whether the file was uploaded, false when the blob already had the same contents
         """
         if not container:
             container = self.config["azure"]["common"]["artifacts_shared_storage_account_container_name"]
+        settings = self.config["cloud_storage"]
+
+        md5 = self._md5(source)
+        if settings["skip_unchanged"] and self._blob_md5(client, container, destination) == md5:
+            logger.info(f"{destination} in container {container} is unchanged, not uploading {source}")
+            return False
+
         logger.info(
             f"""uploading artifact from
              | from ${source}
@@ -187,7 +315,14 @@ class PublishArtifact(Step):
              | in container {container}"""
         )
 
-        client.create_blob_from_path(container_name=container, blob_name=destination, file_path=source)
+        client.create_blob_from_path(
+            container_name=container,
+            blob_name=destination,
+            file_path=source,
+            content_settings=ContentSettings(content_md5=md5),
+            max_connections=settings["max_connections"],
+        )
+        return True
 
     def publish_to_pypi(self):
         """Uses `twine` to upload to PyPi"""
@@ -204,7 +339,9 @@ class PublishArtifact(Step):
 
         The jar will be build as a result of calling `sbt publish`. This means a prebuilt
         artifact is NOT required to publish to Ivy. This will be a lean jar, containing
-        only project code, no dependencies.
+        only project code, no dependencies. With `sbt.server`, this reuses the sbt server
+        started by `build_artifact`, so the project is not compiled again. The version is
+        removed from the server session afterwards.
 
         This uses bash to run commands directly.
 
@@ -213,8 +350,14 @@ class PublishArtifact(Step):
         """
         version = self.env.artifact_tag
         postfix = "-SNAPSHOT" if not get_tag() else ""
-        cmd = ["sbt", f'set version := "{version}{postfix}"', "publish"]
-        return_code, _ = run_shell_command(cmd)
+        sbt = Sbt(self.config["sbt"])
+        cmd = sbt.command(f'set version := "{version}{postfix}"', "publish")
+        try:
+            return_code, _ = run_shell_command(cmd, env=sbt.environment())
+        finally:
+            if sbt.server:
+                # `set` changes the session of the shared server; later sbt commands must not see this version
+                run_shell_command(sbt.command("session clear-all"), env=sbt.environment())
 
         if return_code != 0:
             raise ChildProcessError("Could not publish the package for some reason!")
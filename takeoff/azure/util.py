@@ -1,7 +1,7 @@
 from typing import Callable
 
 from takeoff.application_version import ApplicationVersion
-from takeoff.util import load_takeoff_plugins
+from takeoff.util import takeoff_plugin_registry
 
 
 def _get_naming_function(function_name: str, default: Callable) -> Callable:
@@ -15,10 +15,7 @@ def _get_naming_function(function_name: str, default: Callable) -> Callable:
         A function that maps the Takeoff config and application version to the resource name. If
         a plugin was found it returns that function, otherwise the `default` provided.
     """
-    for plugin in load_takeoff_plugins().values():
-        if hasattr(plugin, function_name):
-            return getattr(plugin, function_name)
-    return default
+    return takeoff_plugin_registry().hook(function_name) or default
 
 
 def default_naming(key: str) -> Callable[[dict, ApplicationVersion], str]:
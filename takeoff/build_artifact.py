@@ -1,19 +1,67 @@
+import glob
+import json
 import logging
+import os
 import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import List, Optional
 
 import voluptuous as vol
+from git import Repo
 
 from takeoff.application_version import ApplicationVersion
+from takeoff.build_cache import BuildCache, source_digest
+from takeoff.sbt import SBT_SCHEMA, Sbt
 from takeoff.schemas import TAKEOFF_BASE_SCHEMA
 from takeoff.step import Step
-from takeoff.util import run_shell_command
+from takeoff.util import output_prefix, run_shell_command
 
 logger = logging.getLogger(__name__)
 
+BUILD_TOOLS = ["python", "sbt"]
+ASSEMBLY_JARS = "target/scala-2.*/*-assembly-*.jar"
+# marks the line with the build requirements, as the build backend may print other lines as well
+BUILD_REQUIREMENTS_MARKER = "takeoff-build-requirements: "
+PRINT_BUILD_REQUIREMENTS = (
+    "import build, json; "
+    "requirements = sorted(build.ProjectBuilder('.').build_system_requires); "
+    f"print('{BUILD_REQUIREMENTS_MARKER}' + json.dumps(requirements))"
+)
+
 SCHEMA = TAKEOFF_BASE_SCHEMA.extend(
     {
         vol.Required("task"): "build_artifact",
-        vol.Required("build_tool"): vol.All(str, vol.In(["python", "sbt"])),
+        vol.Required(
+            "build_tool",
+            description="The build tool, or a list of build tools that build at the same time",
+        ): vol.Any(
+            vol.All(str, vol.In(BUILD_TOOLS)), vol.All([vol.In(BUILD_TOOLS)], vol.Length(min=1), vol.Unique())
+        ),
+        vol.Optional("python", default={}): {
+            vol.Optional(
+                "builder",
+                default="setuptools",
+                description=(
+                    "`setuptools` runs `python setup.py bdist_wheel`, `pep517` runs `python -m build` in a "
+                    "build environment that is reused between runs"
+                ),
+            ): vol.All(str, vol.In(["setuptools", "pep517"])),
+            vol.Optional(
+                "cache_dir",
+                default=None,
+                description=(
+                    "Directory to keep built wheels in, keyed on a hash of the sources and the version. "
+                    "Unchanged sources are restored from it instead of built again."
+                ),
+            ): vol.Any(None, str),
+            vol.Optional(
+                "cache_container",
+                default=None,
+                description="Blob storage container to mirror the wheel cache to, shared between runners",
+            ): vol.Any(None, str),
+        },
+        vol.Optional("sbt", default={}): SBT_SCHEMA,
     },
     extra=vol.ALLOW_EXTRA,
 )
@@ -24,12 +72,54 @@ class BuildArtifact(Step):
         """Build an artifact"""
         super().__init__(env, config)
 
+    @property
+    def build_tools(self) -> List[str]:
+        build_tool = self.config["build_tool"]
+        return [build_tool] if isinstance(build_tool, str) else build_tool
+
     def run(self):
-        if self.config["build_tool"] == "python":
+        if len(self.build_tools) == 1:
+            self.build(self.build_tools[0])
+        else:
+            self.build_concurrently(self.build_tools)
+
+    def build(self, build_tool: str):
+        if build_tool == "python":
             self.build_python_wheel()
-        elif self.config["build_tool"] == "sbt":
+        elif build_tool == "sbt":
             self.build_sbt_assembly_jar()
 
+    def build_concurrently(self, build_tools: List[str]):
+        """Runs the builds of all tools at the same time, each in its own process
+
+        Every tool writes to its own output directory, `dist/` for python and `target/` for sbt, so the
+        builds do not interfere. The output of each build is prefixed with the tool name. All builds run
+        to completion, after which the failed builds are reported together.
+
+        Raises:
+           ChildProcessError if any of the builds was not successful
+        """
+        with ThreadPoolExecutor(max_workers=len(build_tools), thread_name_prefix="build") as pool:
+            futures = [pool.submit(self._timed_build, tool) for tool in build_tools]
+            wait(futures)
+
+        failed = []
+        for tool, future in zip(build_tools, futures):
+            error = future.exception()
+            if error:
+                logger.error(f"Building {tool} failed: {error}")
+                failed.append(tool)
+            else:
+                logger.info(f"Built {tool} in {future.result():.1f}s")
+        if failed:
+            raise ChildProcessError(f"Could not build {', '.join(failed)}")
+
+    def _timed_build(self, build_tool: str) -> float:
+        start = time.monotonic()
+        with output_prefix(f"[{build_tool}] "):
+            self.build(build_tool)
+        return time.monotonic() - start
+
     def schema(self) -> vol.Schema:
         return SCHEMA
 
@@ -50,7 +140,8 @@ class BuildArtifact(Step):
     def build_python_wheel(self):
         """Builds Python wheel
 
-        This uses bash to run commands directly.
+        This uses bash to run commands directly. With a `cache_dir`, a wheel built earlier from the same
+        sources and version is restored instead.
 
         Raises:
            ChildProcessError is the bash command was not successful
@@ -58,24 +149,106 @@ class BuildArtifact(Step):
         self._write_version()
         self._remove_old_artifacts("dist/")
 
-        cmd = ["python", "setup.py", "bdist_wheel"]
+        cache = self._wheel_cache()
+        key = self._python_source_digest() if cache else ""
+        if cache and cache.restore(key, "dist/"):
+            logger.info("Sources are unchanged, not building the wheel again")
+            return
+
+        if self.config["python"]["builder"] == "pep517":
+            python = self._pep517_environment()
+            cmd = [python, "-m", "build", "--wheel", "--no-isolation", "--outdir", "dist/"]
+        else:
+            cmd = ["python", "setup.py", "bdist_wheel"]
         return_code, _ = run_shell_command(cmd)
 
         if return_code != 0:
             raise ChildProcessError("Could not build the package for some reason!")
 
+        if cache:
+            cache.store(key, sorted(glob.glob("dist/*.whl")))
+
+    def _wheel_cache(self) -> Optional[BuildCache]:
+        python_config = self.config["python"]
+        if not python_config["cache_dir"]:
+            return None
+        if not python_config["cache_container"]:
+            return BuildCache(python_config["cache_dir"])
+
+        from takeoff.azure.credentials.keyvault import KeyVaultClient
+        from takeoff.azure.credentials.storage_account import BlobStore
+
+        vault_name, vault_client = KeyVaultClient.vault_and_client(self.config, self.env)
+        blob_service = BlobStore(vault_name, vault_client).service_client(self.config)
+        return BuildCache(python_config["cache_dir"], blob_service, python_config["cache_container"])
+
+    def _python_source_digest(self) -> str:
+        """Hashes every file in the repository that is not ignored by git, the builder and the version
+
+        `version.py` is left out, as Takeoff writes the version to it on every build, and so are earlier
+        build outputs and the cache itself.
+        """
+        repo = Repo(search_parent_directories=True)
+        files = repo.git.ls_files("--cached", "--others", "--exclude-standard").splitlines()
+        cache_dir = os.path.expanduser(self.config["python"]["cache_dir"] or "dist")
+        excluded = tuple(os.path.abspath(_) + os.sep for _ in ("dist", "build", cache_dir))
+        paths: List[str] = []
+        for file in files:
+            path = os.path.join(repo.working_dir, file)
+            if os.path.basename(file) != "version.py" and not path.startswith(excluded):
+                paths.append(os.path.relpath(path))
+        paths += [_ for _ in ("setup.py", "setup.cfg", "pyproject.toml") if os.path.exists(_)]
+        return source_digest(paths, [self.config["python"]["builder"], self.env.version])
+
+    def _pep517_environment(self) -> str:
+        """Creates a virtualenv with `build` and the build requirements of the project, or reuses the one
+        created by an earlier run
+
+        Returns:
+            The path to the python executable of the environment
+        """
+        cache_dir = self.config["python"]["cache_dir"] or os.path.join("~", ".cache", "takeoff")
+        environment = os.path.join(os.path.expanduser(cache_dir), "pep517-env")
+        python = os.path.join(environment, "bin", "python")
+
+        if not os.path.exists(python):
+            logger.info(f"Creating build environment in {environment}")
+            for cmd in (["python", "-m", "venv", environment], [python, "-m", "pip", "install", "build"]):
+                return_code, _ = run_shell_command(cmd)
+                if return_code != 0:
+                    raise ChildProcessError("Could not create the build environment")
+
+        return_code, output = run_shell_command([python, "-c", PRINT_BUILD_REQUIREMENTS])
+        if return_code != 0:
+            raise ChildProcessError("Could not read the build requirements from pyproject.toml")
+        marked = [_ for _ in output if _.startswith(BUILD_REQUIREMENTS_MARKER)]
+        if not marked:
+            raise ChildProcessError("Could not find the build requirements in the output")
+        requirements = json.loads(marked[-1][len(BUILD_REQUIREMENTS_MARKER):])
+        # pip only installs what is missing, so a reused environment is ready immediately
+        return_code, _ = run_shell_command([python, "-m", "pip", "install", *requirements])
+        if return_code != 0:
+            raise ChildProcessError("Could not install the build requirements")
+        return python
+
     def build_sbt_assembly_jar(self):
         """Builds an SBT assembly jar
 
-        This uses bash to run commands directly.
+        This uses bash to run commands directly. Without `clean`, sbt compiles incrementally and only
+        the assembly jars of earlier builds are removed.
 
         Raises:
            ChildProcessError is the bash command was not successful
         """
-        self._remove_old_artifacts("target/")
-
-        cmd = ["sbt", "clean", "assembly"]
-        return_code, _ = run_shell_command(cmd)
+        sbt = Sbt(self.config["sbt"])
+        if sbt.clean:
+            self._remove_old_artifacts("target/")
+            cmd = sbt.command("clean", "assembly")
+        else:
+            for jar in glob.glob(ASSEMBLY_JARS):
+                os.remove(jar)
+            cmd = sbt.command("assembly")
+        return_code, _ = run_shell_command(cmd, env=sbt.environment())
 
         if return_code != 0:
             raise ChildProcessError("Could not build the package for some reason!")
@@ -0,0 +1,124 @@
+"""
+Keeps build outputs keyed on a hash of everything they are built from, so that unchanged sources are
+not built again.
+
+The cache lives in a local directory, which CI runners usually persist between pipelines. It can be
+mirrored to an Azure blob storage container, to share it between runners.
+"""
+import hashlib
+import logging
+import os
+import shutil
+import uuid
+from typing import Any, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def source_digest(paths: Iterable[str], extra: Iterable[str] = ()) -> str:
+    """Computes a hash of the contents of files and additional values
+
+    Args:
+        paths: The files to hash. Paths that do not exist are skipped.
+        extra: Additional values that the build output depends on, for example the version
+
+    Returns:
+        The hex encoded sha256 hash
+    """
+    digest = hashlib.sha256()
+    for value in extra:
+        digest.update(value.encode() + b"\0")
+    for path in sorted(set(paths)):
+        if not os.path.isfile(path):
+            continue
+        digest.update(path.encode() + b"\0")
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BuildCache(object):
+    """Stores the files of a build under a key
+
+    Args:
+        path: The local directory to keep the cache in
+        blob_service: Optional `BlockBlobService` to mirror the cache to
+        container: The blob container to mirror the cache to
+    """
+
+    def __init__(self, path: str, blob_service: Optional[Any] = None, container: Optional[str] = None):
+        self.path = os.path.expanduser(path)
+        self.blob_service = blob_service
+        self.container = container
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.path, key)
+
+    def restore(self, key: str, destination: str) -> List[str]:
+        """Copies the files stored under `key` to `destination`, downloading them from blob storage if
+        they are not available locally
+
+        Args:
+            key: The key the files were stored under
+            destination: The directory to copy the files to
+
+        Returns:
+            The restored files, empty when there is nothing stored under `key`
+        """
+        entry = self._entry(key)
+        if not os.path.isdir(entry) and not self._download(key):
+            return []
+
+        os.makedirs(destination, exist_ok=True)
+        restored = []
+        for name in sorted(os.listdir(entry)):
+            shutil.copy2(os.path.join(entry, name), destination)
+            restored.append(os.path.join(destination, name))
+        logger.info(f"Restored {', '.join(restored)} from the build cache")
+        return restored
+
+    def store(self, key: str, files: List[str]):
+        """Stores files under `key`, locally and in blob storage
+
+        Args:
+            key: The key to store the files under
+            files: The files to store
+        """
+        entry = self._entry(key)
+        if not os.path.isdir(entry):
+            # copy to a temporary directory first, so that concurrent runs never see a partial entry
+            staging = f"{entry}.{uuid.uuid4().hex}.tmp"
+            os.makedirs(staging)
+            for file in files:
+                shutil.copy2(file, staging)
+            try:
+                os.rename(staging, entry)
+            except OSError:
+                shutil.rmtree(staging, ignore_errors=True)
+        logger.info(f"Stored {', '.join(files)} in the build cache")
+
+        if self.blob_service:
+            for file in files:
+                self.blob_service.create_blob_from_path(
+                    self.container, f"{key}/{os.path.basename(file)}", file
+                )
+
+    def _download(self, key: str) -> bool:
+        if not self.blob_service:
+            return False
+        blobs = [_.name for _ in self.blob_service.list_blobs(self.container, prefix=f"{key}/")]
+        if not blobs:
+            return False
+
+        staging = f"{self._entry(key)}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(staging)
+        for blob in blobs:
+            self.blob_service.get_blob_to_path(
+                self.container, blob, os.path.join(staging, os.path.basename(blob))
+            )
+        try:
+            os.rename(staging, self._entry(key))
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+        return True
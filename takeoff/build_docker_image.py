@@ -1,20 +1,28 @@
 import base64
+import hashlib
 import json
 import logging
 import os
+import stat
+from concurrent.futures import ThreadPoolExecutor, wait
 from dataclasses import dataclass
-from typing import List, Union
+from typing import List, Optional, Union
 
+import requests
 import voluptuous as vol
 
 from takeoff.application_version import ApplicationVersion
 from takeoff.credentials.container_registry import DockerRegistry
+from takeoff.docker_engine import DockerEngine
+from takeoff.docker_registry import DockerRegistryClient, ImageReference
 from takeoff.schemas import TAKEOFF_BASE_SCHEMA
 from takeoff.step import Step
-from takeoff.util import run_shell_command
+from takeoff.util import output_prefix, run_shell_command, run_shell_commands
 
 logger = logging.getLogger(__name__)
 
+CONTENT_TAG_PREFIX = "content-"
+
 SCHEMA = TAKEOFF_BASE_SCHEMA.extend(
     {
         vol.Required("task"): "build_docker_image",
@@ -56,11 +64,92 @@ SCHEMA = TAKEOFF_BASE_SCHEMA.extend(
                 ): vol.Any(None, bool),
             }
         ],
+        vol.Optional(
+            "engine",
+            default="cli",
+            description=(
+                "How to talk to the docker daemon: `cli` runs docker commands, `sdk` uses the Docker Engine "
+                "API and reports the duration of every build instruction and the bytes pushed per layer"
+            ),
+        ): vol.All(str, vol.In(["cli", "sdk"])),
+        vol.Optional(
+            "parallelism", default=1, description="Number of images to build and push at the same time"
+        ): vol.All(int, vol.Range(min=1)),
+        vol.Optional(
+            "cache_from",
+            default=[],
+            description=(
+                "Images to use as layer cache. `branch` is the image previously pushed for this branch, "
+                "`latest` the latest release. Anything else is used as a full image reference."
+            ),
+        ): [str],
+        vol.Optional(
+            "cache_repository",
+            default=None,
+            description=(
+                "Repository to push a copy of every image to, and to read the `branch` and `latest` "
+                "cache images from, e.g. myreg.io/cache"
+            ),
+        ): vol.Any(None, str),
+        vol.Optional(
+            "extra_tags", default=[], description="Additional tags for every image, e.g. a `stable` tag"
+        ): [str],
+        vol.Optional(
+            "skip_unchanged",
+            default=False,
+            description=(
+                "Tag every image with a hash of its Dockerfile and build context, and only add the new tags "
+                "when an image with the same hash already exists"
+            ),
+        ): bool,
+        vol.Optional(
+            "inline_cache",
+            default=False,
+            description="Build with BuildKit and embed the cache metadata in the pushed image",
+        ): bool,
     },
     extra=vol.ALLOW_EXTRA,
 )
 
 
+def context_digest(docker_file: str, build_args: List[str], context: str = ".") -> str:
+    """Computes a hash of everything that goes into a docker build
+
+    The hash covers the build arguments, the Dockerfile and every file in the build context that is not
+    excluded by `.dockerignore`, including its path and whether it is executable.
+
+    Args:
+        docker_file: The name of the dockerfile, relative to the context
+        build_args: The `--build-arg` values passed to the build
+        context: The build context directory
+
+    Returns:
+        The hex encoded sha256 hash
+    """
+    from docker.utils.build import exclude_paths
+
+    patterns: List[str] = []
+    dockerignore = os.path.join(context, ".dockerignore")
+    if os.path.exists(dockerignore):
+        with open(dockerignore) as f:
+            patterns = [_.strip() for _ in f.read().splitlines() if _.strip() and not _.startswith("#")]
+
+    digest = hashlib.sha256()
+    for value in [docker_file, *build_args]:
+        digest.update(value.encode() + b"\0")
+    for path in sorted(exclude_paths(context, patterns, dockerfile=docker_file)):
+        full_path = os.path.join(context, path)
+        if os.path.islink(full_path):
+            digest.update(f"{path}\0link\0{os.readlink(full_path)}\0".encode())
+        elif os.path.isfile(full_path):
+            executable = bool(os.stat(full_path).st_mode & stat.S_IXUSR)
+            digest.update(f"{path}\0{executable}\0".encode())
+            with open(full_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+    return digest.hexdigest()
+
+
 @dataclass(frozen=True)
 class DockerFile(object):
     dockerfile: str
@@ -76,12 +165,18 @@ class DockerImageBuilder(Step):
      Depends on:
      - Credentials for a docker registry (username, password, registry) must be
        available in your cloud vault or as environment variables
-     - The docker-cli must be available
+     - The docker-cli must be available, or the docker daemon must be reachable for the `sdk` engine
      """
 
     def __init__(self, env: ApplicationVersion, config: dict):
         super().__init__(env, config)
         self.docker_credentials = DockerRegistry(self.config, self.env).credentials()
+        # the cli engine is implemented by the static methods of this step
+        self.engine: Union[DockerImageBuilder, DockerEngine] = self
+        if self.config.get("engine", "cli") == "sdk":
+            if self.config.get("inline_cache"):
+                raise ValueError("inline_cache requires BuildKit, which only the cli engine supports")
+            self.engine = DockerEngine(self.docker_credentials)
 
     def populate_docker_config(self):
         """Creates ~/.docker/config.json and writes the credentials for the registry to the file"""
@@ -114,7 +209,9 @@ class DockerImageBuilder(Step):
         self.deploy(self._construct_docker_build_config())
 
     @staticmethod
-    def build_image(docker_file: str, tag: str):
+    def build_image(
+        docker_file: str, tag: str, cache_from: Optional[List[str]] = None, inline_cache: bool = False
+    ):
         """Build the docker image
 
         This uses bash to run commands directly.
@@ -122,12 +219,19 @@ class DockerImageBuilder(Step):
         Args:
             docker_file: The name of the dockerfile to build
             tag: The docker tag to apply to the image name
+            cache_from: Images whose layers may be reused for this build
+            inline_cache: Build with BuildKit and write the cache metadata into the image
         """
+        cache_args = [arg for image in cache_from or [] for arg in ("--cache-from", image)]
+        if inline_cache:
+            cache_args += ["--build-arg", "BUILDKIT_INLINE_CACHE=1"]
+
         cmd = [
             "docker",
             "build",
             "--build-arg",
             f"PIP_EXTRA_INDEX_URL={os.getenv('PIP_EXTRA_INDEX_URL')}",
+            *cache_args,
             "-t",
             tag,
             "-f",
@@ -137,7 +241,10 @@ class DockerImageBuilder(Step):
 
         logger.info(f"Building docker image for {docker_file} with command \n{' '.join(cmd)}")
 
-        return_code, _ = run_shell_command(cmd)
+        if inline_cache:
+            return_code, _ = run_shell_command(cmd, env={"DOCKER_BUILDKIT": "1"})
+        else:
+            return_code, _ = run_shell_command(cmd)
 
         if return_code != 0:
             raise ChildProcessError("Could not build the image for some reason!")
@@ -161,6 +268,47 @@ class DockerImageBuilder(Step):
         if return_code != 0:
             raise ChildProcessError("Could not tag image for some reason!")
 
+    @staticmethod
+    def pull_image(tag: str) -> bool:
+        """Pull a docker image, for example to use its layers as cache
+
+        This uses bash to run commands directly.
+
+        Args:
+            tag: The docker tag to download
+
+        Returns:
+            Whether the image could be pulled
+        """
+        return_code, _ = run_shell_command(["docker", "pull", tag])
+
+        if return_code != 0:
+            logger.warning(f"Could not pull {tag}, building without it")
+        return return_code == 0
+
+    @staticmethod
+    def pull_images(tags: List[str]) -> List[bool]:
+        """Pull several docker images at the same time
+
+        This uses bash to run commands directly.
+
+        Args:
+            tags: The docker tags to download
+
+        Returns:
+            Whether each image could be pulled
+        """
+        if not tags:
+            return []
+        results = run_shell_commands(
+            [["docker", "pull", tag] for tag in tags], prefixes=[f"[{tag}] " for tag in tags]
+        )
+
+        for tag, (return_code, _) in zip(tags, results):
+            if return_code != 0:
+                logger.warning(f"Could not pull {tag}, building without it")
+        return [return_code == 0 for return_code, _ in results]
+
     @staticmethod
     def push_image(tag: str):
         """Push the docker image
@@ -180,30 +328,145 @@ class DockerImageBuilder(Step):
             raise ChildProcessError("Could not push image for some reason!")
 
     def deploy(self, dockerfiles: List[DockerFile]):
-        for df in dockerfiles:
-            tag = self.env.artifact_tag
-
-            repository = "/".join(
-                [
-                    _
-                    for _ in (self.docker_credentials.registry, df.prefix, self.application_name)
-                    if _ is not None
-                ]
-            )
-
-            if df.custom_image_name:
-                repository = df.custom_image_name
-
-            if df.postfix:
-                repository += df.postfix
+        """Builds and pushes all images
 
-            image_tag = f"{repository}:{tag}"
-            self.build_image(df.dockerfile, image_tag)
-            self.push_image(image_tag)
+        With a `parallelism` above 1, the images are built concurrently and each image is pushed as soon
+        as its own build has finished. Output of the docker commands is prefixed with the dockerfile name.
+        If an image fails, the other images are finished before the first error is raised.
 
-            if df.tag_release_as_latest and self.env.on_release_tag:
-                latest_tag = f"{repository}:latest"
-                # ensure that the latest tag is available for pushing
-                self.tag_image(image_tag, latest_tag)
+        Args:
+            dockerfiles: The images to build
+        """
+        parallelism = self.config.get("parallelism", 1)
+        if parallelism == 1 or len(dockerfiles) == 1:
+            for df in dockerfiles:
+                self.build_and_push(df)
+            return
+
+        with ThreadPoolExecutor(max_workers=parallelism, thread_name_prefix="docker") as pool:
+            futures = [pool.submit(self._build_and_push_with_prefix, df) for df in dockerfiles]
+            wait(futures)
+
+        errors = []
+        for df, future in zip(dockerfiles, futures):
+            error = future.exception()
+            if error:
+                logger.error(f"Building or pushing {df.dockerfile} failed: {error}")
+                errors.append(error)
+        if errors:
+            raise errors[0]
+
+    def _build_and_push_with_prefix(self, df: DockerFile):
+        with output_prefix(f"[{df.dockerfile}] "):
+            self.build_and_push(df)
+
+    def build_and_push(self, df: DockerFile):
+        """Builds a single image and pushes it, including the `latest` tag for releases
+
+        Only the artifact tag is pushed through the docker daemon. All other tags are added in the
+        registry. With `skip_unchanged`, an image that has already been built from the same sources is
+        not built again; the existing image only gets the new tags. This also promotes a SNAPSHOT
+        image to a release version without rebuilding it.
+        """
+        tag = self.env.artifact_tag
+
+        repository = "/".join(
+            [_ for _ in (self.docker_credentials.registry, df.prefix, self.application_name) if _ is not None]
+        )
+
+        if df.custom_image_name:
+            repository = df.custom_image_name
+
+        if df.postfix:
+            repository += df.postfix
+
+        image_tag = f"{repository}:{tag}"
+        content_tag = self._content_tag(repository, df) if self.config.get("skip_unchanged") else None
+
+        built = True
+        if content_tag and self._image_exists(content_tag):
+            built = False
+            logger.info(f"Sources of {df.dockerfile} are unchanged since {content_tag}, not building")
+            self.add_tags(content_tag, [tag])
+        else:
+            self._build(df, repository, image_tag)
+            self.engine.push_image(image_tag)
+            if content_tag:
+                self.add_tags(image_tag, [content_tag.rpartition(":")[2]])
+
+        tag_latest = df.tag_release_as_latest and self.env.on_release_tag
+        extra_tags = (["latest"] if tag_latest else []) + self.config.get("extra_tags", [])
+        if extra_tags:
+            self.add_tags(image_tag, extra_tags)
+
+        if self.config.get("cache_repository"):
+            if not built:
+                # tagging for another repository goes through the docker daemon, which needs the image
+                self.engine.pull_image(image_tag)
+            cache_repository = self._cache_repository(repository)
+            for cache_tag in [tag] + (["latest"] if tag_latest else []):
+                self.engine.tag_image(image_tag, f"{cache_repository}:{cache_tag}")
+                self.engine.push_image(f"{cache_repository}:{cache_tag}")
+
+    def add_tags(self, image: str, tags: List[str]):
+        """Adds tags to an image that has already been pushed
+
+        The manifest is copied in the registry, so no layers are checked or uploaded again. If the
+        registry cannot be reached through its API, the image is pulled, tagged and pushed instead.
 
-                self.push_image(latest_tag)
+        Args:
+            image: The full reference of the pushed image
+            tags: The tags to add, without the repository
+        """
+        reference = ImageReference.parse(image, known_registries=[self.docker_credentials.registry])
+        try:
+            self._registry_client(reference.registry).add_tags(reference.repository, reference.tag, tags)
+        except requests.RequestException as e:
+            logger.warning(f"Could not tag {image} in the registry, falling back to docker: {e}")
+            if not self.engine.pull_image(image):
+                raise ChildProcessError(f"Could not pull existing image {image}")
+            repository = image.rpartition(":")[0]
+            for tag in tags:
+                self.engine.tag_image(image, f"{repository}:{tag}")
+                self.engine.push_image(f"{repository}:{tag}")
+
+    def _build(self, df: DockerFile, repository: str, image_tag: str):
+        cache_from = self._cache_images(repository)
+        inline_cache = self.config.get("inline_cache", False)
+        if not inline_cache:
+            # the classic builder only uses cache images that are available locally
+            self.engine.pull_images(cache_from)
+
+        self.engine.build_image(df.dockerfile, image_tag, cache_from, inline_cache)
+
+    def _content_tag(self, repository: str, df: DockerFile) -> str:
+        """The image tag that identifies the sources the image is built from"""
+        digest = context_digest(df.dockerfile, [f"PIP_EXTRA_INDEX_URL={os.getenv('PIP_EXTRA_INDEX_URL')}"])
+        return f"{repository}:{CONTENT_TAG_PREFIX}{digest[:40]}"
+
+    def _image_exists(self, image: str) -> bool:
+        """Checks the registry for the image, without pulling it"""
+        reference = ImageReference.parse(image, known_registries=[self.docker_credentials.registry])
+        return self._registry_client(reference.registry).manifest_exists(reference.repository, reference.tag)
+
+    def _registry_client(self, registry: str) -> DockerRegistryClient:
+        if registry == self.docker_credentials.registry:
+            return DockerRegistryClient(
+                registry, self.docker_credentials.username, self.docker_credentials.password
+            )
+        return DockerRegistryClient(registry)
+
+    def _cache_repository(self, repository: str) -> str:
+        """The repository that holds the cache images for an image repository"""
+        if not self.config.get("cache_repository"):
+            return repository
+        return f"{self.config['cache_repository']}/{repository.split('/')[-1]}"
+
+    def _cache_images(self, repository: str) -> List[str]:
+        """Resolves the `cache_from` entries to image references for an image repository"""
+        cache_repository = self._cache_repository(repository)
+        aliases = {
+            "branch": f"{cache_repository}:{self.env.artifact_tag}",
+            "latest": f"{cache_repository}:latest",
+        }
+        return [aliases[_] if _ in aliases else _ for _ in self.config.get("cache_from", [])]
@@ -1,4 +1,5 @@
 import logging
+import threading
 from enum import Enum, auto, unique
 from typing import Any, Dict
 
@@ -9,14 +10,21 @@ logger = logging.getLogger(__name__)
 class ContextKey(Enum):
     EVENTHUB_PRODUCER_POLICY_SECRETS = auto()
     EVENTHUB_CONSUMER_GROUP_SECRETS = auto()
+    # Dict[str, bool]: blob names of the artifacts published to cloud storage, and whether they changed
+    PUBLISHED_ARTIFACTS = auto()
 
 
 class Singleton(type):
     _instances: Dict[Any, Any] = {}
+    # reentrant, as creating one singleton may create another
+    _lock = threading.RLock()
 
     def __call__(cls, *args, **kwargs):
         if cls not in cls._instances:
-            cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
+            with Singleton._lock:
+                # steps running on other threads may have created the instance while waiting for the lock
+                if cls not in cls._instances:
+                    cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
         return cls._instances[cls]
 
 
@@ -0,0 +1,51 @@
+import logging
+import threading
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+from takeoff.context import Singleton
+
+logger = logging.getLogger(__name__)
+
+
+class ClientPool(metaclass=Singleton):
+    """Authenticated clients shared by all steps in a Takeoff run
+
+    Clients are keyed by the vault their credentials come from, the environment and the service they
+    connect to. The first step that asks for a client creates it; all later steps get the same instance,
+    and with it the access tokens and HTTP connections it already holds.
+    """
+
+    def __init__(self):
+        self._clients: Dict[Tuple[Hashable, ...], Any] = {}
+        self._locks: Dict[Tuple[Hashable, ...], threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[Hashable, ...], create: Callable[[], Any]) -> Any:
+        """Returns the client for `key`, creating it with `create` if there is none yet
+
+        Clients for different keys are created concurrently, a client for a single key is only created once.
+
+        Args:
+            key: Identifies the client, for example `(vault_name, environment, "keyvault")`
+            create: Creates a new client
+
+        Returns:
+            The shared client
+        """
+        with self._lock:
+            if key in self._clients:
+                return self._clients[key]
+            key_lock = self._locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            if key not in self._clients:
+                logger.debug(f"Creating client for {key}")
+                client = create()
+                with self._lock:
+                    self._clients[key] = client
+            return self._clients[key]
+
+    def clear(self):
+        with self._lock:
+            self._clients = {}
+            self._locks = {}
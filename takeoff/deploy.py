@@ -1,9 +1,17 @@
 import logging
-from typing import Callable, List
+from typing import Callable, List, Optional
 
 from takeoff.application_version import ApplicationVersion
 from takeoff.credentials.branch_name import BranchName
-from takeoff.util import get_tag, get_short_hash, get_full_yaml_filename, load_yaml, load_takeoff_plugins
+from takeoff.scheduler import DEFAULT_CONCURRENCY, ScheduledStep, plan_steps, run_steps
+from takeoff.tracing import Tracer
+from takeoff.util import (
+    get_git_info,
+    get_full_yaml_filename,
+    load_yaml,
+    invalidate_takeoff_plugins,
+    takeoff_plugin_registry,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -18,15 +26,14 @@ def deploy_env_logic(config: dict) -> ApplicationVersion:
         Information about the version of the application and to which environment it should be deployed
     """
     branch = BranchName(config=config).get()
-    tag = get_tag()
-    git_hash = get_short_hash()
+    git_info = get_git_info()
 
-    if tag:
-        return ApplicationVersion("PRD", str(tag), branch)
+    if git_info.tag:
+        return ApplicationVersion("PRD", git_info.tag, branch, git_info)
     elif branch == "master":
-        return ApplicationVersion("ACP", "SNAPSHOT", branch)
+        return ApplicationVersion("ACP", "SNAPSHOT", branch, git_info)
     else:
-        return ApplicationVersion("DEV", git_hash, branch)
+        return ApplicationVersion("DEV", git_info.short_hash, branch, git_info)
 
 
 def find_env_function() -> Callable:
@@ -35,10 +42,10 @@ def find_env_function() -> Callable:
     Returns:
         Either the default function or the first plugin function if it is found.
     """
-    for plugin in load_takeoff_plugins().values():
-        if hasattr(plugin, "deploy_env_logic"):
-            logging.info("Using plugin 'deploy_env_logic' function")
-            return plugin.deploy_env_logic
+    plugin_function = takeoff_plugin_registry().hook("deploy_env_logic")
+    if plugin_function:
+        logging.info("Using plugin 'deploy_env_logic' function")
+        return plugin_function
     logging.info("Using default 'deploy_env_logic' function")
     return deploy_env_logic
 
@@ -52,9 +59,10 @@ def add_takeoff_plugin_paths(dirs: List[str]):
     import sys
 
     sys.path.extend(dirs)
+    invalidate_takeoff_plugins()
 
 
-def main(takeoff_dir: str = ".takeoff"):
+def main(takeoff_dir: str = ".takeoff", trace_file: Optional[str] = None):
     logger.info(  # noqa: W605
         """
   ______      __              ________
@@ -65,6 +73,16 @@ def main(takeoff_dir: str = ".takeoff"):
 
     """
     )
+    if trace_file:
+        Tracer().enable()
+    try:
+        _run(takeoff_dir)
+    finally:
+        if trace_file:
+            Tracer().write(trace_file)
+
+
+def _run(takeoff_dir: str):
     logger.info(f"Loading Takeoff configuration from {takeoff_dir}")
     deployment = load_yaml(get_full_yaml_filename("deployment", takeoff_dir))
     config = load_yaml(get_full_yaml_filename("config", takeoff_dir))
@@ -76,18 +94,27 @@ def main(takeoff_dir: str = ".takeoff"):
     env = get_environment(config)
     logger.info(f"Running Takeoff with application version: {env}")
 
-    for task_config in deployment["steps"]:
-        task = task_config["task"]
+    plan = plan_steps(deployment["steps"], find_step_class)
+
+    def run_step(step: ScheduledStep):
         logger.info("*" * 76)
-        logger.info("{:10s} {:13s} {:40s} {:10s}".format("*" * 10, "RUNNING TASK:", task, "*" * 10))
+        logger.info("{:10s} {:13s} {:40s} {:10s}".format("*" * 10, "RUNNING TASK:", step.task, "*" * 10))
         logger.info("*" * 76)
-        run_task(env, task, {**task_config, **config})
+        with Tracer().span(step.step_id, "step", task=step.task):
+            run_task(env, step.task, {**step.config, **config})
 
+    run_steps(plan, run_step, deployment.get("concurrency", DEFAULT_CONCURRENCY))
 
-def run_task(env: ApplicationVersion, task: str, task_config: dict):
-    from takeoff.steps import steps
 
-    if task not in steps:
+def find_step_class(task: str) -> Optional[type]:
+    from takeoff.steps import get_step
+
+    return get_step(task)
+
+
+def run_task(env: ApplicationVersion, task: str, task_config: dict):
+    step = find_step_class(task)
+    if not step:
         raise ValueError(f"Deployment step {task} is unknown, please check the config")
     else:
-        return steps[task](env, task_config).run()  # type: ignore
+        return step(env, task_config).run()
@@ -0,0 +1,282 @@
+"""
+Builds, tags and pushes images through the Docker Engine API instead of the docker cli.
+
+The build and push output of the daemon is a stream of JSON messages. These are parsed to log the
+progress, to report how long every Dockerfile instruction took and how many bytes were pushed per
+layer, and to raise errors that contain the message of the daemon.
+"""
+import logging
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+from takeoff.credentials.container_registry import DockerCredentials
+from takeoff.docker_registry import ImageReference
+from takeoff.tracing import Tracer
+
+logger = logging.getLogger(__name__)
+
+BUILD_STEP = re.compile(r"^Step \d+/\d+ : (?P<instruction>.*)$")
+SKIPPED_LAYER_STATUSES = ("Layer already exists", "Mounted from")
+
+
+class DockerBuildError(ChildProcessError):
+    """Raised when the daemon reports an error while building, tagging or pushing an image"""
+
+    def __init__(self, image: str, message: str, code: Optional[int] = None):
+        super().__init__(f"{image}: {message}")
+        self.image = image
+        self.message = message
+        self.code = code
+
+
+@dataclass
+class BuildStep(object):
+    instruction: str
+    seconds: float = 0.0
+    cached: bool = False
+
+
+@dataclass
+class BuildReport(object):
+    image: str
+    image_id: Optional[str] = None
+    steps: List[BuildStep] = field(default_factory=list)
+
+    @property
+    def seconds(self) -> float:
+        return sum(_.seconds for _ in self.steps)
+
+
+@dataclass
+class PushReport(object):
+    image: str
+    digest: Optional[str] = None
+    pushed: Dict[str, int] = field(default_factory=dict)
+    skipped: List[str] = field(default_factory=list)
+
+    @property
+    def pushed_bytes(self) -> int:
+        return sum(self.pushed.values())
+
+
+def _raise_on_error(image: str, message: dict):
+    if "error" in message:
+        detail = message.get("errorDetail") or {}
+        raise DockerBuildError(image, detail.get("message", message["error"]).strip(), detail.get("code"))
+
+
+def parse_build_output(image: str, messages: Iterable[dict]) -> BuildReport:
+    """Logs the output of a build and measures how long every Dockerfile instruction takes
+
+    Args:
+        image: The image that is built
+        messages: The decoded JSON messages the daemon streams while building
+
+    Returns:
+        The duration of every instruction and the id of the built image
+    """
+    report = BuildReport(image)
+    started = time.monotonic()
+    for message in messages:
+        _raise_on_error(image, message)
+        if "aux" in message:
+            report.image_id = message["aux"].get("ID", report.image_id)
+        for line in message.get("stream", "").splitlines():
+            if not line.strip():
+                continue
+            logger.info(line)
+            match = BUILD_STEP.match(line)
+            if match:
+                now = time.monotonic()
+                if report.steps:
+                    report.steps[-1].seconds = now - started
+                started = now
+                report.steps.append(BuildStep(match.group("instruction")))
+            elif report.steps and line.strip() == "---> Using cache":
+                report.steps[-1].cached = True
+    if report.steps:
+        report.steps[-1].seconds = time.monotonic() - started
+    return report
+
+
+def parse_push_output(image: str, messages: Iterable[dict]) -> PushReport:
+    """Logs the output of a push and collects the bytes pushed per layer
+
+    Args:
+        image: The image that is pushed
+        messages: The decoded JSON messages the daemon streams while pushing
+
+    Returns:
+        The bytes pushed per layer, the layers the registry already had and the digest of the image
+    """
+    report = PushReport(image)
+    for message in messages:
+        _raise_on_error(image, message)
+        layer = message.get("id")
+        status = message.get("status", "")
+        if "aux" in message:
+            report.digest = message["aux"].get("Digest", report.digest)
+        elif layer and status == "Pushing":
+            report.pushed[layer] = message.get("progressDetail", {}).get("current", 0)
+        elif layer and status.startswith(SKIPPED_LAYER_STATUSES):
+            report.skipped.append(layer)
+            logger.info(f"{layer}: {status}")
+        elif status and status != "Waiting" and status != "Preparing":
+            logger.info(f"{layer}: {status}" if layer else status)
+    return report
+
+
+class DockerEngine(object):
+    """Talks to the docker daemon through the Docker SDK, using the same environment variables as the cli
+
+    Args:
+        credentials: Credentials for the registry the images are pushed to
+    """
+
+    def __init__(self, credentials: DockerCredentials):
+        import docker
+        from docker.utils import kwargs_from_env
+
+        self.credentials = credentials
+        self.api = docker.APIClient(**kwargs_from_env())
+
+    def _auth_config(self, image: str) -> Optional[dict]:
+        reference = ImageReference.parse(image, known_registries=[self.credentials.registry])
+        if reference.registry != self.credentials.registry:
+            return None
+        return {"username": self.credentials.username, "password": self.credentials.password}
+
+    def _call(self, image: str, request, *args, **kwargs):
+        """Calls the SDK, turning errors of the daemon into a `DockerBuildError`"""
+        from docker.errors import DockerException
+
+        try:
+            return request(*args, **kwargs)
+        except DockerException as e:
+            raise DockerBuildError(image, str(e), getattr(getattr(e, "response", None), "status_code", None))
+
+    def build_image(
+        self, docker_file: str, tag: str, cache_from: Optional[List[str]] = None, inline_cache: bool = False
+    ) -> BuildReport:
+        """Build the docker image from the current directory
+
+        Args:
+            docker_file: The name of the dockerfile to build
+            tag: The docker tag to apply to the image name
+            cache_from: Images whose layers may be reused for this build
+            inline_cache: Not supported, as the Docker SDK does not build with BuildKit
+
+        Returns:
+            The duration of every instruction in the dockerfile
+        """
+        if inline_cache:
+            raise ValueError("The Docker SDK does not build with BuildKit, use the cli for inline_cache")
+        logger.info(f"Building docker image for {docker_file} through the Docker Engine API")
+
+        with Tracer().span(f"docker build {tag}", "docker") as span:
+            messages = self._call(
+                tag,
+                self.api.build,
+                path=".",
+                dockerfile=docker_file,
+                tag=tag,
+                buildargs={"PIP_EXTRA_INDEX_URL": f"{os.getenv('PIP_EXTRA_INDEX_URL')}"},
+                cache_from=cache_from or None,
+                rm=True,
+                decode=True,
+            )
+            report = self._call(tag, parse_build_output, tag, messages)
+            span["steps"] = len(report.steps)
+            span["cached_steps"] = len([_ for _ in report.steps if _.cached])
+
+        for step in sorted(report.steps, key=lambda _: _.seconds, reverse=True)[:5]:
+            logger.info(f"{step.seconds:8.1f}s {'(cached) ' if step.cached else ''}{step.instruction}")
+        return report
+
+    def tag_image(self, old_tag: str, new_tag: str):
+        """Tag a docker tag with a new tag
+
+        Args:
+            old_tag: The existing docker tag
+            new_tag: The new docker tag
+        """
+        logger.info(f"Tagging {old_tag} as {new_tag}")
+        repository, _, tag = new_tag.rpartition(":")
+        if not self._call(new_tag, self.api.tag, old_tag, repository, tag):
+            raise DockerBuildError(new_tag, f"Could not tag {old_tag}")
+
+    def pull_image(self, tag: str) -> bool:
+        """Pull a docker image, for example to use its layers as cache
+
+        Args:
+            tag: The docker tag to download
+
+        Returns:
+            Whether the image could be pulled
+        """
+        repository, _, image_tag = tag.rpartition(":")
+        try:
+            messages = self._call(
+                tag,
+                self.api.pull,
+                repository,
+                tag=image_tag,
+                stream=True,
+                decode=True,
+                auth_config=self._auth_config(tag),
+            )
+            for message in messages:
+                _raise_on_error(tag, message)
+        except DockerBuildError as e:
+            logger.warning(f"Could not pull {tag}, building without it: {e.message}")
+            return False
+        return True
+
+    def pull_images(self, tags: List[str]) -> List[bool]:
+        """Pull several docker images at the same time
+
+        Args:
+            tags: The docker tags to download
+
+        Returns:
+            Whether each image could be pulled
+        """
+        if not tags:
+            return []
+        with ThreadPoolExecutor(max_workers=len(tags), thread_name_prefix="docker-pull") as pool:
+            return list(pool.map(self.pull_image, tags))
+
+    def push_image(self, tag: str) -> PushReport:
+        """Push the docker image
+
+        Args:
+            tag: The docker tag to upload
+
+        Returns:
+            The bytes pushed per layer and the layers that the registry already had
+        """
+        logger.info(f"Uploading docker image {tag}")
+        repository, _, image_tag = tag.rpartition(":")
+
+        with Tracer().span(f"docker push {tag}", "docker") as span:
+            messages = self._call(
+                tag,
+                self.api.push,
+                repository,
+                tag=image_tag,
+                stream=True,
+                decode=True,
+                auth_config=self._auth_config(tag),
+            )
+            report = self._call(tag, parse_push_output, tag, messages)
+            span.update(pushed_bytes=report.pushed_bytes, skipped_layers=len(report.skipped))
+
+        logger.info(
+            f"Pushed {len(report.pushed)} layers ({report.pushed_bytes / 1e6:.1f} MB) of {tag}, "
+            f"{len(report.skipped)} layers were already in the registry"
+        )
+        return report
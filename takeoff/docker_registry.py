@@ -0,0 +1,175 @@
+"""
+Minimal client for the Docker registry HTTP API v2, used to inspect and tag images without pulling them.
+
+https://docs.docker.com/registry/spec/api/
+"""
+import logging
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import requests
+
+from takeoff.util import call_with_retries
+
+logger = logging.getLogger(__name__)
+
+DOCKER_HUB = "registry-1.docker.io"
+
+MANIFEST_TYPES = [
+    "application/vnd.docker.distribution.manifest.v2+json",
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.manifest.v1+json",
+    "application/vnd.oci.image.index.v1+json",
+]
+
+
+@dataclass(frozen=True)
+class ImageReference(object):
+    registry: str
+    repository: str
+    tag: str
+
+    @staticmethod
+    def parse(image: str, known_registries: Iterable[str] = ()) -> "ImageReference":
+        """Splits an image reference like `myreg.io/team/app:1.0` into its registry, repository and tag
+
+        The first path component is the registry if it is one of `known_registries`, or if it looks like
+        a hostname, following the rules of the docker cli. Otherwise the image lives on Docker Hub.
+
+        Args:
+            image: The image reference, including a tag
+            known_registries: Registry names that do not look like a hostname, for example `pony`
+
+        Returns:
+            The parsed image reference
+        """
+        name, _, tag = image.rpartition(":")
+        if not name or "/" in tag:
+            raise ValueError(f"Image reference {image} has no tag")
+
+        first, _, rest = name.partition("/")
+        if rest and (first in known_registries or "." in first or ":" in first or first == "localhost"):
+            return ImageReference(first, rest, tag)
+        return ImageReference(DOCKER_HUB, name if rest else f"library/{name}", tag)
+
+
+class DockerRegistryClient(object):
+    """Talks to a single registry, authenticating with basic auth or a bearer token as the registry demands"""
+
+    def __init__(self, registry: str, username: Optional[str] = None, password: Optional[str] = None):
+        self.registry = registry
+        self.auth: Optional[Tuple[str, str]] = (username, password) if username and password else None
+        self.session = requests.Session()
+        self._tokens: Dict[str, str] = {}
+
+    @property
+    def base_url(self) -> str:
+        insecure = self.registry.split(":")[0] in ("localhost", "127.0.0.1")
+        return f"{'http' if insecure else 'https'}://{self.registry}/v2"
+
+    def _request(self, method: str, repository: str, path: str, actions: str = "pull", **kwargs):
+        """Sends a request to the registry, retrying when it is throttled or unavailable
+
+        Args:
+            method: The HTTP method
+            repository: The repository within the registry, for example `team/app`
+            path: The path below the repository, for example `manifests/1.0`
+            actions: The actions to request a bearer token for, for example `pull,push`
+            kwargs: Passed on to `requests`
+
+        Returns:
+            The response of the registry
+        """
+        url = f"{self.base_url}/{repository}/{path}"
+        scope = f"repository:{repository}:{actions}"
+        headers = kwargs.pop("headers", {})
+
+        def send(token: Optional[str]):
+            if token:
+                return self.session.request(
+                    method, url, headers={**headers, "Authorization": f"Bearer {token}"}, **kwargs
+                )
+            return self.session.request(method, url, headers=headers, auth=self.auth, **kwargs)
+
+        def request():
+            response = send(self._tokens.get(scope))
+            challenge = response.headers.get("WWW-Authenticate", "")
+            if response.status_code == 401 and challenge.lower().startswith("bearer"):
+                self._tokens[scope] = self._fetch_token(challenge, scope)
+                response = send(self._tokens[scope])
+            if response.status_code == 429 or response.status_code >= 500:
+                response.raise_for_status()
+            return response
+
+        return call_with_retries(request)
+
+    def _fetch_token(self, challenge: str, scope: str) -> str:
+        """Gets a bearer token for `scope` from the token service named in the `WWW-Authenticate` challenge"""
+        params: Dict[str, str] = dict(re.findall(r'(\w+)="([^"]*)"', challenge))
+        realm = params.pop("realm")
+        params["scope"] = scope
+        response = self.session.get(realm, params=params, auth=self.auth)
+        response.raise_for_status()
+        body = response.json()
+        return body.get("token") or body["access_token"]
+
+    def manifest_exists(self, repository: str, tag: str) -> bool:
+        """Checks whether the registry has an image with this tag
+
+        Args:
+            repository: The repository within the registry, for example `team/app`
+            tag: The tag of the image
+
+        Returns:
+            Whether the tag exists
+        """
+        response = self._request(
+            "HEAD", repository, f"manifests/{tag}", headers={"Accept": ", ".join(MANIFEST_TYPES)}
+        )
+        if response.status_code == 404:
+            return False
+        response.raise_for_status()
+        return True
+
+    def get_manifest(self, repository: str, reference: str) -> Tuple[str, bytes]:
+        """Downloads the manifest of an image
+
+        Args:
+            repository: The repository within the registry, for example `team/app`
+            reference: The tag or digest of the image
+
+        Returns:
+            The media type and the raw manifest. The raw bytes are kept, so that the manifest digest
+            does not change when it is uploaded again.
+        """
+        response = self._request(
+            "GET", repository, f"manifests/{reference}", headers={"Accept": ", ".join(MANIFEST_TYPES)}
+        )
+        response.raise_for_status()
+        return response.headers["Content-Type"], response.content
+
+    def put_manifest(self, repository: str, tag: str, media_type: str, manifest: bytes):
+        """Uploads a manifest under a tag. All layers it refers to must exist in the repository."""
+        response = self._request(
+            "PUT",
+            repository,
+            f"manifests/{tag}",
+            actions="pull,push",
+            headers={"Content-Type": media_type},
+            data=manifest,
+        )
+        response.raise_for_status()
+
+    def add_tags(self, repository: str, reference: str, tags: List[str]):
+        """Adds tags to an image that is already in the registry, without pulling or pushing any layers
+
+        Args:
+            repository: The repository within the registry, for example `team/app`
+            reference: The existing tag or digest of the image
+            tags: The tags to add
+        """
+        media_type, manifest = self.get_manifest(repository, reference)
+        for tag in tags:
+            logger.info(f"Tagging {self.registry}/{repository}:{reference} as {tag} in the registry")
+            self.put_manifest(repository, tag, media_type, manifest)
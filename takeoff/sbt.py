@@ -0,0 +1,100 @@
+"""
+Builds the command lines for sbt, shared by the steps that build and publish Scala artifacts.
+
+By default every command starts a new sbt, which pays for JVM startup, loading the build and resolving
+dependencies every time. With `server: true`, the first command starts an sbt server through the thin
+client (`sbt --client`, sbt 1.4 or later) and all later commands in the same Takeoff run reuse it. The
+server is shut down when Takeoff exits.
+"""
+import atexit
+import logging
+import os
+import threading
+from typing import Dict, List, Optional
+
+import voluptuous as vol
+
+from takeoff.context import Singleton
+from takeoff.util import run_shell_command
+
+logger = logging.getLogger(__name__)
+
+SBT_SCHEMA = {
+    vol.Optional(
+        "server",
+        default=False,
+        description="Run all sbt commands of a Takeoff run in one sbt server, through the thin client",
+    ): bool,
+    vol.Optional(
+        "clean",
+        default=None,
+        description="Run `sbt clean` and remove `target/` before building. Defaults to `false` with a server",
+    ): vol.Any(None, bool),
+    vol.Optional(
+        "cache_dir",
+        default=None,
+        description="Directory to keep the Coursier, Ivy and sbt boot caches in, instead of the home folder",
+    ): vol.Any(None, str),
+}
+
+
+class SbtServer(metaclass=Singleton):
+    """Keeps track of the sbt server started for this Takeoff run, to shut it down on exit"""
+
+    def __init__(self):
+        self._env: Optional[Dict[str, str]] = None
+        self._started = False
+        self._lock = threading.Lock()
+
+    def register(self, env: Optional[Dict[str, str]]):
+        with self._lock:
+            if not self._started:
+                self._started = True
+                self._env = env
+                atexit.register(self.shutdown)
+
+    def shutdown(self):
+        with self._lock:
+            if not self._started:
+                return
+            self._started = False
+        logger.info("Shutting down the sbt server")
+        run_shell_command(["sbt", "--client", "shutdown"], env=self._env)
+
+
+class Sbt(object):
+    """sbt command lines for the `sbt` configuration of a step
+
+    Args:
+        config: The `sbt` section of the step configuration
+    """
+
+    def __init__(self, config: dict):
+        self.server = config.get("server", False)
+        self.cache_dir = config.get("cache_dir")
+        clean = config.get("clean")
+        self.clean = not self.server if clean is None else clean
+
+    def command(self, *commands: str) -> List[str]:
+        """The command line that runs the sbt commands, in order
+
+        In server mode, this makes sure the server is shut down when Takeoff exits.
+        """
+        if not self.server:
+            return ["sbt", *commands]
+        SbtServer().register(self.environment())
+        # the thin client sends its arguments as a single command line
+        return ["sbt", "--client", "; ".join(commands)]
+
+    def environment(self) -> Optional[Dict[str, str]]:
+        """Environment variables that point sbt to the cache directory, if one is configured"""
+        if not self.cache_dir:
+            return None
+        cache_dir = os.path.abspath(os.path.expanduser(self.cache_dir))
+        options = [
+            os.environ.get("SBT_OPTS", ""),
+            f"-Dsbt.boot.directory={cache_dir}/boot",
+            f"-Dsbt.ivy.home={cache_dir}/ivy",
+            f"-Dsbt.coursier.home={cache_dir}/coursier",
+        ]
+        return {"COURSIER_CACHE": f"{cache_dir}/coursier", "SBT_OPTS": " ".join(_ for _ in options if _)}
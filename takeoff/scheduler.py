@@ -0,0 +1,185 @@
+"""
+Example:
+
+    In `.takeoff/deployment.yml`::
+
+        concurrency: 4
+        steps:
+          - task: build_docker_image
+          - task: configure_eventhub
+            depends_on: []
+          - task: create_application_insights
+            depends_on: []
+          - task: deploy_to_kubernetes
+            depends_on: [build_docker_image]
+
+Steps without `depends_on` wait for all steps declared before them, which preserves the
+sequential behaviour of older deployment files. Steps that declare `depends_on` only wait for the
+listed steps, plus any earlier step that produces a `ContextKey` they consume.
+"""
+import logging
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, Dict, FrozenSet, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 1
+
+
+@dataclass(frozen=True)
+class ScheduledStep(object):
+    step_id: str
+    task: str
+    config: dict
+    depends_on: FrozenSet[str]
+
+
+def _step_ids(task_configs: List[dict]) -> List[str]:
+    """Determines a unique identifier for every step
+
+    Explicit `id` fields are used as is. Otherwise the task name is used, with a `_<n>` postfix for
+    the n-th occurrence of a task that is used more than once.
+
+    Args:
+        task_configs: The steps as listed in `.takeoff/deployment.yml`
+
+    Returns:
+        The step identifiers, in the same order as the steps
+
+    Raises:
+        ValueError if two steps end up with the same identifier
+    """
+    seen: Dict[str, int] = {}
+    ids = []
+    for task_config in task_configs:
+        task = task_config["task"]
+        seen[task] = seen.get(task, 0) + 1
+        ids.append(task_config.get("id", task if seen[task] == 1 else f"{task}_{seen[task]}"))
+
+    duplicates = {_ for _ in ids if ids.count(_) > 1}
+    if duplicates:
+        raise ValueError(f"Deployment step ids must be unique, found duplicates: {sorted(duplicates)}")
+    return ids
+
+
+def _resolve_reference(reference: str, ids: List[str], tasks: List[str]) -> Set[str]:
+    """Resolves a `depends_on` entry to step ids. An entry matches the step with that id as well as
+    all steps running a task with that name.
+
+    Raises:
+        ValueError if the reference matches no step
+    """
+    matches = {step_id for step_id, task in zip(ids, tasks) if reference in (step_id, task)}
+    if not matches:
+        raise ValueError(f"Unknown step '{reference}' in depends_on, please check the deployment config")
+    return matches
+
+
+def plan_steps(task_configs: List[dict], step_class: Callable[[str], Optional[type]]) -> List[ScheduledStep]:
+    """Builds the dependency graph for all steps in the deployment
+
+    Args:
+        task_configs: The steps as listed in `.takeoff/deployment.yml`
+        step_class: Maps a task name to its `Step` class, or None if the task is unknown. Used to infer
+            dependencies from the `ContextKey`s a step produces and consumes.
+
+    Returns:
+        The steps including their resolved dependencies, in declaration order
+    """
+    ids = _step_ids(task_configs)
+    tasks = [_["task"] for _ in task_configs]
+    classes = [step_class(_) for _ in tasks]
+
+    plan = []
+    for i, task_config in enumerate(task_configs):
+        if "depends_on" not in task_config:
+            depends_on = set(ids[:i])
+        else:
+            depends_on = set()
+            for reference in task_config["depends_on"]:
+                depends_on |= _resolve_reference(reference, ids, tasks)
+
+            consumes: FrozenSet = getattr(classes[i], "consumes", frozenset())
+            for j in range(i):
+                if consumes & getattr(classes[j], "produces", frozenset()):
+                    depends_on.add(ids[j])
+
+        plan.append(ScheduledStep(ids[i], tasks[i], task_config, frozenset(depends_on)))
+
+    _topological_order(plan)
+    return plan
+
+
+def _topological_order(plan: List[ScheduledStep]) -> List[ScheduledStep]:
+    """Orders the steps such that every step comes after its dependencies. Ties are broken by the
+    order in which the steps are declared.
+
+    Raises:
+        ValueError if the dependencies contain a cycle
+    """
+    done: Set[str] = set()
+    ordered: List[ScheduledStep] = []
+    remaining = list(plan)
+    while remaining:
+        ready = next((_ for _ in remaining if _.depends_on <= done), None)
+        if not ready:
+            raise ValueError(f"Circular dependency between steps {[_.step_id for _ in remaining]}")
+        ordered.append(ready)
+        done.add(ready.step_id)
+        remaining.remove(ready)
+    return ordered
+
+
+def run_steps(plan: List[ScheduledStep], run: Callable[[ScheduledStep], None], concurrency: int):
+    """Runs all steps, respecting their dependencies
+
+    With a concurrency of 1 the steps run one after the other on the current thread. Otherwise every
+    step whose dependencies have finished is started on a worker pool of `concurrency` threads. After a
+    failure no new steps are started; running steps are allowed to finish before the error is raised.
+
+    Args:
+        plan: The steps to run, as returned by `plan_steps`
+        run: Function that executes a single step
+        concurrency: Maximum number of steps to run at the same time
+    """
+    if not isinstance(concurrency, int) or concurrency < 1:
+        raise ValueError(f"Concurrency should be a positive integer, got {concurrency}")
+
+    if concurrency == 1:
+        for step in _topological_order(plan):
+            run(step)
+    else:
+        _run_concurrently(plan, run, concurrency)
+
+
+def _run_concurrently(plan: List[ScheduledStep], run: Callable[[ScheduledStep], None], concurrency: int):
+    done: Set[str] = set()
+    pending = list(plan)
+    running: Dict[Future, ScheduledStep] = {}
+    errors: List[BaseException] = []
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="takeoff-step") as pool:
+        while pending or running:
+            ready = [_ for _ in pending if _.depends_on <= done] if not errors else []
+            for step in ready[: concurrency - len(running)]:
+                pending.remove(step)
+                running[pool.submit(run, step)] = step
+
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                step = running.pop(future)
+                error = future.exception()
+                if error:
+                    logger.error(f"Step {step.step_id} failed: {error}")
+                    errors.append(error)
+                else:
+                    done.add(step.step_id)
+
+    if errors:
+        if pending:
+            logger.error(f"Not running steps {[_.step_id for _ in pending]} because of earlier failures")
+        raise errors[0]
@@ -1,5 +1,7 @@
 import voluptuous as vol
 
+DEFAULT_KEYVAULT_CONCURRENCY = 8
+
 AZURE_KEYVAULT_KEYS_SCHEMA = {
     vol.Optional("active_directory_user"): vol.Schema(
         {
@@ -113,6 +115,11 @@ AZURE_SCHEMA = {
     ): str,
     vol.Optional("location", default="west europe"): str,
     vol.Optional("keyvault_keys"): AZURE_KEYVAULT_KEYS_SCHEMA,
+    vol.Optional(
+        "keyvault_concurrency",
+        default=DEFAULT_KEYVAULT_CONCURRENCY,
+        description="Maximum number of secrets to fetch from the KeyVault concurrently",
+    ): vol.All(int, vol.Range(min=1)),
     vol.Optional("common"): AZURE_COMMON,
 }
 
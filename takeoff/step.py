@@ -1,11 +1,13 @@
 import abc
 import logging
 import pprint
+from typing import FrozenSet
 
 import voluptuous as vol
 
 from takeoff.application_version import ApplicationVersion
 from takeoff.azure.credentials.keyvault import KeyVaultClient
+from takeoff.context import ContextKey
 from takeoff.credentials.application_name import ApplicationName
 
 logger = logging.getLogger(__name__)
@@ -15,10 +17,16 @@ class Step(object):
     """Base class for any Takeoff step
 
     Inheriting from this class will allow the user to create a new Step that will validate the schema
-    and expose the `run` function. After inheriting this, add the new class to `steps.py`. This will
-    enable Takeoff to pick it up from the `.takeoff/deployment.yml`.
+    and expose the `run` function. After inheriting this, add the import path of the new class to `steps.py`.
+    This will enable Takeoff to pick it up from the `.takeoff/deployment.yml`.
+
+    Steps that share data through the `Context` should list the keys they write in `produces` and
+    the keys they read in `consumes`. The scheduler uses these to order steps that run concurrently.
     """
 
+    produces: FrozenSet[ContextKey] = frozenset()
+    consumes: FrozenSet[ContextKey] = frozenset()
+
     def __init__(self, env: ApplicationVersion, config: dict):
         self.env = env
         self.config = self.validate(config)
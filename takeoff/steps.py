@@ -1,19 +1,33 @@
-from takeoff.azure.configure_eventhub import ConfigureEventHub
-from takeoff.azure.create_application_insights import CreateApplicationInsights
-from takeoff.azure.create_databricks_secrets import CreateDatabricksSecretsFromVault
-from takeoff.azure.deploy_to_databricks import DeployToDatabricks
-from takeoff.azure.deploy_to_kubernetes import DeployToKubernetes
-from takeoff.azure.publish_artifact import PublishArtifact
-from takeoff.build_artifact import BuildArtifact
-from takeoff.build_docker_image import DockerImageBuilder
+import importlib
+from typing import Dict, Optional, Union
 
-steps = {
-    "build_artifact": BuildArtifact,
-    "build_docker_image": DockerImageBuilder,
-    "create_application_insights": CreateApplicationInsights,
-    "create_databricks_secrets_from_vault": CreateDatabricksSecretsFromVault,
-    "configure_eventhub": ConfigureEventHub,
-    "deploy_to_databricks": DeployToDatabricks,
-    "deploy_to_kubernetes": DeployToKubernetes,
-    "publish_artifact": PublishArtifact,
+# Steps are registered by import path, so that the SDKs a step depends on are only imported when
+# a deployment actually uses that step.
+steps: Dict[str, Union[str, type]] = {
+    "build_artifact": "takeoff.build_artifact.BuildArtifact",
+    "build_docker_image": "takeoff.build_docker_image.DockerImageBuilder",
+    "create_application_insights": "takeoff.azure.create_application_insights.CreateApplicationInsights",
+    "create_databricks_secrets_from_vault": (
+        "takeoff.azure.create_databricks_secrets.CreateDatabricksSecretsFromVault"
+    ),
+    "configure_eventhub": "takeoff.azure.configure_eventhub.ConfigureEventHub",
+    "deploy_to_databricks": "takeoff.azure.deploy_to_databricks.DeployToDatabricks",
+    "deploy_to_kubernetes": "takeoff.azure.deploy_to_kubernetes.DeployToKubernetes",
+    "publish_artifact": "takeoff.azure.publish_artifact.PublishArtifact",
 }
+
+
+def get_step(task: str) -> Optional[type]:
+    """Returns the Step class for a task, importing its module if needed
+
+    Args:
+        task: The name of the task, as used in `.takeoff/deployment.yml`
+
+    Returns:
+        The Step class, or None if the task is unknown
+    """
+    step = steps.get(task)
+    if isinstance(step, str):
+        module, _, name = step.rpartition(".")
+        return getattr(importlib.import_module(module), name)
+    return step
@@ -0,0 +1,143 @@
+"""
+Records how long steps, shell commands and SDK calls take during a Takeoff run.
+
+Tracing is off by default. When enabled, for example through `takeoff --trace_file trace.json`, every
+span is kept in memory and written at the end of the run in the Chrome trace event format. The file
+can be opened in `chrome://tracing` or https://ui.perfetto.dev, and converted to OTLP by most
+tracing backends.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+from takeoff.context import Singleton
+
+logger = logging.getLogger(__name__)
+
+
+class Tracer(metaclass=Singleton):
+    def __init__(self):
+        self.enabled = False
+        self._events: List[Dict[str, Any]] = []
+        self._threads: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def clear(self):
+        with self._lock:
+            self._events = []
+            self._threads = {}
+
+    @contextmanager
+    def span(self, name: str, category: str, **args) -> Iterator[dict]:
+        """Records the duration of the enclosed block as a single span
+
+        Args:
+            name: Name of the span, for example the task name or the SDK method
+            category: Kind of span, for example `step`, `shell` or the SDK the call was made to
+            args: Additional information to attach to the span
+
+        Returns:
+            The span arguments, which the enclosed block can add results to
+        """
+        if not self.enabled:
+            yield args
+            return
+
+        start = time.time()
+        try:
+            yield args
+        except BaseException as e:
+            args["error"] = repr(e)
+            raise
+        finally:
+            self._record(name, category, start, time.time() - start, args)
+
+    def _record(self, name: str, category: str, start: float, duration: float, args: dict):
+        thread = threading.current_thread()
+        tid = thread.ident or 0
+        event = {
+            "name": name,
+            "cat": category,
+            "ph": "X",
+            "ts": int(start * 1e6),
+            "dur": int(duration * 1e6),
+            "pid": os.getpid(),
+            "tid": tid,
+            "args": args,
+        }
+        with self._lock:
+            self._events.append(event)
+            self._threads[tid] = thread.name
+
+    @property
+    def events(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            thread_names = [
+                {"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+                for tid, name in self._threads.items()
+            ]
+            return thread_names + list(self._events)
+
+    def write(self, path: str):
+        """Writes all recorded spans to `path` as a Chrome trace file"""
+        with open(path, "w") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+        logger.info(f"Written trace of {len(self._events)} spans to {path}")
+
+
+class _TracedProxy(object):
+    """Wraps an SDK client such that every public method call is recorded as a span. Attributes that
+    hold groups of operations, like `EventHubManagementClient.consumer_groups`, are wrapped as well."""
+
+    def __init__(self, target: Any, name: str, record_args: bool):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_record_args", record_args)
+
+    def __getattr__(self, attribute: str) -> Any:
+        value = getattr(self._target, attribute)
+        name = f"{self._name}.{attribute}"
+        if attribute.startswith("_"):
+            return value
+        if type(value).__name__.endswith("Operations"):
+            return _TracedProxy(value, name, self._record_args)
+        if callable(value) and not isinstance(value, type):
+            return self._wrap(value, name)
+        return value
+
+    def __setattr__(self, attribute: str, value: Any):
+        setattr(self._target, attribute, value)
+
+    def _wrap(self, method, name: str):
+        category = self._name.split(".")[0]
+
+        def traced_method(*args, **kwargs):
+            span_args = {"args": [_ for _ in args if isinstance(_, str)]} if self._record_args else {}
+            with Tracer().span(name, category, **span_args):
+                return method(*args, **kwargs)
+
+        return traced_method
+
+
+def traced(client: Any, name: str, record_args: bool = False) -> Any:
+    """Records a span for every call made through the SDK client, if tracing is enabled
+
+    Args:
+        client: The SDK client
+        name: Prefix for the span names, also used as the span category
+        record_args: Whether to attach the string positional arguments of each call to its span. Only
+            enable this for clients whose positional arguments cannot contain secrets.
+
+    Returns:
+        The client itself when tracing is disabled, otherwise a proxy to it
+    """
+    if not Tracer().enabled:
+        return client
+    return _TracedProxy(client, name, record_args)
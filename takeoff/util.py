@@ -3,14 +3,28 @@ import importlib
 import logging
 import os
 import pkgutil
+import selectors
+import signal
 import subprocess
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import Callable, List, Pattern, Union, Tuple
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from types import ModuleType
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Pattern, Union, Tuple
 
 import jinja2
-from git import Repo
+from git import Object, Repo
+from git.util import hex_to_bin
 from yaml import load, SafeLoader
 
+from takeoff.tracing import Tracer
+
 logger = logging.getLogger(__name__)
 
 
@@ -57,15 +71,93 @@ def render_file_with_jinja(path: str, params: dict, parse_function: Callable) ->
     return parse_function(rendered)
 
 
+@dataclass(frozen=True)
+class GitInfo(object):
+    """Snapshot of the git metadata Takeoff needs to determine the application version"""
+
+    sha: str
+    short_hash: str
+    tag: Optional[str]
+
+
+_git_info: Optional[GitInfo] = None
+_git_info_lock = threading.Lock()
+
+
+def _peel(repo: Repo, sha: str) -> str:
+    """Returns the sha of the commit an (annotated) tag object points to"""
+    obj = Object.new_from_sha(repo, hex_to_bin(sha))
+    while obj.type == "tag":
+        obj = obj.object
+    return obj.hexsha
+
+
+def _tags_by_commit(repo: Repo) -> Dict[str, List[str]]:
+    """Builds a reverse index from commit sha to the names of the tags pointing at it
+
+    Tags are read directly from `packed-refs` and the loose refs in `refs/tags`, instead of
+    dereferencing every tag through git. Only loose annotated tags need to be peeled, packed
+    refs carry their peeled commit already.
+
+    Args:
+        repo: The git repository
+
+    Returns:
+        Tag names per commit sha, sorted by name
+    """
+    tags: Dict[str, str] = {}
+    packed_refs = os.path.join(repo.common_dir, "packed-refs")
+    if os.path.isfile(packed_refs):
+        with open(packed_refs) as f:
+            name = None
+            for line in f:
+                if line.startswith("^") and name:
+                    tags[name] = line[1:].strip()
+                elif not line.startswith("#"):
+                    sha, ref = line.split()
+                    name = ref.replace("refs/tags/", "", 1) if ref.startswith("refs/tags/") else None
+                    if name:
+                        tags[name] = sha
+
+    tags_dir = os.path.join(repo.common_dir, "refs", "tags")
+    for root, _, files in os.walk(tags_dir):
+        for file_ in files:
+            with open(os.path.join(root, file_)) as f:
+                name = os.path.relpath(os.path.join(root, file_), tags_dir).replace(os.sep, "/")
+                tags[name] = _peel(repo, f.read().strip())
+
+    index: Dict[str, List[str]] = {}
+    for name in sorted(tags):
+        index.setdefault(tags[name], []).append(name)
+    return index
+
+
+def get_git_info() -> GitInfo:
+    """Returns the git metadata of the current repository. It is read once per run.
+
+    Returns:
+        The commit sha, short hash and the tag on HEAD, if any
+    """
+    global _git_info
+    with _git_info_lock:
+        if _git_info is None:
+            repo = Repo(search_parent_directories=True)
+            sha = repo.head.object.hexsha
+            tags = _tags_by_commit(repo).get(sha, [])
+            short_hash = repo.git.rev_parse(sha, short=7)
+            _git_info = GitInfo(sha=sha, short_hash=short_hash, tag=next(iter(tags), None))
+        return _git_info
+
+
 def get_tag() -> Union[None, str]:
-    repo = Repo(search_parent_directories=True)
-    return next((tag for tag in repo.tags if tag.commit == repo.head.commit), None)
+    return get_git_info().tag
 
 
 def get_short_hash(n: int = 7) -> str:
-    repo = Repo(search_parent_directories=True)
-    sha = repo.head.object.hexsha
-    return repo.git.rev_parse(sha, short=n)
+    git_info = get_git_info()
+    if n == len(git_info.short_hash):
+        return git_info.short_hash
+    return Repo(search_parent_directories=True).git.rev_parse(git_info.sha, short=n)
 
 
 def b64_encode(s: str) -> str:
@@ -194,32 +286,311 @@ def get_jar_name(build_definition_name: str, artifact_tag: str, file_ext: str) -
     return f"{build_definition_name}/{build_definition_name}-{artifact_tag}{file_ext}"
 
 
-def run_shell_command(command: List[str]) -> Tuple[int, List]:
+_output = threading.local()
+
+# number of lines of stdout of a shell command that are kept in memory and returned
+SHELL_OUTPUT_TAIL = 10000
+# seconds between writes of shell command output to the log
+SHELL_FLUSH_INTERVAL = 0.2
+# seconds a timed out shell command gets to stop before it is killed
+SHELL_KILL_GRACE_PERIOD = 5
+DEFAULT_SHELL_CONCURRENCY = 4
+
+
+@contextmanager
+def output_prefix(prefix: str) -> Iterator[None]:
+    """Prefixes every line of output that `run_shell_command` prints on the current thread. This keeps
+    the output of commands that run concurrently apart.
+
+    Args:
+        prefix: The text to put in front of every line, for example `[Dockerfile] `
+    """
+    previous = getattr(_output, "prefix", "")
+    _output.prefix = previous + prefix
+    try:
+        yield
+    finally:
+        _output.prefix = previous
+
+
+class _ShellOutput(object):
+    """Prints the output of a command in batches, and keeps only the last lines of its stdout in memory
+
+    Lines of stderr are printed to stderr, but not kept.
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.lines: Deque[str] = deque(maxlen=SHELL_OUTPUT_TAIL)
+        self._batches: Dict[bool, List[str]] = {False: [], True: []}
+        self._flushed = time.monotonic()
+
+    def add(self, line: str, stderr: bool = False):
+        if not stderr:
+            self.lines.append(line)
+        self._batches[stderr].append(f"{self.prefix}{line.rstrip()}\n")
+
+    def flush(self, force: bool = True):
+        if not force and time.monotonic() - self._flushed < SHELL_FLUSH_INTERVAL:
+            return
+        for stderr, stream in ((False, sys.stdout), (True, sys.stderr)):
+            if self._batches[stderr]:
+                stream.write("".join(self._batches[stderr]))
+                stream.flush()
+                self._batches[stderr] = []
+        self._flushed = time.monotonic()
+
+
+def _read_output(process: subprocess.Popen, output: _ShellOutput, deadline: Optional[float]) -> bool:
+    """Reads stdout and stderr of the process until both are closed, or until the deadline passes
+
+    Returns:
+        Whether all output was read before the deadline
+    """
+    partial_lines: Dict[int, bytes] = {}
+    stderr_fd = process.stderr.fileno() if process.stderr is not None else None
+    with selectors.DefaultSelector() as selector:
+        for stream in (process.stdout, process.stderr):
+            if stream is not None:
+                selector.register(stream, selectors.EVENT_READ)
+                partial_lines[stream.fileno()] = b""
+        while selector.get_map():
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            for key, _ in selector.select(SHELL_FLUSH_INTERVAL):
+                chunk = os.read(key.fd, 1 << 16)
+                if not chunk:
+                    selector.unregister(key.fileobj)
+                    # the last line may not end with a newline
+                    chunk = b"\n" if partial_lines[key.fd] else b""
+                *lines, partial_lines[key.fd] = (partial_lines[key.fd] + chunk).split(b"\n")
+                for line in lines:
+                    output.add(line.decode(errors="replace") + "\n", stderr=key.fd == stderr_fd)
+            output.flush(force=False)
+    return True
+
+
+def _kill_process_group(process: subprocess.Popen):
+    """Stops the process and everything it started, forcefully if it does not stop within a few seconds"""
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        try:
+            process.wait(SHELL_KILL_GRACE_PERIOD)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def run_shell_command(
+    command: List[str], env: Optional[Dict[str, str]] = None, timeout: Optional[float] = None
+) -> Tuple[int, List]:
     """Runs a shell command using `subprocess.Popen`
 
     In addition to running any bash command, the output of process is streamed directly to the stdout.
+    The stdout and stderr of the command are printed to stdout and stderr, in batches at most every
+    `SHELL_FLUSH_INTERVAL` seconds. Only the last `SHELL_OUTPUT_TAIL` lines of stdout are kept in memory
+    and returned.
+
+    Args:
+        command: The command and its arguments
+        env: Environment variables to set for the command, on top of the current environment
+        timeout: Number of seconds after which the command and all processes it started are killed
+
+    Returns:
+        The result of the bash command. 0 for success, >=1 for failure, negative when the command was
+        killed. And the lines of stdout, at most the last `SHELL_OUTPUT_TAIL` of them.
+    """
+    with Tracer().span(" ".join(command[:2]), "shell") as span_args:
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        output = _ShellOutput(getattr(_output, "prefix", ""))
+        with subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd="./",
+            env={**os.environ, **env} if env else None,
+            # a separate process group allows killing everything the command started on a timeout
+            start_new_session=timeout is not None,
+        ) as process:
+            try:
+                finished = _read_output(process, output, deadline)
+                remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+                if finished:
+                    process.wait(remaining)
+            except subprocess.TimeoutExpired:
+                finished = False
+            finally:
+                output.flush()
+            if not finished:
+                logger.error(f"{' '.join(command[:2])} did not finish within {timeout} seconds, killing it")
+                _kill_process_group(process)
+                process.wait()
+        span_args["returncode"] = process.returncode
+    return process.returncode, list(output.lines)
+
+
+def run_shell_commands(
+    commands: List[List[str]],
+    max_concurrency: int = DEFAULT_SHELL_CONCURRENCY,
+    prefixes: Optional[List[str]] = None,
+    env: Optional[Dict[str, str]] = None,
+) -> List[Tuple[int, List]]:
+    """Runs several shell commands at the same time, like `run_shell_command`
+
+    Every command runs on a worker thread, so this can be called from any thread. The output of the
+    commands is printed as it arrives, every line prefixed with the command it came from. A failing
+    command does not stop the others.
+
+    Args:
+        commands: The commands and their arguments
+        max_concurrency: The maximum number of commands to run at the same time
+        prefixes: The prefix for every line of output of each command. Defaults to the name of the
+            program and the position of the command, for example `[kubectl 2] `
+        env: Environment variables to set for the commands, on top of the current environment
+
+    Returns:
+        The return code and the last lines of stdout of every command, in the order of `commands`
+    """
+    if not commands:
+        return []
+    thread_prefix = getattr(_output, "prefix", "")
+    if prefixes is None:
+        prefixes = [f"[{cmd[0]} {i + 1}] " for i, cmd in enumerate(commands)]
+
+    def run(command: List[str], prefix: str) -> Tuple[int, List]:
+        # the output prefix is thread local, the worker starts from the prefix of the calling thread
+        with output_prefix(thread_prefix + prefix):
+            return run_shell_command(command, env=env)
+
+    with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="shell") as pool:
+        return list(pool.map(run, commands, prefixes))
+
+
+def http_status_code(error: Exception) -> Optional[int]:
+    """Returns the HTTP status code of an error raised by an SDK client, if there is one"""
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def is_throttled_or_unavailable(error: Exception) -> bool:
+    """Whether an error was caused by throttling (429) or a server side problem (5xx)"""
+    status_code = http_status_code(error)
+    return status_code is not None and (status_code == 429 or status_code >= 500)
+
+
+def retry_after_seconds(headers: Dict[str, str]) -> Optional[float]:
+    """The delay the `Retry-After` header asks for, given in seconds or as an HTTP date
+
+    Returns:
+        The number of seconds to wait, or None when there is no header or it cannot be parsed
+    """
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def call_with_retries(
+    func: Callable[[], Any],
+    should_retry: Callable[[Exception], bool] = is_throttled_or_unavailable,
+    max_attempts: int = 5,
+    backoff_seconds: float = 0.5,
+) -> Any:
+    """Calls a function, retrying with exponential backoff when it raises a retryable error
+
+    When the error carries a `Retry-After` header, in seconds or as an HTTP date, that delay is used
+    instead of the backoff.
+
+    Args:
+        func: The function to call
+        should_retry: Decides whether an error is worth retrying
+        max_attempts: The maximum number of calls
+        backoff_seconds: The delay before the first retry, doubled for every next retry
 
     Returns:
-        The result of the bash command. 0 for success, >=1 for failure.
+        The result of the function
+    """
+    for attempt in range(1, max_attempts + 1):
+        try:
+            return func()
+        except Exception as e:
+            if attempt == max_attempts or not should_retry(e):
+                raise e
+            headers = getattr(getattr(e, "response", None), "headers", None) or {}
+            delay = retry_after_seconds(headers)
+            if delay is None:
+                delay = backoff_seconds * 2 ** (attempt - 1)
+            logger.warning(f"Attempt {attempt} of {max_attempts} failed with '{e}', retrying in {delay}s")
+            time.sleep(delay)
+
+
+class TakeoffPluginRegistry(object):
+    """The Takeoff plugins found on the path, with their hooks resolved by name"""
+
+    def __init__(self, plugins: Dict[str, ModuleType]):
+        self.plugins = plugins
+        self._hooks: Dict[str, Optional[Callable]] = {}
+
+    def hook(self, name: str) -> Optional[Callable]:
+        """Returns the function `name` of the first plugin that defines it
+
+        Args:
+            name: The name of the plugin function, for example `deploy_env_logic`
+
+        Returns:
+            The plugin function, or None if no plugin defines it
+        """
+        if name not in self._hooks:
+            self._hooks[name] = next(
+                (getattr(plugin, name) for plugin in self.plugins.values() if hasattr(plugin, name)), None
+            )
+        return self._hooks[name]
+
+
+_plugin_registry: Dict[Tuple[str, Tuple[str, ...]], TakeoffPluginRegistry] = {}
+_plugin_registry_lock = threading.Lock()
+
+
+def takeoff_plugin_registry() -> TakeoffPluginRegistry:
+    """Returns the registry of Takeoff plugins, scanning `sys.path` only when it has not been scanned yet
+
+    The registry is rebuilt when `sys.path` or the plugin prefix changes, or after
+    `invalidate_takeoff_plugins` has been called.
+
+    https://packaging.python.org/guides/creating-and-discovering-plugins/
     """
-    process = subprocess.Popen(command, stdout=subprocess.PIPE, cwd="./", universal_newlines=True)
-    output_lines = []
-    while True:
-        output = process.stdout.readline()
-        if output == "" and process.poll() is not None:
-            break
-        if output:
-            print(output.strip())
-            output_lines.append(output)
-    return process.poll(), output_lines
-
-
-def load_takeoff_plugins():
+    global _plugin_registry
+    key = (DEFAULT_TAKEOFF_PLUGIN_PREFIX, tuple(sys.path))
+    with _plugin_registry_lock:
+        if key not in _plugin_registry:
+            plugins = {
+                name: importlib.import_module(name)
+                for finder, name, ispkg in pkgutil.iter_modules()
+                if name.startswith(DEFAULT_TAKEOFF_PLUGIN_PREFIX)
+            }
+            logging.info(f"Found Takeoff plugins {plugins}")
+            _plugin_registry = {key: TakeoffPluginRegistry(plugins)}
+        return _plugin_registry[key]
+
+
+def invalidate_takeoff_plugins():
+    """Forces the next lookup of a Takeoff plugin to rescan `sys.path`"""
+    global _plugin_registry
+    with _plugin_registry_lock:
+        _plugin_registry = {}
+
+
+def load_takeoff_plugins() -> Dict[str, ModuleType]:
     """https://packaging.python.org/guides/creating-and-discovering-plugins/"""
-    plugins = {
-        name: importlib.import_module(name)
-        for finder, name, ispkg in pkgutil.iter_modules()
-        if name.startswith(DEFAULT_TAKEOFF_PLUGIN_PREFIX)
-    }
-    logging.info(f"Found Takeoff plugins {plugins}")
-    return plugins
+    return takeoff_plugin_registry().plugins
@@ -4,6 +4,9 @@ from dataclasses import dataclass
 
 import mock
 
+from takeoff.azure.credentials.keyvault_credentials_provider import KeyVaultSecretCache
+from takeoff.credentials.client_pool import ClientPool
+
 
 @dataclass
 class MockKeyVaultId:
@@ -53,13 +56,17 @@ CONFIG = {"azure": {"keyvault_keys":
 
 class KeyVaultBaseTest(unittest.TestCase):
 
+    def setUp(self):
+        KeyVaultSecretCache.clear()
+        ClientPool().clear()
+
     def construct_keyvault_mock(self):
         m_client = mock.Mock()
         m_client.configure_mock(
             **{'get_secrets.return_value':
                    list(map(MockKeyVaultId, map(lambda x: f"{PREFIX}{x[0]}", VALUES))),
                'get_secret.side_effect':
-                   list(map(MockKeyVaultSecret, map(lambda x: x[1], VALUES)))
+                   lambda vault, key, version: MockKeyVaultSecret(dict(VALUES)[key])
                })
         return m_client
 
@@ -18,3 +18,14 @@ class TestKeyVaultClient(EnvironmentKeyBaseTest):
             "takeoff.azure.credentials.keyvault.AzureKeyVaultClient",
             {"credentials": "mylittlepony"}
         )
+
+    @mock.patch("takeoff.azure.credentials.keyvault.ServicePrincipalCredentials.credentials")
+    @mock.patch("takeoff.azure.credentials.keyvault.AzureKeyVaultClient")
+    def test_client_is_shared(self, m_client, m_creds):
+        env = ApplicationVersion("DEV", "04fab6", "my-branch")
+        config = {"azure": {"keyvault_naming": "myvault{env}"}}
+
+        first = victim.vault_and_client(config, env)
+        assert victim.vault_and_client(config, env) == first
+        m_client.assert_called_once()
+        m_creds.assert_called_once()
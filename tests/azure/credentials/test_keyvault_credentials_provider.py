@@ -1,11 +1,19 @@
 from unittest import mock
 
+import pytest
 from azure.keyvault.models import SecretBundle
 
-from takeoff.azure.credentials.keyvault_credentials_provider import KeyVaultCredentialsMixin
+from takeoff.azure.credentials.keyvault_credentials_provider import (
+    KeyVaultCredentialsMixin,
+    KeyVaultSecretCache,
+)
+from tests.azure.credentials.base_keyvault_test import MockKeyVaultSecret, PREFIX, VALUES
 
 
 class TestAzureKeyVaultCredentialsMixin(object):
+    def setup_method(self):
+        KeyVaultSecretCache.clear()
+
     @mock.patch(
         "takeoff.azure.credentials.keyvault_credentials_provider.KeyVaultCredentialsMixin._credentials",
         return_value={"key1": "foo", "key2": "bar"},
@@ -31,3 +39,49 @@ class TestAzureKeyVaultCredentialsMixin(object):
 
         res = KeyVaultCredentialsMixin(None, client)._credentials(["databricks-token", "databricks-host"])
         assert len(res) == 2
+
+
+class TestKeyVaultSecretCache(object):
+    def setup_method(self):
+        KeyVaultSecretCache.clear()
+
+    @staticmethod
+    def client():
+        client = mock.MagicMock()
+        client.get_secrets.return_value = [SecretBundle(id=f"{PREFIX}{k}") for k, _ in VALUES]
+        client.get_secret.side_effect = lambda vault, key, version: MockKeyVaultSecret(dict(VALUES)[key])
+        return client
+
+    def test_fetches_only_requested_keys(self):
+        client = self.client()
+        res = KeyVaultCredentialsMixin("vault", client)._credentials(["databricks-token", "databricks-host"])
+
+        assert res == {"databricks-token": "dbtoken", "databricks-host": "dbhost"}
+        assert client.get_secret.call_count == 2
+
+    def test_vault_listed_once_per_run(self):
+        client = self.client()
+        KeyVaultCredentialsMixin("vault", client)._credentials(["databricks-token"])
+        KeyVaultCredentialsMixin("vault", self.client())._credentials(["databricks-token", "az-username"])
+
+        client.get_secrets.assert_called_once_with("vault")
+        assert client.get_secret.call_count == 2
+
+    def test_missing_key(self):
+        with pytest.raises(ValueError):
+            KeyVaultCredentialsMixin("vault", self.client())._credentials(["unknown"])
+
+    def test_prefixed_secrets_use_cache(self):
+        client = self.client()
+        KeyVaultCredentialsMixin("vault", client)._credentials(["databricks-token"])
+        res = KeyVaultCredentialsMixin("vault", client).get_keyvault_secrets("databricks")
+
+        assert {_.key: _.val for _ in res} == {"host": "dbhost", "token": "dbtoken"}
+        client.get_secrets.assert_called_once()
+        assert client.get_secret.call_count == 2
+
+    def test_get_many_preserves_order(self):
+        keys = [k for k, _ in VALUES]
+        res = KeyVaultSecretCache("vault", self.client()).get_many(keys, max_workers=4)
+
+        assert res == [v for _, v in VALUES]
@@ -1,5 +1,7 @@
+import mock
+
 from takeoff.azure.credentials.storage_account import BlobStore as victim
-from tests.azure.credentials.base_keyvault_test import KeyVaultBaseTest
+from tests.azure.credentials.base_keyvault_test import KeyVaultBaseTest, CONFIG
 
 
 class TestBlobStore(KeyVaultBaseTest):
@@ -11,3 +13,16 @@ class TestBlobStore(KeyVaultBaseTest):
             "takeoff.azure.credentials.storage_account.BlockBlobService",
             {'account_name': "blobname", 'account_key': "blobkey"}
         )
+
+    def test_block_size_has_its_own_client(self):
+        store = victim("vault", self.construct_keyvault_mock())
+        with mock.patch("takeoff.azure.credentials.storage_account.BlockBlobService",
+                        side_effect=lambda **kwargs: mock.Mock(MAX_BLOCK_SIZE=4 * 1024 * 1024)):
+            default = store.service_client(CONFIG)
+            large_blocks = store.service_client(CONFIG, block_size_mb=16)
+
+            assert store.service_client(CONFIG, block_size_mb=16) is large_blocks
+
+        assert default is not large_blocks
+        assert default.MAX_BLOCK_SIZE == 4 * 1024 * 1024
+        assert large_blocks.MAX_BLOCK_SIZE == large_blocks.MAX_SINGLE_PUT_SIZE == 16 * 1024 * 1024
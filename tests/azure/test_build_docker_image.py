@@ -1,13 +1,16 @@
 import base64
 import os
+import threading
 
 import mock
 import pytest
+import requests
 
 from takeoff.application_version import ApplicationVersion
-from takeoff.build_docker_image import DockerImageBuilder, DockerFile
+from takeoff.build_docker_image import DockerImageBuilder, DockerFile, context_digest
 from takeoff.credentials.container_registry import DockerCredentials
 from tests.azure import takeoff_config
+from tests.fake_registry import FakeRegistry
 
 BASE_CONF = {"task": "build_docker_image"}
 
@@ -170,7 +173,8 @@ class TestDockerImageBuilder:
                                   "CI_COMMIT_REF_SLUG": "2.1.0"})
     @mock.patch("takeoff.build_docker_image.run_shell_command", return_value=(0, ['output_lines']))
     @mock.patch("takeoff.application_version.get_tag", return_value="2.1.0")
-    def test_deploy_release(self, m_tag, m_bash, victim_release: DockerImageBuilder):
+    @mock.patch("takeoff.build_docker_image.DockerRegistryClient")
+    def test_deploy_release(self, m_registry, m_tag, m_bash, victim_release: DockerImageBuilder):
         files = [DockerFile("Dockerfile", None, None, None, True), DockerFile("File2", "-foo", None, "mycustom/repo", False)]
 
         victim_release.deploy(files)
@@ -178,8 +182,227 @@ class TestDockerImageBuilder:
         build_call_2 = ["docker", "build", "--build-arg", "PIP_EXTRA_INDEX_URL=url/to/artifact/store", "-t", "mycustom/repo-foo:2.1.0", "-f", "./File2", "."]
 
         push_call_1 = ["docker", "push", "pony/myapp:2.1.0"]
-        tag_call_latest = ["docker", "tag", "pony/myapp:2.1.0", "pony/myapp:latest"]
-        push_call_1_latest = ["docker", "push", "pony/myapp:latest"]
         push_call_2 = ["docker", "push", "mycustom/repo-foo:2.1.0"]
-        calls = list(map(mock.call, [build_call_1, push_call_1, tag_call_latest, push_call_1_latest, build_call_2, push_call_2]))
-        m_bash.assert_has_calls(calls)
+        calls = list(map(mock.call, [build_call_1, push_call_1, build_call_2, push_call_2]))
+        assert m_bash.call_args_list == calls
+        m_registry.assert_called_once_with("pony", "My", "Little")
+        m_registry.return_value.add_tags.assert_called_once_with("myapp", "2.1.0", ["latest"])
+
+    @mock.patch.dict(os.environ, {"PIP_EXTRA_INDEX_URL": "url/to/artifact/store",
+                                  "CI_PROJECT_NAME": "myapp",
+                                  "CI_COMMIT_REF_SLUG": "SNAPSHOT"})
+    @mock.patch("takeoff.application_version.get_tag", return_value=None)
+    def test_deploy_parallel(self, m_tag, victim: DockerImageBuilder):
+        files = [DockerFile("Dockerfile", None, None, None, True),
+                 DockerFile("File2", "-foo", None, None, False)]
+        victim.config["parallelism"] = 2
+        barrier = threading.Barrier(2, timeout=5)
+        calls = []
+
+        def run(cmd):
+            if cmd[1] == "build":
+                # both builds have to be running at the same time to pass the barrier
+                barrier.wait()
+            calls.append(cmd)
+            return 0, []
+
+        with mock.patch("takeoff.build_docker_image.run_shell_command", side_effect=run):
+            victim.deploy(files)
+
+        pushes = [_ for _ in calls if _[1] == "push"]
+        assert sorted(pushes) == [["docker", "push", "pony/myapp-foo:SNAPSHOT"],
+                                  ["docker", "push", "pony/myapp:SNAPSHOT"]]
+        for push in pushes:
+            build = next(_ for _ in calls if _[1] == "build" and _[5] == push[2])
+            assert calls.index(push) > calls.index(build)
+
+    @mock.patch.dict(os.environ, {"PIP_EXTRA_INDEX_URL": "url/to/artifact/store",
+                                  "CI_PROJECT_NAME": "myapp",
+                                  "CI_COMMIT_REF_SLUG": "SNAPSHOT"})
+    @mock.patch("takeoff.application_version.get_tag", return_value=None)
+    def test_deploy_parallel_failure(self, m_tag, victim: DockerImageBuilder):
+        files = [DockerFile("Dockerfile", None, None, None, True),
+                 DockerFile("File2", "-foo", None, None, False)]
+        victim.config["parallelism"] = 2
+
+        def run(cmd):
+            return (1 if cmd[-2] == "./Dockerfile" else 0), []
+
+        with mock.patch("takeoff.build_docker_image.run_shell_command", side_effect=run) as m_bash:
+            with pytest.raises(ChildProcessError):
+                victim.deploy(files)
+
+        m_bash.assert_any_call(["docker", "push", "pony/myapp-foo:SNAPSHOT"])
+
+    @mock.patch.dict(os.environ, ENV_VARIABLES)
+    @mock.patch("takeoff.build_docker_image.run_shell_command", return_value=(0, ['output_lines']))
+    def test_build_image_with_inline_cache(self, m_bash):
+        DockerImageBuilder.build_image("Thefile", "stag", ["cache:branch"], inline_cache=True)
+        m_bash.assert_called_once_with(
+            ["docker", "build", "--build-arg", "PIP_EXTRA_INDEX_URL=url/to/artifact/store",
+             "--cache-from", "cache:branch", "--build-arg", "BUILDKIT_INLINE_CACHE=1",
+             "-t", "stag", "-f", "./Thefile", "."],
+            env={"DOCKER_BUILDKIT": "1"},
+        )
+
+    @mock.patch.dict(os.environ, {"PIP_EXTRA_INDEX_URL": "url/to/artifact/store",
+                                  "CI_PROJECT_NAME": "myapp",
+                                  "CI_COMMIT_REF_SLUG": "SNAPSHOT"})
+    @mock.patch("takeoff.application_version.get_tag", return_value=None)
+    def test_deploy_pulls_cache_images(self, m_tag, victim: DockerImageBuilder):
+        victim.config["cache_from"] = ["branch", "latest", "other/image:1.0"]
+
+        with mock.patch("takeoff.build_docker_image.run_shell_command", return_value=(0, [])) as m_bash, \
+                mock.patch("takeoff.build_docker_image.run_shell_commands",
+                           return_value=[(1, []), (0, []), (0, [])]) as m_bash_concurrent:
+            victim.deploy([DockerFile("Dockerfile", None, None, None, True)])
+
+        pulls = [["docker", "pull", "pony/myapp:SNAPSHOT"],
+                 ["docker", "pull", "pony/myapp:latest"],
+                 ["docker", "pull", "other/image:1.0"]]
+        assert m_bash_concurrent.call_args[0][0] == pulls
+        cache_args = ["--cache-from", "pony/myapp:SNAPSHOT", "--cache-from", "pony/myapp:latest",
+                      "--cache-from", "other/image:1.0"]
+        calls = [["docker", "build", "--build-arg", "PIP_EXTRA_INDEX_URL=url/to/artifact/store", *cache_args,
+                  "-t", "pony/myapp:SNAPSHOT", "-f", "./Dockerfile", "."],
+                 ["docker", "push", "pony/myapp:SNAPSHOT"]]
+        m_bash.assert_has_calls(list(map(mock.call, calls)))
+
+    @mock.patch.dict(os.environ, {"PIP_EXTRA_INDEX_URL": "url/to/artifact/store",
+                                  "CI_PROJECT_NAME": "myapp",
+                                  "CI_COMMIT_REF_SLUG": "2.1.0"})
+    @mock.patch("takeoff.build_docker_image.run_shell_command", return_value=(0, ['output_lines']))
+    @mock.patch("takeoff.application_version.get_tag", return_value="2.1.0")
+    @mock.patch("takeoff.build_docker_image.DockerRegistryClient")
+    def test_deploy_with_cache_repository(self, m_registry, m_tag, m_bash, victim_release):
+        victim_release.config.update(cache_from=["latest"], cache_repository="pony/cache", inline_cache=True)
+
+        victim_release.deploy([DockerFile("Dockerfile", None, None, None, True)])
+
+        m_bash.assert_any_call(
+            ["docker", "build", "--build-arg", "PIP_EXTRA_INDEX_URL=url/to/artifact/store",
+             "--cache-from", "pony/cache/myapp:latest", "--build-arg", "BUILDKIT_INLINE_CACHE=1",
+             "-t", "pony/myapp:2.1.0", "-f", "./Dockerfile", "."],
+            env={"DOCKER_BUILDKIT": "1"},
+        )
+        calls = [["docker", "push", "pony/myapp:2.1.0"],
+                 ["docker", "tag", "pony/myapp:2.1.0", "pony/cache/myapp:2.1.0"],
+                 ["docker", "push", "pony/cache/myapp:2.1.0"],
+                 ["docker", "tag", "pony/myapp:2.1.0", "pony/cache/myapp:latest"],
+                 ["docker", "push", "pony/cache/myapp:latest"]]
+        m_bash.assert_has_calls(list(map(mock.call, calls)))
+        assert ["docker", "pull", "pony/cache/myapp:latest"] not in [_[0][0] for _ in m_bash.call_args_list]
+
+
+def test_context_digest(tmp_path):
+    (tmp_path / "Dockerfile").write_text("FROM python:3.7")
+    (tmp_path / "app.py").write_text("print('hello')")
+    (tmp_path / "notes.md").write_text("notes")
+    (tmp_path / ".dockerignore").write_text("# comment\n*.md\n")
+    digest = context_digest("Dockerfile", ["ARG=1"], str(tmp_path))
+
+    (tmp_path / "notes.md").write_text("other notes")
+    assert context_digest("Dockerfile", ["ARG=1"], str(tmp_path)) == digest
+    assert context_digest("Dockerfile", ["ARG=2"], str(tmp_path)) != digest
+
+    (tmp_path / "app.py").write_text("print('world')")
+    assert context_digest("Dockerfile", ["ARG=1"], str(tmp_path)) != digest
+
+
+@mock.patch.dict(os.environ, {"PIP_EXTRA_INDEX_URL": "url/to/artifact/store"})
+@mock.patch("takeoff.application_version.get_tag", return_value=None)
+@mock.patch("takeoff.build_docker_image.context_digest", return_value="ab" * 32)
+class TestSkipUnchanged:
+    content_tag = "pony/myapp:content-" + "ab" * 20
+
+    def test_existing_image_is_retagged(self, _, __, victim: DockerImageBuilder):
+        victim.config["skip_unchanged"] = True
+        with mock.patch.object(DockerImageBuilder, "_image_exists", return_value=True) as m_exists, \
+                mock.patch.object(DockerImageBuilder, "add_tags") as m_add_tags, \
+                mock.patch("takeoff.build_docker_image.run_shell_command", return_value=(0, [])) as m_bash:
+            victim.deploy([DockerFile("Dockerfile", None, None, None, True)])
+
+        m_exists.assert_called_once_with(self.content_tag)
+        m_add_tags.assert_called_once_with(self.content_tag, ["SNAPSHOT"])
+        m_bash.assert_not_called()
+
+    def test_new_image_is_built_and_tagged_with_content_hash(self, _, __, victim: DockerImageBuilder):
+        victim.config["skip_unchanged"] = True
+        with mock.patch.object(DockerImageBuilder, "_image_exists", return_value=False), \
+                mock.patch.object(DockerImageBuilder, "add_tags") as m_add_tags, \
+                mock.patch("takeoff.build_docker_image.run_shell_command", return_value=(0, [])) as m_bash:
+            victim.deploy([DockerFile("Dockerfile", None, None, None, True)])
+
+        calls = [["docker", "build", "--build-arg", "PIP_EXTRA_INDEX_URL=url/to/artifact/store",
+                  "-t", "pony/myapp:SNAPSHOT", "-f", "./Dockerfile", "."],
+                 ["docker", "push", "pony/myapp:SNAPSHOT"]]
+        assert m_bash.call_args_list == list(map(mock.call, calls))
+        m_add_tags.assert_called_once_with("pony/myapp:SNAPSHOT", [self.content_tag.rpartition(":")[2]])
+
+    def test_image_exists_uses_registry_credentials(self, _, __, victim: DockerImageBuilder):
+        with mock.patch("takeoff.build_docker_image.DockerRegistryClient") as m_client:
+            victim._image_exists("pony/myapp:tag")
+            victim._image_exists("other.io/app:tag")
+
+        m_client.assert_has_calls([mock.call("pony", "My", "Little"),
+                                   mock.call().manifest_exists("myapp", "tag"),
+                                   mock.call("other.io"),
+                                   mock.call().manifest_exists("app", "tag")])
+
+
+@mock.patch.dict(os.environ, {"PIP_EXTRA_INDEX_URL": "url/to/artifact/store"})
+@mock.patch("takeoff.application_version.get_tag", return_value="2.1.0")
+def test_deploy_adds_tags_in_registry(_, victim_release: DockerImageBuilder):
+    with FakeRegistry() as registry:
+        victim_release.config["extra_tags"] = ["stable"]
+        df = DockerFile("Dockerfile", None, None, f"{registry.address}/team/app", True)
+
+        def push(cmd):
+            if cmd[1] == "push":
+                registry.add_manifest("team/app", cmd[2].rpartition(":")[2])
+            return 0, []
+
+        with mock.patch("takeoff.build_docker_image.run_shell_command", side_effect=push) as m_bash:
+            victim_release.deploy([df])
+
+    assert [_[0][0][1] for _ in m_bash.call_args_list] == ["build", "push"]
+    pushed = registry.manifests[("team/app", "2.1.0")]
+    assert registry.manifests[("team/app", "latest")] == pushed
+    assert registry.manifests[("team/app", "stable")] == pushed
+
+
+@mock.patch("takeoff.build_docker_image.DockerRegistryClient")
+@mock.patch("takeoff.build_docker_image.run_shell_command", return_value=(0, []))
+def test_add_tags_falls_back_to_docker(m_bash, m_registry, victim: DockerImageBuilder):
+    m_registry.return_value.add_tags.side_effect = requests.ConnectionError("unreachable")
+
+    victim.add_tags("pony/myapp:1.0", ["latest"])
+
+    calls = [["docker", "pull", "pony/myapp:1.0"],
+             ["docker", "tag", "pony/myapp:1.0", "pony/myapp:latest"],
+             ["docker", "push", "pony/myapp:latest"]]
+    assert m_bash.call_args_list == list(map(mock.call, calls))
+
+
+@mock.patch("takeoff.build_docker_image.DockerEngine")
+def test_sdk_engine(m_engine):
+    with mock.patch("takeoff.build_docker_image.DockerRegistry.credentials", return_value=CREDS), \
+         mock.patch("takeoff.step.ApplicationName.get", return_value="myapp"):
+        conf = {**takeoff_config(), **BASE_CONF, "engine": "sdk"}
+        victim = DockerImageBuilder(ApplicationVersion('DEV', 'SNAPSHOT', 'master'), conf)
+
+    with mock.patch("takeoff.build_docker_image.run_shell_command") as m_bash:
+        victim.deploy([DockerFile("Dockerfile", None, None, None, True)])
+
+    m_engine.assert_called_once_with(CREDS)
+    m_engine.return_value.build_image.assert_called_once_with("Dockerfile", "pony/myapp:SNAPSHOT", [], False)
+    m_engine.return_value.push_image.assert_called_once_with("pony/myapp:SNAPSHOT")
+    m_bash.assert_not_called()
+
+
+def test_sdk_engine_without_buildkit():
+    with mock.patch("takeoff.build_docker_image.DockerRegistry.credentials", return_value=CREDS), \
+         mock.patch("takeoff.step.ApplicationName.get", return_value="myapp"):
+        conf = {**takeoff_config(), **BASE_CONF, "engine": "sdk", "inline_cache": True}
+        with pytest.raises(ValueError):
+            DockerImageBuilder(ApplicationVersion('DEV', 'SNAPSHOT', 'master'), conf)
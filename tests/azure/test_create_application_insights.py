@@ -7,6 +7,7 @@ from voluptuous import MultipleInvalid
 
 from takeoff.application_version import ApplicationVersion
 from takeoff.azure.create_application_insights import CreateApplicationInsights
+from takeoff.credentials.client_pool import ClientPool
 from takeoff.credentials.secret import Secret
 from tests.azure import takeoff_config
 
@@ -114,3 +115,19 @@ class TestCreateApplicationInsights(object):
 
         assert result is None
 
+
+@pytest.fixture
+def client_pool():
+    ClientPool().clear()
+    yield ClientPool()
+    ClientPool().clear()
+
+
+@mock.patch("takeoff.azure.create_application_insights.ApplicationInsightsManagementClient")
+@mock.patch("takeoff.azure.create_application_insights.SubscriptionId")
+@mock.patch("takeoff.azure.create_application_insights.ActiveDirectoryUserCredentials")
+def test_create_client_is_shared(m_credentials, m_subscription, m_client, victim, client_pool):
+    assert victim._create_client() is victim._create_client()
+
+    m_client.assert_called_once()
+    m_credentials.assert_called_once()
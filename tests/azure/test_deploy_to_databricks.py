@@ -1,12 +1,18 @@
 import os
+import threading
+import time
 from dataclasses import dataclass
 
 import pytest
+import requests
 import voluptuous as vol
 from mock import mock
 
 from takeoff.application_version import ApplicationVersion
-from takeoff.azure.deploy_to_databricks import JobConfig, SCHEMA, DeployToDatabricks
+from takeoff.azure.deploy_to_databricks import JobConfig, JobDeployment, JobIndex, SCHEMA, DeployToDatabricks
+from takeoff.context import Context, ContextKey
+from takeoff.tracing import Tracer
+from takeoff.util import get_main_py_name, get_whl_name
 from tests.azure import takeoff_config
 
 jobs = [
@@ -58,6 +64,7 @@ def victim():
     m_runs_api_client.list_runs.return_value = {
         "runs": [{"run_id": "run1"}, {"run_id": "run2"}]
     }
+    m_runs_api_client.get_run.return_value = {"state": {"life_cycle_state": "TERMINATED"}}
 
     with mock.patch("takeoff.azure.deploy_to_databricks.KeyVaultClient.vault_and_client", return_value=(None, None)), \
          mock.patch("takeoff.step.ApplicationName.get", return_value="my_app"), \
@@ -77,6 +84,9 @@ class TestDeployToDatabricks(object):
         assert victim.config["jobs"][0]["name"] == ""
         assert victim.config["jobs"][0]["lang"] == "python"
         assert victim.config["jobs"][0]["arguments"] == [{}]
+        assert victim.config["update_mode"] == "recreate"
+        assert victim.config["max_parallel_jobs"] == 4
+        assert victim.config["switchover"] == {"enabled": False, "start_timeout_seconds": 1200}
 
     def test_find_application_job_id_if_snapshot(self, victim):
         assert victim._application_job_id("foo", "master", jobs) == [1]
@@ -554,7 +564,7 @@ class TestDeployToDatabricks(object):
     )
     def test_remove_job_batch(self, _, victim):
         with mock.patch(
-                "takeoff.azure.deploy_to_databricks.DeployToDatabricks._application_job_id",
+                "takeoff.azure.deploy_to_databricks.JobIndex.find",
                 return_value=["id1", "id2"],
         ):
             victim.remove_job("my-branch", {'name': ""}, False)
@@ -570,7 +580,7 @@ class TestDeployToDatabricks(object):
 
     def test_remove_job_streaming(self, victim):
         with mock.patch(
-                "takeoff.azure.deploy_to_databricks.DeployToDatabricks._application_job_id",
+                "takeoff.azure.deploy_to_databricks.JobIndex.find",
                 return_value=["id1", "id2"],
         ):
             with mock.patch(
@@ -585,7 +595,7 @@ class TestDeployToDatabricks(object):
 
     def test_remove_non_existing_job(self, victim):
         with mock.patch(
-                "takeoff.azure.deploy_to_databricks.DeployToDatabricks._application_job_id",
+                "takeoff.azure.deploy_to_databricks.JobIndex.find",
                 return_value=[],
         ):
             victim.remove_job("my-branch", {'name': ""}, False)
@@ -615,3 +625,499 @@ class TestDeployToDatabricks(object):
             python_params=None,
             spark_submit_params=None,
         )
+
+
+def deploy_jobs(victim, names, deploy_job):
+    victim.config["jobs"] = [{"main_name": "Dave", "name": name} for name in names]
+    with mock.patch.object(DeployToDatabricks, "deploy_job", side_effect=deploy_job):
+        return victim.deploy_to_databricks()
+
+
+def test_deploy_jobs_concurrently(victim):
+    second_started = threading.Event()
+
+    def deploy_job(job):
+        if job["name"] == "first":
+            # only finishes when the second job is deployed at the same time
+            assert second_started.wait(5)
+        else:
+            second_started.set()
+        return JobDeployment(job["name"], 1, [2])
+
+    deployments = deploy_jobs(victim, ["first", "second"], deploy_job)
+
+    assert [_.name for _ in deployments] == ["first", "second"]
+
+
+def test_deploy_jobs_at_most_max_parallel_jobs(victim):
+    victim.config["max_parallel_jobs"] = 2
+    running, most_running = [0], [0]
+    lock = threading.Lock()
+
+    def deploy_job(job):
+        with lock:
+            running[0] += 1
+            most_running[0] = max(most_running[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+        return JobDeployment(job["name"])
+
+    deploy_jobs(victim, [str(_) for _ in range(6)], deploy_job)
+
+    assert most_running[0] == 2
+
+
+def test_deploy_jobs_reports_all_failures(victim):
+    def deploy_job(job):
+        if job["name"] != "good":
+            raise requests.HTTPError("bad request")
+        return JobDeployment(job["name"], 1)
+
+    with pytest.raises(ChildProcessError, match="^Could not deploy my_app-bad, my_app-worse to Databricks$"):
+        deploy_jobs(victim, ["bad", "good", "worse"], deploy_job)
+
+
+def test_deploy_job(victim):
+    victim.config["jobs"] = [{**victim.config["jobs"][0], "config_file": streaming_job_config}]
+    with mock.patch.object(JobIndex, "find", return_value=["id1"]), \
+            mock.patch.object(DeployToDatabricks, "_kill_it_with_fire"):
+        deployments = victim.deploy_to_databricks()
+
+    assert deployments == [JobDeployment("my_app-bar", "job1", ["id1"], True)]
+
+
+def http_error(status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.HTTPError(f"{status_code} error", response=response)
+
+
+def test_submit_job_retries_when_throttled(victim):
+    victim.jobs_api.create_job.side_effect = [http_error(429), {"job_id": "job1"}]
+
+    with mock.patch("takeoff.util.time.sleep"):
+        assert victim._submit_job({}, False) == "job1"
+
+    assert victim.jobs_api.create_job.call_count == 2
+
+
+def test_submit_job_does_not_retry_server_errors(victim):
+    victim.jobs_api.create_job.side_effect = [http_error(500), {"job_id": "job1"}]
+
+    with pytest.raises(requests.HTTPError):
+        victim._submit_job({}, False)
+
+    victim.jobs_api.create_job.assert_called_once()
+
+
+def test_remove_job_retries_server_errors(victim):
+    victim.jobs_api.delete_job.side_effect = [http_error(503), True]
+
+    with mock.patch.object(JobIndex, "find", return_value=["id1"]), \
+            mock.patch("takeoff.util.time.sleep"):
+        assert victim.remove_job("my-branch", {"name": ""}, False) == ["id1"]
+
+    assert victim.jobs_api.delete_job.call_count == 2
+
+
+def job_pages(*pages):
+    return [
+        {
+            "jobs": [{"job_id": _.job_id, "settings": {"name": _.name}} for _ in page],
+            "has_more": i < len(pages) - 1,
+        }
+        for i, page in enumerate(pages)
+    ]
+
+
+def test_job_index_lists_all_pages_once():
+    client = mock.Mock()
+    client.perform_query.side_effect = job_pages(jobs[:4], jobs[4:])
+    index = JobIndex(client)
+
+    assert index.find("tim-postfix", "master") == [6, 7]
+    assert index.find("foo", "master") == [1]
+    assert index.find("daniel", "branch-name") == [5]
+
+    client.perform_query.assert_has_calls([
+        mock.call("GET", "/jobs/list", data={"offset": 0, "limit": 25}),
+        mock.call("GET", "/jobs/list", data={"offset": 4, "limit": 25}),
+    ])
+    assert client.perform_query.call_count == 2
+
+
+def test_job_index_without_pagination():
+    client = mock.Mock()
+    client.perform_query.return_value = {"jobs": [{"job_id": 1, "settings": {"name": "foo-SNAPSHOT"}}]}
+
+    assert JobIndex(client).find("foo", "master") == [1]
+    client.perform_query.assert_called_once()
+
+
+def test_job_index_follows_created_and_deleted_jobs():
+    index = JobIndex.of(jobs)
+
+    index.add(JobConfig("foo-0.0.3", 8))
+    index.remove(1)
+
+    assert index.find("foo", "master") == [8]
+    assert index.find("foobar", "master") == [3]
+
+
+def test_job_index_ignores_changes_before_listing():
+    client = mock.Mock()
+    client.perform_query.return_value = {"jobs": []}
+    index = JobIndex(client)
+
+    index.add(JobConfig("foo-SNAPSHOT", 1))
+    index.remove(2)
+
+    client.perform_query.assert_not_called()
+    assert index.find("foo", "master") == []
+
+
+def test_deploy_updates_job_index(victim):
+    victim.job_index = JobIndex.of([JobConfig("my_app-SNAPSHOT", "old")])
+    victim.jobs_api.create_job.return_value = {"job_id": "new"}
+
+    victim.remove_job("bar", {"name": ""}, False)
+    victim._submit_job({"name": "my_app-bar"}, False)
+
+    assert victim.job_index.find("my_app", "bar") == ["new"]
+    victim.jobs_api.delete_job.assert_called_once_with("old")
+
+
+STREAMING_SETTINGS = {"name": "my_app-bar", "new_cluster": {"spark_version": "4.1.x-scala2.11"}}
+
+
+@pytest.fixture
+def resetting(victim):
+    Context().clear()
+    victim.config["update_mode"] = "reset"
+    victim.job_index = JobIndex.of([JobConfig("my_app-bar", 10), JobConfig("my_app-SNAPSHOT", 9)])
+    victim.jobs_api.get_job.return_value = {
+        "job_id": 10,
+        "settings": {**STREAMING_SETTINGS, "email_notifications": {}, "max_concurrent_runs": 1},
+    }
+    with mock.patch.object(DeployToDatabricks, "create_config", return_value=dict(STREAMING_SETTINGS)):
+        yield victim
+    Context().clear()
+
+
+def published(changed: bool):
+    Context().create_or_update(ContextKey.PUBLISHED_ARTIFACTS, {
+        get_whl_name("my_app", "bar", ".whl"): changed,
+        get_main_py_name("my_app", "bar", ".py"): False,
+    })
+
+
+def test_reset_unchanged_job(resetting):
+    published(changed=False)
+
+    deployment = resetting.deploy_job(resetting.config["jobs"][0])
+
+    assert deployment == JobDeployment("my_app-bar", 10, [9], False, action="unchanged")
+    resetting.jobs_api.delete_job.assert_called_once_with(9)
+    resetting.jobs_api.reset_job.assert_not_called()
+    resetting.jobs_api.create_job.assert_not_called()
+    resetting.jobs_api.run_now.assert_not_called()
+    assert mock.call(10) not in resetting.runs_api.cancel_run.call_args_list
+
+
+def test_reset_job_with_workspace_defaults_is_unchanged(resetting):
+    published(changed=False)
+    resetting.jobs_api.get_job.return_value = {"job_id": 10, "settings": {
+        "name": "my_app-bar",
+        "new_cluster": {
+            "spark_version": "4.1.x-scala2.11", "enable_elastic_disk": True, "spark_env_vars": {},
+        },
+        "email_notifications": {},
+        "format": "SINGLE_TASK",
+    }}
+
+    deployment = resetting.deploy_job(resetting.config["jobs"][0])
+
+    assert deployment.action == "unchanged"
+    resetting.jobs_api.reset_job.assert_not_called()
+    assert mock.call(10) not in resetting.runs_api.cancel_run.call_args_list
+
+
+def test_reset_changed_job(resetting):
+    published(changed=False)
+    resetting.jobs_api.get_job.return_value = {"job_id": 10, "settings": {"name": "my_app-bar"}}
+
+    deployment = resetting.deploy_job(resetting.config["jobs"][0])
+
+    assert deployment == JobDeployment("my_app-bar", 10, [9], True, action="updated")
+    resetting.jobs_api.reset_job.assert_called_once_with({"job_id": 10, "new_settings": STREAMING_SETTINGS})
+    resetting.runs_api.list_runs.assert_any_call(
+        10, active_only=True, completed_only=None, offset=0, limit=25
+    )
+    resetting.runs_api.cancel_run.assert_has_calls([mock.call("run1"), mock.call("run2")])
+    resetting.jobs_api.run_now.assert_called_once_with(
+        job_id=10, jar_params=None, notebook_params=None, python_params=None, spark_submit_params=None
+    )
+
+
+@pytest.mark.parametrize("publish", [lambda: published(changed=True), lambda: None])
+def test_reset_restarts_job_with_changed_artifact(resetting, publish):
+    publish()
+
+    deployment = resetting.deploy_job(resetting.config["jobs"][0])
+
+    assert deployment.action == "unchanged"
+    assert deployment.started_run
+    resetting.jobs_api.reset_job.assert_not_called()
+    resetting.jobs_api.run_now.assert_called_once()
+
+
+def test_reset_starts_job_that_is_not_running(resetting):
+    published(changed=False)
+    resetting.runs_api.list_runs.return_value = {}
+
+    deployment = resetting.deploy_job(resetting.config["jobs"][0])
+
+    assert deployment.started_run
+    resetting.runs_api.cancel_run.assert_not_called()
+    resetting.jobs_api.run_now.assert_called_once()
+
+
+def test_reset_without_existing_job_creates_it(resetting):
+    resetting.job_index = JobIndex.of([JobConfig("my_app-SNAPSHOT", 9)])
+
+    deployment = resetting.deploy_job(resetting.config["jobs"][0])
+
+    assert deployment == JobDeployment("my_app-bar", "job1", [9], True)
+    resetting.jobs_api.create_job.assert_called_once_with(STREAMING_SETTINGS)
+    resetting.jobs_api.get_job.assert_not_called()
+
+
+@pytest.mark.parametrize("current, equal", [
+    ({**STREAMING_SETTINGS, "timeout_seconds": 0}, True),
+    ({**STREAMING_SETTINGS, "timeout_seconds": 60}, False),
+    ({**STREAMING_SETTINGS, "schedule": {"quartz_cron_expression": "0 0 * * * ?"}}, False),
+    ({**STREAMING_SETTINGS, "format": "MULTI_TASK"}, True),
+    ({"name": "my_app-bar", "new_cluster": {"spark_version": "5.5.x-scala2.11"}}, False),
+    ({"name": "my_app-bar", "new_cluster": "cluster"}, False),
+    ({"name": "my_app-bar"}, False),
+])
+def test_settings_equal(current, equal):
+    assert DeployToDatabricks._settings_equal(STREAMING_SETTINGS, current) == equal
+
+
+def test_settings_equal_ignores_fields_added_by_workspace():
+    new = {**STREAMING_SETTINGS, "libraries": [{"whl": "dbfs:/my_app.whl"}]}
+    current = {
+        "name": "my_app-bar",
+        "new_cluster": {
+            "spark_version": "4.1.x-scala2.11", "enable_elastic_disk": True, "spark_env_vars": {},
+        },
+        "libraries": [{"whl": "dbfs:/my_app.whl"}],
+        "email_notifications": {},
+        "max_concurrent_runs": 1,
+        "format": "SINGLE_TASK",
+    }
+
+    assert DeployToDatabricks._settings_equal(new, current)
+    assert not DeployToDatabricks._settings_equal(new, {**current, "max_concurrent_runs": 2})
+    assert not DeployToDatabricks._settings_equal(new, {**current, "libraries": []})
+    assert not DeployToDatabricks._settings_equal(
+        new, {**current, "libraries": [{"whl": "dbfs:/my_app.whl"}, {"jar": "dbfs:/other.jar"}]}
+    )
+
+
+def run_state(life_cycle_state):
+    return {"state": {"life_cycle_state": life_cycle_state}}
+
+
+def test_active_run_ids_lists_all_pages(victim):
+    victim.runs_api.list_runs.side_effect = [
+        {"runs": [{"run_id": 1}, {"run_id": 2}], "has_more": True},
+        {"runs": [{"run_id": 3}], "has_more": False},
+    ]
+
+    assert victim._active_run_ids("my-id") == [1, 2, 3]
+    victim.runs_api.list_runs.assert_has_calls([
+        mock.call("my-id", active_only=True, completed_only=None, offset=0, limit=25),
+        mock.call("my-id", active_only=True, completed_only=None, offset=2, limit=25),
+    ])
+
+
+def test_kill_it_with_fire_cancels_concurrently(victim):
+    both_cancelling = threading.Barrier(2, timeout=5)
+    victim.runs_api.cancel_run.side_effect = lambda run_id: both_cancelling.wait()
+
+    victim._kill_it_with_fire("my-id")
+
+    assert sorted(_[0][0] for _ in victim.runs_api.cancel_run.call_args_list) == ["run1", "run2"]
+
+
+def test_kill_it_with_fire_waits_for_termination(victim):
+    states = {
+        "run1": iter([run_state("RUNNING"), run_state("TERMINATED")]),
+        "run2": iter([run_state("TERMINATING"), run_state("TERMINATING"), run_state("TERMINATED")]),
+    }
+    victim.runs_api.get_run.side_effect = lambda run_id: next(states[run_id])
+
+    with mock.patch("takeoff.azure.deploy_to_databricks.time.sleep") as m_sleep:
+        victim._kill_it_with_fire("my-id")
+
+    assert [_[0][0] for _ in m_sleep.call_args_list] == [1.0, 2.0]
+    assert victim.runs_api.get_run.call_count == 5
+
+
+def test_kill_it_with_fire_times_out(victim):
+    victim.config["cancel_timeout_seconds"] = 0
+    victim.runs_api.get_run.return_value = run_state("TERMINATING")
+
+    with pytest.raises(ChildProcessError, match="did not terminate within 0 seconds"):
+        victim._kill_it_with_fire("my-id")
+
+
+def test_kill_it_with_fire_records_timings(victim):
+    tracer = Tracer()
+    tracer.clear()
+    tracer.enable()
+    try:
+        victim._kill_it_with_fire("my-id")
+    finally:
+        tracer.enabled = False
+
+    [span] = [_ for _ in tracer.events if _["name"] == "cancel runs of job my-id"]
+    tracer.clear()
+    assert span["args"]["runs"] == 2
+    assert span["args"]["polls"] == 1
+    assert span["args"]["cancel_seconds"] >= 0
+    assert span["args"]["wait_seconds"] >= 0
+
+
+def test_kill_it_with_fire_without_runs(victim):
+    victim.runs_api.list_runs.return_value = {}
+
+    victim._kill_it_with_fire("my-id")
+
+    victim.runs_api.cancel_run.assert_not_called()
+    victim.runs_api.get_run.assert_not_called()
+
+
+@pytest.fixture
+def switching(victim):
+    victim.config["switchover"]["enabled"] = True
+    victim.job_index = JobIndex.of([JobConfig("my_app-SNAPSHOT", 9)])
+    victim.jobs_api.create_job.return_value = {"job_id": 10}
+    victim.jobs_api.run_now.return_value = {"run_id": "run3"}
+    victim.runs_api.get_run.side_effect = lambda run_id: run_state(
+        "RUNNING" if run_id == "run3" else "TERMINATED"
+    )
+    with mock.patch.object(DeployToDatabricks, "create_config", return_value=dict(STREAMING_SETTINGS)), \
+            mock.patch("takeoff.azure.deploy_to_databricks.time.sleep"):
+        yield victim
+
+
+def test_switch_over(switching):
+    calls = []
+    new_run_states = iter(["PENDING", "RUNNING"])
+
+    def get_run(run_id):
+        calls.append(("get_run", run_id))
+        return run_state(next(new_run_states) if run_id == "run3" else "TERMINATED")
+
+    def record(*call, result=None):
+        return lambda *args, **kwargs: calls.append(call + args) or result
+
+    switching.jobs_api.create_job.side_effect = record("create_job", result={"job_id": 10})
+    switching.runs_api.cancel_run.side_effect = record("cancel_run")
+    switching.jobs_api.run_now.side_effect = record("run_now", result={"run_id": "run3"})
+    switching.jobs_api.delete_job.side_effect = record("delete_job")
+    switching.runs_api.get_run.side_effect = get_run
+
+    deployment = switching.deploy_job(switching.config["jobs"][0])
+
+    assert deployment == JobDeployment("my_app-bar", 10, [9], True)
+    assert calls[0] == ("create_job", STREAMING_SETTINGS)
+    assert sorted(calls[1:3]) == [("cancel_run", "run1"), ("cancel_run", "run2")]
+    assert calls[3:] == [
+        ("run_now",),
+        ("get_run", "run1"),
+        ("get_run", "run2"),
+        ("get_run", "run3"),
+        ("get_run", "run3"),
+        ("delete_job", 9),
+    ]
+    switching.runs_api.list_runs.assert_called_once_with(
+        9, active_only=True, completed_only=None, offset=0, limit=25
+    )
+
+
+def test_switch_over_records_downtime(switching):
+    tracer = Tracer()
+    tracer.clear()
+    tracer.enable()
+    try:
+        switching.deploy_job(switching.config["jobs"][0])
+    finally:
+        tracer.enabled = False
+
+    [span] = [_ for _ in tracer.events if _["name"] == "switch over to job 10"]
+    tracer.clear()
+    assert span["args"]["runs"] == 2
+    assert span["args"]["downtime_seconds"] >= span["args"]["stop_seconds"] >= 0
+
+
+def test_switch_over_when_new_run_fails(switching):
+    switching.runs_api.get_run.side_effect = lambda run_id: run_state("INTERNAL_ERROR")
+
+    with pytest.raises(ChildProcessError, match="^Run run3 of job 10 ended with INTERNAL_ERROR"):
+        switching.deploy_job(switching.config["jobs"][0])
+
+    switching.jobs_api.delete_job.assert_not_called()
+
+
+def test_switch_over_times_out(switching):
+    switching.config["switchover"]["start_timeout_seconds"] = 0
+    switching.runs_api.get_run.side_effect = lambda run_id: run_state(
+        "PENDING" if run_id == "run3" else "TERMINATED"
+    )
+
+    with pytest.raises(ChildProcessError, match="of job 10 did not start within 0 seconds$"):
+        switching.deploy_job(switching.config["jobs"][0])
+
+
+def test_switch_over_cancels_new_run_when_old_runs_do_not_terminate(switching):
+    switching.config["cancel_timeout_seconds"] = 0
+    switching.runs_api.get_run.side_effect = lambda run_id: run_state("RUNNING")
+
+    with pytest.raises(
+        ChildProcessError,
+        match=r"^Runs \['run1', 'run2'\] of job 9 did not terminate within 0 seconds; "
+              r"the new run run3 of job 10 was cancelled$",
+    ):
+        switching.deploy_job(switching.config["jobs"][0])
+
+    switching.runs_api.cancel_run.assert_called_with("run3")
+    switching.jobs_api.delete_job.assert_not_called()
+
+
+def test_switch_over_reports_new_run_it_could_not_cancel(switching):
+    switching.config["cancel_timeout_seconds"] = 0
+    switching.runs_api.get_run.side_effect = lambda run_id: run_state("RUNNING")
+
+    def cancel_run(run_id):
+        if run_id == "run3":
+            raise ValueError("Could not reach the workspace")
+
+    switching.runs_api.cancel_run.side_effect = cancel_run
+
+    with pytest.raises(ChildProcessError, match="new run run3 of job 10 could not be cancelled"):
+        switching.deploy_job(switching.config["jobs"][0])
+
+
+def test_switch_over_only_for_streaming_jobs(switching):
+    batch_settings = {**STREAMING_SETTINGS, "schedule": {}}
+    with mock.patch.object(DeployToDatabricks, "create_config", return_value=batch_settings):
+        deployment = switching.deploy_job(switching.config["jobs"][0])
+
+    assert not deployment.started_run
+    switching.jobs_api.run_now.assert_not_called()
+    switching.runs_api.get_run.assert_not_called()
@@ -1,15 +1,20 @@
 import glob
 import os
+import threading
 import unittest
 
 import azure
 import mock
 import pytest
 import voluptuous as vol
+from azure.common import AzureMissingResourceHttpError
+from azure.storage.blob import BlockBlobService
 
 from takeoff.application_version import ApplicationVersion
 from takeoff.azure.publish_artifact import PublishArtifact as victim
 from takeoff.azure.publish_artifact import language_must_match_target
+from takeoff.context import Context, ContextKey
+from takeoff.util import run_shell_command
 from tests.azure import takeoff_config
 
 BASE_CONF = {
@@ -130,7 +135,7 @@ class TestPublishArtifact(unittest.TestCase):
 
         calls = [mock.call(file="some.whl", file_extension=".whl"),
                  mock.call(file="main.py", file_extension=".py")]
-        m.assert_has_calls(calls)
+        m.assert_has_calls(calls, any_order=True)
 
     @mock.patch("takeoff.azure.publish_artifact.KeyVaultClient.vault_and_client", return_value=(None, None))
     @mock.patch("takeoff.step.ApplicationName.get", return_value="my_app")
@@ -165,9 +170,15 @@ class TestPublishArtifact(unittest.TestCase):
     @mock.patch("takeoff.step.ApplicationName.get", return_value="my_app")
     def test_upload_file_to_blob(self, m1, m2):
         conf = {**takeoff_config(), **BASE_CONF, "language": "scala", "target": ["ivy"]}
-        with mock.patch.object(azure.storage.blob, "BlockBlobService") as m:
+        with mock.patch.object(azure.storage.blob, "BlockBlobService") as m, \
+                mock.patch.object(victim, "_md5", return_value="bWQ1"):
             victim(FAKE_ENV, conf)._upload_file_to_azure_storage_account(m, "Dave", "Mustaine", "mylittlepony")
-        m.create_blob_from_path.assert_called_once_with(container_name="mylittlepony", blob_name="Mustaine", file_path="Dave")
+        m.create_blob_from_path.assert_called_once_with(container_name="mylittlepony",
+                                                        blob_name="Mustaine",
+                                                        file_path="Dave",
+                                                        content_settings=mock.ANY,
+                                                        max_connections=4)
+        assert m.create_blob_from_path.call_args[1]["content_settings"].content_md5 == "bWQ1"
 
     @mock.patch("takeoff.azure.publish_artifact.KeyVaultClient.vault_and_client", return_value=(None, None))
     @mock.patch("takeoff.step.ApplicationName.get", return_value="my_app")
@@ -201,7 +212,7 @@ class TestPublishArtifact(unittest.TestCase):
         conf = {**takeoff_config(), **BASE_CONF, "language": "scala", "target": ["ivy"]}
         with mock.patch("takeoff.azure.publish_artifact.run_shell_command", return_value=(0, ['output_lines'])) as m:
             victim(FAKE_ENV, conf).publish_to_ivy()
-        m.assert_called_once_with(["sbt", 'set version := "v-SNAPSHOT"', "publish"])
+        m.assert_called_once_with(["sbt", 'set version := "v-SNAPSHOT"', "publish"], env=None)
 
     @mock.patch("takeoff.azure.publish_artifact.KeyVaultClient.vault_and_client", return_value=(None, None))
     @mock.patch("takeoff.step.ApplicationName.get", return_value="my_app")
@@ -211,4 +222,190 @@ class TestPublishArtifact(unittest.TestCase):
         env = ApplicationVersion('prd', '1.0.0', 'branch')
         with mock.patch("takeoff.azure.publish_artifact.run_shell_command", return_value=(0, ['output_lines'])) as m:
             victim(env, conf).publish_to_ivy()
-        m.assert_called_once_with(["sbt", 'set version := "1.0.0"', "publish"])
+        m.assert_called_once_with(["sbt", 'set version := "1.0.0"', "publish"], env=None)
+
+    @mock.patch("takeoff.azure.publish_artifact.KeyVaultClient.vault_and_client", return_value=(None, None))
+    @mock.patch("takeoff.step.ApplicationName.get", return_value="my_app")
+    @mock.patch("takeoff.azure.publish_artifact.get_tag", return_value="1.0.0")
+    @mock.patch("takeoff.sbt.SbtServer.register")
+    def test_publish_to_ivy_with_sbt_server(self, m_register, m1, m2, m3):
+        conf = {**takeoff_config(), **BASE_CONF, "language": "scala", "target": ["ivy"],
+                "sbt": {"server": True}}
+        env = ApplicationVersion('prd', '1.0.0', 'branch')
+        with mock.patch("takeoff.azure.publish_artifact.run_shell_command", return_value=(0, ['output_lines'])) as m:
+            victim(env, conf).publish_to_ivy()
+        m.assert_has_calls([
+            mock.call(["sbt", "--client", 'set version := "1.0.0"; publish'], env=None),
+            mock.call(["sbt", "--client", "session clear-all"], env=None),
+        ])
+        assert m.call_count == 2
+        m_register.assert_called_with(None)
+
+    @mock.patch("takeoff.azure.publish_artifact.KeyVaultClient.vault_and_client", return_value=(None, None))
+    @mock.patch("takeoff.step.ApplicationName.get", return_value="my_app")
+    @mock.patch("takeoff.azure.publish_artifact.get_tag", return_value="1.0.0")
+    @mock.patch("takeoff.sbt.SbtServer.register")
+    def test_publish_to_ivy_with_sbt_server_clears_session_on_failure(self, m_register, m1, m2, m3):
+        conf = {**takeoff_config(), **BASE_CONF, "language": "scala", "target": ["ivy"],
+                "sbt": {"server": True}}
+        env = ApplicationVersion('prd', '1.0.0', 'branch')
+        with mock.patch("takeoff.azure.publish_artifact.run_shell_command", return_value=(1, [])) as m:
+            with pytest.raises(ChildProcessError):
+                victim(env, conf).publish_to_ivy()
+        m.assert_called_with(["sbt", "--client", "session clear-all"], env=None)
+
+
+@pytest.fixture
+def jar(tmp_path):
+    path = tmp_path / "app-assembly-1.0.jar"
+    path.write_bytes(b"jar contents")
+    return str(path)
+
+
+@pytest.fixture
+def publisher() -> victim:
+    Context().clear()
+    with mock.patch("takeoff.azure.publish_artifact.KeyVaultClient.vault_and_client",
+                    return_value=(None, None)), \
+            mock.patch("takeoff.step.ApplicationName.get", return_value="my_app"):
+        yield victim(FAKE_ENV, {**takeoff_config(), **BASE_CONF, "language": "scala",
+                                "cloud_storage": {"max_connections": 8, "block_size_mb": 16}})
+    Context().clear()
+
+
+def blob_with_md5(md5):
+    blob = mock.Mock()
+    blob.properties.content_settings.content_md5 = md5
+    return blob
+
+
+def test_md5(jar):
+    # `echo -n "jar contents" | openssl md5 -binary | base64`
+    assert victim._md5(jar) == "sBLr7z0ia5pN9JcS9GKmYQ=="
+
+
+def test_upload_skips_unchanged_blob(publisher, jar):
+    client = mock.Mock()
+    client.get_blob_properties.return_value = blob_with_md5(victim._md5(jar))
+
+    uploaded = publisher._upload_file_to_azure_storage_account(client, jar, "my_app/app.jar", "libraries")
+
+    assert not uploaded
+    client.get_blob_properties.assert_called_once_with("libraries", "my_app/app.jar")
+    client.create_blob_from_path.assert_not_called()
+
+
+@pytest.mark.parametrize("existing", [
+    AzureMissingResourceHttpError("Not found", 404),
+    blob_with_md5("b3RoZXI="),
+    blob_with_md5(None),
+])
+def test_upload_changed_blob(publisher, jar, existing):
+    client = mock.Mock()
+    if isinstance(existing, Exception):
+        client.get_blob_properties.side_effect = existing
+    else:
+        client.get_blob_properties.return_value = existing
+
+    assert publisher._upload_file_to_azure_storage_account(client, jar, "my_app/my_app-v.jar", "libraries")
+
+    client.create_blob_from_path.assert_called_once_with(
+        container_name="libraries",
+        blob_name="my_app/my_app-v.jar",
+        file_path=jar,
+        content_settings=mock.ANY,
+        max_connections=8,
+    )
+    assert client.create_blob_from_path.call_args[1]["content_settings"].content_md5 == victim._md5(jar)
+
+
+def test_upload_without_skipping(publisher, jar):
+    publisher.config["cloud_storage"]["skip_unchanged"] = False
+    client = mock.Mock()
+
+    assert publisher._upload_file_to_azure_storage_account(client, jar, "my_app/my_app-v.jar", "libraries")
+
+    client.get_blob_properties.assert_not_called()
+
+
+def test_upload_records_published_artifacts(publisher, jar):
+    with mock.patch("takeoff.azure.publish_artifact.BlobStore.service_client") as m_client, \
+            mock.patch.object(victim, "_upload_file_to_azure_storage_account", side_effect=[True, False]):
+        publisher.upload_to_cloud_storage(jar, ".jar")
+        publisher.upload_to_cloud_storage("main.py", ".py")
+
+    m_client.assert_called_with(publisher.config, block_size_mb=16)
+
+    assert Context().get(ContextKey.PUBLISHED_ARTIFACTS) == {
+        "my_app/my_app-v.jar": True,
+        "my_app/my_app-main-v.py": False,
+    }
+
+
+def test_publish_targets_concurrently(publisher):
+    publisher.config["target"] = ["cloud_storage", "ivy"]
+    ivy_started = threading.Event()
+
+    def upload(**kwargs):
+        # only finishes when ivy is published at the same time
+        assert ivy_started.wait(5)
+
+    with mock.patch.object(victim, "_get_jar", return_value="some.jar"), \
+            mock.patch.object(victim, "upload_to_cloud_storage", side_effect=upload) as m_upload, \
+            mock.patch.object(victim, "publish_to_ivy", side_effect=ivy_started.set) as m_ivy:
+        publisher.publish_jvm_package()
+
+    m_upload.assert_called_once_with(file="some.jar", file_extension=".jar")
+    m_ivy.assert_called_once()
+
+
+def test_publish_targets_concurrently_reports_all_failures(publisher):
+    publisher.config["target"] = ["cloud_storage", "ivy"]
+
+    with mock.patch.object(victim, "_get_jar", side_effect=FileNotFoundError("no jar")), \
+            mock.patch.object(victim, "publish_to_ivy") as m_ivy:
+        with pytest.raises(ChildProcessError, match="^Could not publish to cloud_storage$"):
+            publisher.publish_jvm_package()
+
+    m_ivy.assert_called_once()
+
+
+def test_publish_targets_concurrently_prefixes_output(publisher, capsys):
+    publisher.config["target"] = ["cloud_storage", "ivy"]
+
+    def echo(text):
+        return lambda *args, **kwargs: run_shell_command(["echo", text])
+
+    with mock.patch.object(victim, "_get_jar", return_value="some.jar"), \
+            mock.patch.object(victim, "upload_to_cloud_storage", side_effect=echo("uploading")), \
+            mock.patch.object(victim, "publish_to_ivy", side_effect=echo("publishing")):
+        publisher.publish_jvm_package()
+
+    assert sorted(capsys.readouterr().out.splitlines()) == ["[cloud_storage] uploading", "[ivy] publishing"]
+
+
+@pytest.mark.skipif(
+    "AZURITE_CONNECTION_STRING" not in os.environ,
+    reason="needs Azurite, e.g. `docker run -p 10000:10000 mcr.microsoft.com/azure-storage/azurite "
+    "azurite-blob --blobHost 0.0.0.0` and AZURITE_CONNECTION_STRING set to its connection string",
+)
+def test_upload_to_azurite(publisher, tmp_path):
+    client = BlockBlobService(connection_string=os.environ["AZURITE_CONNECTION_STRING"])
+    client.MAX_BLOCK_SIZE = client.MAX_SINGLE_PUT_SIZE = 1024 * 1024
+    container = "takeoff-test"
+    client.create_container(container)
+    large_jar = tmp_path / "large.jar"
+    large_jar.write_bytes(os.urandom(3 * 1024 * 1024 + 1))
+
+    def upload() -> bool:
+        return publisher._upload_file_to_azure_storage_account(client, str(large_jar), "large.jar", container)
+
+    try:
+        assert upload()
+        assert not upload()
+
+        large_jar.write_bytes(os.urandom(1024))
+        assert upload()
+        assert client.get_blob_to_bytes(container, "large.jar").content == large_jar.read_bytes()
+    finally:
+        client.delete_container(container)
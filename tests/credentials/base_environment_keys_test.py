@@ -4,6 +4,8 @@ import unittest
 
 import mock
 
+from takeoff.credentials.client_pool import ClientPool
+
 OS_KEYS = {'AZ_SP_CLIENT_ID_ENV': 'd0aaa0de-c1ef-456f-a025-c5d6341193bb',
            'AZ_SP_CLIENT_SECRET_ENV': '3ceb401f-6462-48da-b42f-b1d1745c2590',
            'CI_PROJECT_NAME': 'test-project',
@@ -35,6 +37,8 @@ CONFIG = {
 
 
 class EnvironmentKeyBaseTest(unittest.TestCase):
+    def setUp(self):
+        ClientPool().clear()
 
     @mock.patch.dict(os.environ, OS_KEYS)
     def execute(self, mock_class, assertion):
@@ -0,0 +1,47 @@
+import threading
+import time
+
+import mock
+
+from takeoff.credentials.client_pool import ClientPool
+
+
+class TestClientPool(object):
+    def setup_method(self):
+        ClientPool().clear()
+
+    def test_reuses_clients(self):
+        create = mock.Mock(side_effect=lambda: object())
+
+        client = ClientPool().get(("vault", "dev", "keyvault"), create)
+
+        assert ClientPool().get(("vault", "dev", "keyvault"), create) is client
+        assert ClientPool().get(("vault", "prd", "keyvault"), create) is not client
+        assert create.call_count == 2
+
+    def test_creates_client_once_when_called_concurrently(self):
+        created = []
+
+        def create():
+            time.sleep(0.05)
+            created.append(object())
+            return created[-1]
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(ClientPool().get(("vault", "databricks"), create)))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(created) == 1
+        assert results == created * 4
+
+    def test_clear(self):
+        client = ClientPool().get(("vault", "databricks"), object)
+        ClientPool().clear()
+
+        assert ClientPool().get(("vault", "databricks"), object) is not client
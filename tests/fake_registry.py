@@ -0,0 +1,115 @@
+import base64
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MANIFEST_TYPE = "application/vnd.docker.distribution.manifest.v2+json"
+MANIFEST_PATH = re.compile("^/v2/(?P<repository>.+)/manifests/(?P<reference>[^/]+)$")
+TOKEN_PATH = re.compile(r"^/token(\?|$)")
+
+
+class FakeRegistry(object):
+    """In-process stand-in for a `registry:2` container, storing manifests in memory
+
+    With `credentials` set, the registry behaves like Docker Hub and ACR: requests without a bearer
+    token get a challenge pointing to the `/token` endpoint, which hands out tokens for basic auth.
+    """
+
+    TOKEN = "fake-token"
+
+    def __init__(self, credentials=None):
+        self.credentials = credentials
+        self.manifests = {}
+        self.requests = []
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+
+    @property
+    def address(self) -> str:
+        return f"127.0.0.1:{self.server.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def add_manifest(self, repository: str, tag: str, layers=("sha256:layer",)):
+        manifest = {"schemaVersion": 2, "mediaType": MANIFEST_TYPE, "layers": [{"digest": _} for _ in layers]}
+        self.manifests[(repository, tag)] = json.dumps(manifest).encode()
+
+    def _handler(self):
+        return type("Handler", (_Handler,), {"registry": self})
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """Serves the requests of a `FakeRegistry`, dispatching them on their method and path to `ROUTES`"""
+
+    registry: FakeRegistry
+    # method, path, name of the handler and whether it needs a bearer token
+    ROUTES = [
+        ("GET", TOKEN_PATH, "_token", False),
+        ("GET", MANIFEST_PATH, "_get_manifest", True),
+        ("HEAD", MANIFEST_PATH, "_get_manifest", True),
+        ("PUT", MANIFEST_PATH, "_put_manifest", True),
+    ]
+
+    def log_message(self, *args):
+        pass
+
+    def _dispatch(self):
+        self.registry.requests.append((self.command, self.path))
+        for command, path, handler, needs_token in self.ROUTES:
+            match = path.match(self.path)
+            if command == self.command and match:
+                if not needs_token or self._authorized():
+                    getattr(self, handler)(match)
+                return
+        self._send(404)
+
+    do_GET = _dispatch
+    do_HEAD = _dispatch
+    do_PUT = _dispatch
+
+    def _authorized(self) -> bool:
+        if not self.registry.credentials:
+            return True
+        if self.headers.get("Authorization") == f"Bearer {self.registry.TOKEN}":
+            return True
+        self.send_response(401)
+        self.send_header(
+            "WWW-Authenticate",
+            f'Bearer realm="http://{self.registry.address}/token",service="{self.registry.address}"',
+        )
+        self.end_headers()
+        return False
+
+    def _send(self, status: int, body: bytes = b"", content_type: str = MANIFEST_TYPE):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _token(self, match):
+        expected = base64.b64encode(":".join(self.registry.credentials).encode()).decode()
+        if self.headers.get("Authorization") != f"Basic {expected}":
+            self.send_response(401)
+            self.end_headers()
+            return
+        self._send(200, json.dumps({"token": self.registry.TOKEN}).encode(), "application/json")
+
+    def _get_manifest(self, match):
+        manifest = self.registry.manifests.get((match.group("repository"), match.group("reference")))
+        if manifest is None:
+            self._send(404)
+        else:
+            self._send(200, manifest)
+
+    def _put_manifest(self, match):
+        key = (match.group("repository"), match.group("reference"))
+        self.registry.manifests[key] = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self._send(201)
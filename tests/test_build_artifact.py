@@ -1,15 +1,21 @@
 import os
+import sys
+import threading
 import unittest
 
 import mock
 import pytest
+import voluptuous as vol
+from git import Repo
 
 from takeoff.application_version import ApplicationVersion
-from takeoff.build_artifact import BuildArtifact as victim
+from takeoff.build_artifact import BuildArtifact as victim, PRINT_BUILD_REQUIREMENTS
+from takeoff.util import run_shell_command
 from tests.azure import takeoff_config
 
 BASE_CONF = {"task": "build_artifact", "build_tool": "python"}
 FAKE_ENV = ApplicationVersion('env', 'v', 'branch')
+TAKEOFF_CONFIG: dict = {}
 
 
 class TestBuildArtifact(unittest.TestCase):
@@ -61,7 +67,7 @@ class TestBuildArtifact(unittest.TestCase):
         conf = {**takeoff_config(), **BASE_CONF}
         with mock.patch("takeoff.build_artifact.run_shell_command", return_value=(0, ['output_lines'])) as m:
             victim(FAKE_ENV, conf).build_sbt_assembly_jar()
-        m.assert_called_once_with(["sbt", "clean", "assembly"])
+        m.assert_called_once_with(["sbt", "clean", "assembly"], env=None)
 
     @mock.patch.dict(os.environ, {"CI_PROJECT_NAME": "Elon"})
     @mock.patch.object(victim, "_write_version")
@@ -71,7 +77,7 @@ class TestBuildArtifact(unittest.TestCase):
         with pytest.raises(ChildProcessError):
             with mock.patch("takeoff.build_artifact.run_shell_command", return_value=(1, ['output_lines'])) as m:
                 victim(FAKE_ENV, conf).build_sbt_assembly_jar()
-            m.assert_called_once_with(["sbt", "clean", "assembly"])
+            m.assert_called_once_with(["sbt", "clean", "assembly"], env=None)
 
     def test_remove_old_artifacts(self):
         with mock.patch("takeoff.build_artifact.shutil") as m:
@@ -87,4 +93,187 @@ class TestBuildArtifact(unittest.TestCase):
 
         mopen.assert_called_once_with("version.py", "w+")
         handle = mopen()
-        handle.write.assert_called_once_with("__version__='v'")
\ No newline at end of file
+        handle.write.assert_called_once_with("__version__='v'")
+
+
+@pytest.fixture
+def project(tmp_path, monkeypatch):
+    # read before changing to the project directory
+    monkeypatch.setattr("tests.test_build_artifact.TAKEOFF_CONFIG", takeoff_config())
+    repo = Repo.init(str(tmp_path))
+    (tmp_path / "setup.py").write_text("from setuptools import setup; setup()")
+    (tmp_path / "version.py").write_text("__version__='SNAPSHOT'")
+    (tmp_path / ".gitignore").write_text("dist/\n")
+    repo.index.add(["setup.py", ".gitignore"])
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def python_victim(**python_config) -> victim:
+    with mock.patch.dict(os.environ, {"CI_PROJECT_NAME": "Elon"}):
+        return victim(FAKE_ENV, {**TAKEOFF_CONFIG, **BASE_CONF, "python": python_config})
+
+
+def build_wheel(cmd):
+    os.makedirs("dist", exist_ok=True)
+    with open("dist/Elon-v-py3-none-any.whl", "w") as f:
+        f.write("wheel")
+    return 0, []
+
+
+def test_python_source_digest(project):
+    step = python_victim(cache_dir="cache")
+    digest = step._python_source_digest()
+
+    (project / "version.py").write_text("__version__='1.0.0'")
+    (project / "dist").mkdir()
+    (project / "dist" / "old.whl").write_text("wheel")
+    assert step._python_source_digest() == digest
+
+    (project / "module.py").write_text("print('new file')")
+    assert step._python_source_digest() != digest
+
+
+def test_build_python_wheel_cached(project):
+    step = python_victim(cache_dir=str(project / "cache"))
+
+    with mock.patch("takeoff.build_artifact.run_shell_command", side_effect=build_wheel) as m:
+        step.build_python_wheel()
+        step.build_python_wheel()
+
+    m.assert_called_once_with(["python", "setup.py", "bdist_wheel"])
+    assert os.listdir("dist") == ["Elon-v-py3-none-any.whl"]
+
+    (project / "setup.py").write_text("from setuptools import setup; setup(name='Elon')")
+    with mock.patch("takeoff.build_artifact.run_shell_command", side_effect=build_wheel) as m:
+        step.build_python_wheel()
+    m.assert_called_once()
+
+
+def test_build_python_wheel_pep517(project):
+    step = python_victim(builder="pep517")
+
+    with mock.patch.object(victim, "_pep517_environment", return_value="env/bin/python"), \
+            mock.patch("takeoff.build_artifact.run_shell_command", return_value=(0, [])) as m:
+        step.build_python_wheel()
+
+    m.assert_called_once_with(
+        ["env/bin/python", "-m", "build", "--wheel", "--no-isolation", "--outdir", "dist/"]
+    )
+
+
+def test_pep517_environment_is_reused(project):
+    step = python_victim(builder="pep517", cache_dir=str(project / "cache"))
+    python = str(project / "cache" / "pep517-env" / "bin" / "python")
+
+    def run(cmd):
+        if cmd[:3] == ["python", "-m", "venv"]:
+            os.makedirs(os.path.dirname(python))
+            open(python, "w").close()
+        requirements = [
+            "DEPRECATION: some notice\n",
+            'takeoff-build-requirements: ["setuptools>=40.8.0", "wheel"]\n',
+            "a warning printed after the requirements\n",
+        ]
+        return 0, requirements if cmd[1] == "-c" else []
+
+    with mock.patch("takeoff.build_artifact.run_shell_command", side_effect=run) as m:
+        assert step._pep517_environment() == python
+        assert step._pep517_environment() == python
+
+    created = [["python", "-m", "venv", str(project / "cache" / "pep517-env")],
+               [python, "-m", "pip", "install", "build"]]
+    prepared = [[python, "-c", PRINT_BUILD_REQUIREMENTS],
+                [python, "-m", "pip", "install", "setuptools>=40.8.0", "wheel"]]
+    assert [_[0][0] for _ in m.call_args_list] == created + prepared + prepared
+
+
+@mock.patch("takeoff.sbt.SbtServer.register")
+def test_build_sbt_assembly_jar_incremental(_, tmp_path, monkeypatch):
+    config = takeoff_config()
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "target" / "scala-2.12" / "classes").mkdir(parents=True)
+    (tmp_path / "target" / "scala-2.12" / "app-assembly-0.1.jar").write_text("old")
+    with mock.patch.dict(os.environ, {"CI_PROJECT_NAME": "Elon"}):
+        step = victim(FAKE_ENV, {**config, **BASE_CONF, "build_tool": "sbt",
+                                 "sbt": {"server": True, "cache_dir": "/cache"}})
+
+    with mock.patch("takeoff.build_artifact.run_shell_command", return_value=(0, [])) as m:
+        step.build_sbt_assembly_jar()
+
+    m.assert_called_once_with(["sbt", "--client", "assembly"], env=mock.ANY)
+    assert m.call_args[1]["env"]["COURSIER_CACHE"] == "/cache/coursier"
+    assert os.listdir(tmp_path / "target" / "scala-2.12") == ["classes"]
+
+
+def multi_victim(build_tool) -> victim:
+    with mock.patch.dict(os.environ, {"CI_PROJECT_NAME": "Elon"}):
+        return victim(FAKE_ENV, {**takeoff_config(), **BASE_CONF, "build_tool": build_tool})
+
+
+@pytest.mark.parametrize("build_tool", [[], ["python", "python"], ["python", "maven"]])
+def test_invalid_build_tools(build_tool):
+    with pytest.raises(vol.MultipleInvalid):
+        multi_victim(build_tool)
+
+
+def test_build_tools_concurrently():
+    step = multi_victim(["python", "sbt"])
+    sbt_started = threading.Event()
+
+    def build_python():
+        # only finishes when the sbt build runs at the same time
+        assert sbt_started.wait(5)
+
+    with mock.patch.object(victim, "build_python_wheel", side_effect=build_python) as m_python, \
+            mock.patch.object(victim, "build_sbt_assembly_jar", side_effect=sbt_started.set) as m_sbt:
+        step.run()
+
+    m_python.assert_called_once()
+    m_sbt.assert_called_once()
+
+
+def test_build_tools_concurrently_reports_all_failures():
+    step = multi_victim(["python", "sbt"])
+
+    with mock.patch.object(victim, "build_python_wheel", side_effect=ChildProcessError("python failed")), \
+            mock.patch.object(victim, "build_sbt_assembly_jar") as m_sbt:
+        with pytest.raises(ChildProcessError, match="^Could not build python$"):
+            step.run()
+
+    m_sbt.assert_called_once()
+
+
+def test_build_tools_concurrently_prefixes_output(capsys):
+    step = multi_victim(["python", "sbt"])
+
+    def echo(tool):
+        return lambda: run_shell_command(["echo", f"building {tool}"])
+
+    with mock.patch.object(victim, "build_python_wheel", side_effect=echo("wheel")), \
+            mock.patch.object(victim, "build_sbt_assembly_jar", side_effect=echo("jar")):
+        step.run()
+
+    assert sorted(capsys.readouterr().out.splitlines()) == ["[python] building wheel", "[sbt] building jar"]
+
+
+def test_pep517_environment_without_requirements(project):
+    step = python_victim(builder="pep517", cache_dir=str(project / "cache"))
+    os.makedirs(project / "cache" / "pep517-env" / "bin")
+    open(project / "cache" / "pep517-env" / "bin" / "python", "w").close()
+
+    with mock.patch("takeoff.build_artifact.run_shell_command", return_value=(0, ["only a warning\n"])):
+        with pytest.raises(ChildProcessError, match="build requirements"):
+            step._pep517_environment()
+
+
+def test_print_build_requirements(tmp_path):
+    pytest.importorskip("build")
+    (tmp_path / "pyproject.toml").write_text('[build-system]\nrequires = ["wheel", "setuptools"]\n')
+
+    script = PRINT_BUILD_REQUIREMENTS.replace("'.'", repr(str(tmp_path)))
+
+    code, lines = run_shell_command([sys.executable, "-c", script])
+
+    assert code == 0
+    assert lines == ['takeoff-build-requirements: ["setuptools", "wheel"]\n']
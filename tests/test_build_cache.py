@@ -0,0 +1,61 @@
+import os
+from types import SimpleNamespace
+
+import mock
+
+from takeoff.build_cache import BuildCache, source_digest
+
+
+def test_source_digest(tmp_path):
+    source = tmp_path / "module.py"
+    source.write_text("print('hello')")
+    paths = [str(source), str(tmp_path / "missing.py")]
+
+    digest = source_digest(paths, ["1.0.0"])
+
+    assert digest == source_digest(list(reversed(paths)), ["1.0.0"])
+    assert digest != source_digest(paths, ["1.0.1"])
+    source.write_text("print('world')")
+    assert digest != source_digest(paths, ["1.0.0"])
+
+
+def test_store_and_restore(tmp_path):
+    wheel = tmp_path / "dist" / "app-1.0.0-py3-none-any.whl"
+    wheel.parent.mkdir()
+    wheel.write_bytes(b"wheel")
+    cache = BuildCache(str(tmp_path / "cache"))
+
+    assert cache.restore("abc", str(tmp_path / "restored")) == []
+    cache.store("abc", [str(wheel)])
+    restored = cache.restore("abc", str(tmp_path / "restored"))
+
+    assert restored == [str(tmp_path / "restored" / wheel.name)]
+    assert (tmp_path / "restored" / wheel.name).read_bytes() == b"wheel"
+    assert os.listdir(tmp_path / "cache") == ["abc"]
+
+
+def test_blob_mirror(tmp_path):
+    wheel = tmp_path / "app-1.0.0-py3-none-any.whl"
+    wheel.write_bytes(b"wheel")
+    blob_service = mock.Mock()
+
+    BuildCache(str(tmp_path / "cache"), blob_service, "build-cache").store("abc", [str(wheel)])
+    blob_service.create_blob_from_path.assert_called_once_with("build-cache", f"abc/{wheel.name}", str(wheel))
+
+    # a runner without the local cache downloads the wheel from blob storage
+    blob_service.list_blobs.return_value = [SimpleNamespace(name=f"abc/{wheel.name}")]
+    blob_service.get_blob_to_path.side_effect = lambda container, blob, path: open(path, "wb").write(b"wheel")
+    other_runner = BuildCache(str(tmp_path / "other_cache"), blob_service, "build-cache")
+
+    restored = other_runner.restore("abc", str(tmp_path / "restored"))
+
+    blob_service.list_blobs.assert_called_once_with("build-cache", prefix="abc/")
+    assert restored == [str(tmp_path / "restored" / wheel.name)]
+    assert (tmp_path / "other_cache" / "abc" / wheel.name).exists()
+
+
+def test_blob_mirror_miss(tmp_path):
+    blob_service = mock.Mock()
+    blob_service.list_blobs.return_value = []
+
+    assert BuildCache(str(tmp_path), blob_service, "build-cache").restore("abc", str(tmp_path / "dist")) == []
@@ -1,6 +1,9 @@
+import threading
+import time
+
 import pytest
 
-from takeoff.context import Context
+from takeoff.context import Context, Singleton
 
 
 @pytest.fixture(scope='module', autouse=True)
@@ -46,3 +49,22 @@ def test_get_or_else():
     Context().create_or_update("Alice", "Cooper")
     assert Context().get_or_else("Not exists", {}) == {}
     assert Context().get_or_else("Alice", {}) == "Cooper"
+
+
+def test_singleton_created_once_when_called_concurrently():
+    created = []
+
+    class Slow(metaclass=Singleton):
+        def __init__(self):
+            time.sleep(0.05)
+            created.append(self)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(Slow())) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(created) == 1
+    assert results == created * 4
@@ -10,8 +10,9 @@ from takeoff.azure.configure_eventhub import ConfigureEventHub
 from takeoff.azure.create_databricks_secrets import CreateDatabricksSecretsFromVault
 from takeoff.azure.deploy_to_databricks import DeployToDatabricks
 from takeoff.deploy import main
-from takeoff.deploy import run_task, add_takeoff_plugin_paths, find_env_function
+from takeoff.deploy import run_task, add_takeoff_plugin_paths, find_env_function, deploy_env_logic
 from takeoff.step import Step
+from takeoff.util import GitInfo
 from tests.azure import takeoff_config
 
 environment_variables = {
@@ -183,3 +184,23 @@ def test_add_custom_path():
 
     assert env(conf_ext).branch == "master"
     sys.path.remove(paths[0])
+
+
+@pytest.mark.parametrize("tag, branch, expected", [
+    ("1.0.0", "master", ("PRD", "1.0.0")),
+    (None, "master", ("ACP", "SNAPSHOT")),
+    (None, "my-feature", ("DEV", "abcdef1")),
+])
+@mock.patch("takeoff.deploy.BranchName.get")
+def test_deploy_env_logic(m_branch, tag, branch, expected):
+    git_info = GitInfo(sha="abcdef1234567890", short_hash="abcdef1", tag=tag)
+    m_branch.return_value = branch
+
+    with mock.patch("takeoff.deploy.get_git_info", return_value=git_info), \
+            mock.patch("takeoff.application_version.get_tag") as m_tag:
+        env = deploy_env_logic({})
+        assert env.on_release_tag == (tag is not None)
+
+    assert (env.environment, env.version) == expected
+    assert env.git_info is git_info
+    m_tag.assert_not_called()
@@ -0,0 +1,156 @@
+import mock
+import pytest
+from docker.errors import APIError
+
+from takeoff.credentials.container_registry import DockerCredentials
+from takeoff.docker_engine import DockerBuildError, DockerEngine, parse_build_output, parse_push_output
+
+CREDS = DockerCredentials("My", "Little", "pony")
+
+BUILD_OUTPUT = [
+    {"stream": "Step 1/3 : FROM python:3.7"},
+    {"stream": "\n"},
+    {"stream": " ---> 0a3b\n"},
+    {"stream": "Step 2/3 : COPY requirements.txt .\n"},
+    {"stream": " ---> Using cache\n ---> 1b4c\n"},
+    {"stream": "Step 3/3 : RUN pip install -r requirements.txt\n"},
+    {"stream": " ---> Running in 2c5d\n"},
+    {"aux": {"ID": "sha256:3d6e"}},
+    {"stream": "Successfully built 3d6e\n"},
+]
+
+PUSH_OUTPUT = [
+    {"status": "The push refers to repository [pony/myapp]"},
+    {"status": "Preparing", "progressDetail": {}, "id": "aaa"},
+    {"status": "Preparing", "progressDetail": {}, "id": "bbb"},
+    {"status": "Preparing", "progressDetail": {}, "id": "ccc"},
+    {"status": "Layer already exists", "progressDetail": {}, "id": "aaa"},
+    {"status": "Mounted from library/python", "progressDetail": {}, "id": "bbb"},
+    {"status": "Pushing", "progressDetail": {"current": 512, "total": 2048}, "id": "ccc"},
+    {"status": "Pushing", "progressDetail": {"current": 2048, "total": 2048}, "id": "ccc"},
+    {"status": "Pushed", "progressDetail": {}, "id": "ccc"},
+    {"status": "1.0: digest: sha256:4e7f size: 1234"},
+    {"progressDetail": {}, "aux": {"Tag": "1.0", "Digest": "sha256:4e7f", "Size": 1234}},
+]
+
+ERROR = {"errorDetail": {"message": "denied: requested access to the resource is denied"},
+         "error": "denied: requested access to the resource is denied"}
+
+
+def test_parse_build_output():
+    report = parse_build_output("pony/myapp:1.0", BUILD_OUTPUT)
+
+    assert report.image_id == "sha256:3d6e"
+    assert [_.instruction for _ in report.steps] == [
+        "FROM python:3.7", "COPY requirements.txt .", "RUN pip install -r requirements.txt"
+    ]
+    assert [_.cached for _ in report.steps] == [False, True, False]
+
+
+def test_parse_build_output_error():
+    message = "The command '/bin/sh -c foo' returned a non-zero code: 127"
+    error = {"errorDetail": {"code": 127, "message": message}, "error": message}
+
+    with pytest.raises(DockerBuildError) as e:
+        parse_build_output("pony/myapp:1.0", BUILD_OUTPUT[:3] + [error])
+
+    assert e.value.image == "pony/myapp:1.0"
+    assert e.value.code == 127
+    assert isinstance(e.value, ChildProcessError)
+
+
+def test_parse_push_output():
+    report = parse_push_output("pony/myapp:1.0", PUSH_OUTPUT)
+
+    assert report.pushed == {"ccc": 2048}
+    assert report.pushed_bytes == 2048
+    assert report.skipped == ["aaa", "bbb"]
+    assert report.digest == "sha256:4e7f"
+
+
+def test_parse_push_output_error():
+    with pytest.raises(DockerBuildError, match="requested access to the resource is denied"):
+        parse_push_output("pony/myapp:1.0", PUSH_OUTPUT[:3] + [ERROR])
+
+
+@pytest.fixture
+def engine() -> DockerEngine:
+    with mock.patch("docker.APIClient") as m_client:
+        engine = DockerEngine(CREDS)
+    assert engine.api is m_client.return_value
+    return engine
+
+
+@mock.patch.dict("os.environ", {"PIP_EXTRA_INDEX_URL": "url/to/artifact/store"})
+def test_build_image(engine):
+    engine.api.build.return_value = iter(BUILD_OUTPUT)
+
+    report = engine.build_image("Dockerfile", "pony/myapp:1.0", cache_from=["pony/myapp:latest"])
+
+    engine.api.build.assert_called_once_with(path=".",
+                                             dockerfile="Dockerfile",
+                                             tag="pony/myapp:1.0",
+                                             buildargs={"PIP_EXTRA_INDEX_URL": "url/to/artifact/store"},
+                                             cache_from=["pony/myapp:latest"],
+                                             rm=True,
+                                             decode=True)
+    assert len(report.steps) == 3
+
+
+def test_build_image_inline_cache(engine):
+    with pytest.raises(ValueError):
+        engine.build_image("Dockerfile", "pony/myapp:1.0", inline_cache=True)
+
+
+def test_push_image(engine):
+    engine.api.push.return_value = iter(PUSH_OUTPUT)
+
+    report = engine.push_image("pony/myapp:1.0")
+
+    engine.api.push.assert_called_once_with("pony/myapp",
+                                            tag="1.0",
+                                            stream=True,
+                                            decode=True,
+                                            auth_config={"username": "My", "password": "Little"})
+    assert report.pushed_bytes == 2048
+
+
+def test_push_image_api_error(engine):
+    engine.api.push.side_effect = APIError("500 Server Error", response=mock.Mock(status_code=500))
+
+    with pytest.raises(DockerBuildError) as e:
+        engine.push_image("pony/myapp:1.0")
+
+    assert e.value.code == 500
+
+
+def test_pull_image(engine):
+    engine.api.pull.return_value = iter([{"status": "Pulling from myapp", "id": "1.0"}])
+
+    assert engine.pull_image("other.io/myapp:1.0")
+    engine.api.pull.assert_called_once_with(
+        "other.io/myapp", tag="1.0", stream=True, decode=True, auth_config=None
+    )
+
+
+def test_pull_image_failure(engine):
+    engine.api.pull.return_value = iter([{"error": "manifest unknown"}])
+
+    assert not engine.pull_image("pony/myapp:1.0")
+
+
+def test_tag_image(engine):
+    engine.api.tag.return_value = True
+
+    engine.tag_image("pony/myapp:1.0", "pony/myapp:latest")
+
+    engine.api.tag.assert_called_once_with("pony/myapp:1.0", "pony/myapp", "latest")
+
+
+def test_pull_images(engine):
+    engine.api.pull.side_effect = lambda repository, **kwargs: iter(
+        [{"error": "manifest unknown"}] if repository == "pony/missing" else []
+    )
+
+    assert engine.pull_images(["pony/myapp:1.0", "pony/missing:1.0"]) == [True, False]
+    assert engine.pull_images([]) == []
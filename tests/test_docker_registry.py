@@ -0,0 +1,54 @@
+import pytest
+
+from takeoff.docker_registry import DOCKER_HUB, DockerRegistryClient, ImageReference
+from tests.fake_registry import FakeRegistry
+
+
+@pytest.mark.parametrize("image, expected", [
+    ("myreg.azurecr.io/team/app:1.0", ImageReference("myreg.azurecr.io", "team/app", "1.0")),
+    ("localhost:5000/app:latest", ImageReference("localhost:5000", "app", "latest")),
+    ("pony/app:1.0", ImageReference("pony", "app", "1.0")),
+    ("someone/app:1.0", ImageReference(DOCKER_HUB, "someone/app", "1.0")),
+    ("ubuntu:18.04", ImageReference(DOCKER_HUB, "library/ubuntu", "18.04")),
+])
+def test_parse_image_reference(image, expected):
+    assert ImageReference.parse(image, known_registries=["pony"]) == expected
+
+
+def test_parse_image_reference_without_tag():
+    with pytest.raises(ValueError):
+        ImageReference.parse("localhost:5000/app")
+
+
+def test_manifest_exists():
+    with FakeRegistry() as registry:
+        registry.add_manifest("team/app", "1.0")
+        client = DockerRegistryClient(registry.address)
+
+        assert client.manifest_exists("team/app", "1.0")
+        assert not client.manifest_exists("team/app", "2.0")
+
+
+def test_bearer_token_authentication():
+    with FakeRegistry(credentials=("user", "pass")) as registry:
+        registry.add_manifest("team/app", "1.0")
+        client = DockerRegistryClient(registry.address, "user", "pass")
+
+        assert client.manifest_exists("team/app", "1.0")
+        assert client.manifest_exists("team/app", "1.0")
+
+    token_requests = [_ for _ in registry.requests if _[1].startswith("/token")]
+    assert len(token_requests) == 1
+
+
+def test_add_tags():
+    with FakeRegistry(credentials=("user", "pass")) as registry:
+        registry.add_manifest("team/app", "1.0", layers=["sha256:a", "sha256:b"])
+        client = DockerRegistryClient(registry.address, "user", "pass")
+
+        client.add_tags("team/app", "1.0", ["latest", "stable"])
+
+    assert registry.manifests[("team/app", "latest")] == registry.manifests[("team/app", "1.0")]
+    assert registry.manifests[("team/app", "stable")] == registry.manifests[("team/app", "1.0")]
+    token_scopes = [_[1] for _ in registry.requests if _[1].startswith("/token")]
+    assert any("pull%2Cpush" in _ for _ in token_scopes)
@@ -0,0 +1,59 @@
+import os
+
+import mock
+import pytest
+
+from takeoff.sbt import Sbt, SbtServer
+
+
+@pytest.fixture(autouse=True)
+def server():
+    SbtServer()._started = False
+    yield SbtServer()
+    SbtServer()._started = False
+
+
+@pytest.mark.parametrize("config, clean", [
+    ({}, True),
+    ({"server": True}, False),
+    ({"server": True, "clean": True}, True),
+    ({"clean": False}, False),
+])
+def test_clean(config, clean):
+    assert Sbt(config).clean == clean
+
+
+def test_command():
+    assert Sbt({}).command("clean", "assembly") == ["sbt", "clean", "assembly"]
+
+
+@mock.patch("takeoff.sbt.atexit.register")
+def test_server_command(m_atexit, server):
+    sbt = Sbt({"server": True})
+
+    assert sbt.command("clean", "assembly") == ["sbt", "--client", "clean; assembly"]
+    assert sbt.command("publish") == ["sbt", "--client", "publish"]
+
+    m_atexit.assert_called_once_with(server.shutdown)
+
+
+@mock.patch("takeoff.sbt.atexit.register")
+@mock.patch.dict(os.environ, {"SBT_OPTS": "-Xmx2G"})
+def test_server_shutdown(_, server):
+    Sbt({"server": True, "cache_dir": "/cache"}).command("assembly")
+
+    with mock.patch("takeoff.sbt.run_shell_command", return_value=(0, [])) as m:
+        server.shutdown()
+        server.shutdown()
+
+    m.assert_called_once_with(["sbt", "--client", "shutdown"], env=Sbt({"cache_dir": "/cache"}).environment())
+
+
+@mock.patch.dict(os.environ, {"SBT_OPTS": "-Xmx2G"})
+def test_environment():
+    assert Sbt({}).environment() is None
+    assert Sbt({"cache_dir": "/cache"}).environment() == {
+        "COURSIER_CACHE": "/cache/coursier",
+        "SBT_OPTS": "-Xmx2G -Dsbt.boot.directory=/cache/boot -Dsbt.ivy.home=/cache/ivy "
+                    "-Dsbt.coursier.home=/cache/coursier",
+    }
@@ -0,0 +1,112 @@
+import threading
+
+import pytest
+
+from takeoff.context import ContextKey
+from takeoff.scheduler import ScheduledStep, plan_steps, run_steps
+
+
+class Producer:
+    produces = frozenset({ContextKey.EVENTHUB_CONSUMER_GROUP_SECRETS})
+
+
+class Consumer:
+    consumes = frozenset({ContextKey.EVENTHUB_CONSUMER_GROUP_SECRETS})
+
+
+def no_class(_):
+    return None
+
+
+def deps(plan):
+    return {_.step_id: set(_.depends_on) for _ in plan}
+
+
+class TestPlanSteps(object):
+    def test_sequential_by_default(self):
+        plan = plan_steps([{"task": "a"}, {"task": "b"}, {"task": "c"}], no_class)
+        assert deps(plan) == {"a": set(), "b": {"a"}, "c": {"a", "b"}}
+
+    def test_duplicate_tasks_get_postfix(self):
+        plan = plan_steps([{"task": "a"}, {"task": "a"}, {"task": "b", "id": "custom"}], no_class)
+        assert [_.step_id for _ in plan] == ["a", "a_2", "custom"]
+
+    def test_duplicate_ids(self):
+        with pytest.raises(ValueError):
+            plan_steps([{"task": "a", "id": "x"}, {"task": "b", "id": "x"}], no_class)
+
+    def test_explicit_dependencies(self):
+        plan = plan_steps(
+            [{"task": "a"}, {"task": "b", "depends_on": []}, {"task": "c", "depends_on": ["b"]}], no_class
+        )
+        assert deps(plan) == {"a": set(), "b": set(), "c": {"b"}}
+
+    def test_dependency_on_task_name_matches_all_steps(self):
+        plan = plan_steps(
+            [
+                {"task": "a", "depends_on": []},
+                {"task": "a", "depends_on": []},
+                {"task": "c", "depends_on": ["a"]},
+            ],
+            no_class,
+        )
+        assert deps(plan)["c"] == {"a", "a_2"}
+
+    def test_unknown_dependency(self):
+        with pytest.raises(ValueError):
+            plan_steps([{"task": "a", "depends_on": ["foo"]}], no_class)
+
+    def test_circular_dependency(self):
+        with pytest.raises(ValueError):
+            plan_steps([{"task": "a", "depends_on": ["b"]}, {"task": "b", "depends_on": ["a"]}], no_class)
+
+    def test_inferred_context_dependency(self):
+        classes = {"producer": Producer, "consumer": Consumer}
+        plan = plan_steps(
+            [
+                {"task": "producer"},
+                {"task": "other", "depends_on": []},
+                {"task": "consumer", "depends_on": []},
+            ],
+            classes.get,
+        )
+        assert deps(plan)["consumer"] == {"producer"}
+
+
+def step(step_id, *depends_on):
+    return ScheduledStep(step_id, step_id, {}, frozenset(depends_on))
+
+
+class TestRunSteps(object):
+    def test_sequential_order(self):
+        order = []
+        run_steps([step("b", "a"), step("a")], lambda s: order.append(s.step_id), 1)
+        assert order == ["a", "b"]
+
+    def test_independent_steps_run_concurrently(self):
+        barrier = threading.Barrier(2, timeout=5)
+        order = []
+
+        def run(s):
+            if s.step_id in {"a", "b"}:
+                barrier.wait()
+            order.append(s.step_id)
+
+        run_steps([step("a"), step("b"), step("c", "a", "b")], run, 2)
+        assert order[-1] == "c"
+
+    def test_failure_skips_dependent_steps(self):
+        ran = []
+
+        def run(s):
+            if s.step_id == "a":
+                raise ChildProcessError("boom")
+            ran.append(s.step_id)
+
+        with pytest.raises(ChildProcessError):
+            run_steps([step("a"), step("b", "a")], run, 2)
+        assert ran == []
+
+    def test_invalid_concurrency(self):
+        with pytest.raises(ValueError):
+            run_steps([step("a")], lambda s: None, 0)
@@ -0,0 +1,40 @@
+import subprocess
+import sys
+
+import pytest
+
+from takeoff.step import Step
+from takeoff.steps import get_step, steps
+
+HEAVY_MODULES = ["azure.mgmt", "azure.storage", "databricks_cli", "docker", "kubernetes", "twine"]
+
+CHECK_IMPORTS = """
+import sys
+{imports}
+loaded = sorted(m for m in {heavy} if m in sys.modules)
+print(",".join(loaded))
+"""
+
+
+def heavy_modules_after(imports: str) -> str:
+    """Runs the imports in a fresh interpreter and returns the heavy SDK modules that got loaded"""
+    code = CHECK_IMPORTS.format(imports=imports, heavy=HEAVY_MODULES)
+    return subprocess.check_output([sys.executable, "-c", code], universal_newlines=True).strip()
+
+
+@pytest.mark.parametrize("task", sorted(steps))
+def test_registered_steps_resolve(task):
+    assert issubclass(get_step(task), Step)
+
+
+def test_unknown_step():
+    assert get_step("unknown") is None
+
+
+def test_get_version_does_not_import_sdks():
+    assert heavy_modules_after("from takeoff.deploy import get_environment") == ""
+
+
+def test_build_artifact_does_not_import_sdks():
+    imports = "from takeoff.steps import get_step\nget_step('build_artifact')"
+    assert heavy_modules_after(imports) == ""
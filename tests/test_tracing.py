@@ -0,0 +1,127 @@
+import json
+
+import mock
+import pytest
+
+from takeoff.tracing import Tracer, traced
+from takeoff.util import run_shell_command
+
+
+@pytest.fixture
+def tracer():
+    tracer = Tracer()
+    tracer.clear()
+    tracer.enable()
+    yield tracer
+    tracer.enabled = False
+    tracer.clear()
+
+
+def spans(tracer):
+    return [_ for _ in tracer.events if _["ph"] == "X"]
+
+
+class ConsumerGroupsOperations(object):
+    def create_or_update(self, *args):
+        return "created"
+
+
+class FakeClient(object):
+    def __init__(self):
+        self.consumer_groups = ConsumerGroupsOperations()
+        self.url = "https://example.com"
+
+    def perform_query(self, method, path, data=None):
+        if path == "/fail":
+            raise ValueError("boom")
+        return {"path": path}
+
+
+def test_disabled_by_default():
+    client = FakeClient()
+    assert traced(client, "fake") is client
+
+    with Tracer().span("foo", "step") as args:
+        args["bar"] = 1
+    assert spans(Tracer()) == []
+
+
+def test_span(tracer):
+    with tracer.span("build_docker_image", "step", task="build_docker_image") as args:
+        args["result"] = "done"
+
+    [span] = spans(tracer)
+    assert span["name"] == "build_docker_image"
+    assert span["cat"] == "step"
+    assert span["args"] == {"task": "build_docker_image", "result": "done"}
+    assert span["dur"] >= 0
+
+
+def test_span_records_errors(tracer):
+    with pytest.raises(ValueError):
+        with tracer.span("foo", "step"):
+            raise ValueError("boom")
+
+    assert spans(tracer)[0]["args"] == {"error": "ValueError('boom')"}
+
+
+def test_traced_client(tracer):
+    client = traced(FakeClient(), "databricks", record_args=True)
+
+    assert client.perform_query("GET", "/jobs/list", data={"key": "value"}) == {"path": "/jobs/list"}
+    assert client.consumer_groups.create_or_update("rg", "group") == "created"
+    assert client.url == "https://example.com"
+    with pytest.raises(ValueError):
+        client.perform_query("POST", "/fail")
+
+    error = {"error": "ValueError('boom')"}
+    assert [(_["name"], _["cat"], _["args"]) for _ in spans(tracer)] == [
+        ("databricks.perform_query", "databricks", {"args": ["GET", "/jobs/list"]}),
+        ("databricks.consumer_groups.create_or_update", "databricks", {"args": ["rg", "group"]}),
+        ("databricks.perform_query", "databricks", {"args": ["POST", "/fail"], **error}),
+    ]
+
+
+def test_traced_client_does_not_record_args_by_default(tracer):
+    traced(FakeClient(), "keyvault").perform_query("GET", "/secret")
+
+    assert spans(tracer)[0]["args"] == {}
+
+
+def test_shell_command_span(tracer):
+    run_shell_command(["echo", "hello", "world"])
+
+    [span] = spans(tracer)
+    assert (span["name"], span["cat"], span["args"]) == ("echo hello", "shell", {"returncode": 0})
+
+
+def test_write(tracer, tmp_path):
+    with tracer.span("foo", "step"):
+        pass
+    path = str(tmp_path / "trace.json")
+    tracer.write(path)
+
+    with open(path) as f:
+        trace = json.load(f)
+    assert [_["ph"] for _ in trace["traceEvents"]] == ["M", "X"]
+
+
+@mock.patch("takeoff.deploy.get_full_yaml_filename", side_effect=lambda s, _: s)
+@mock.patch("takeoff.deploy.get_environment")
+@mock.patch("takeoff.deploy.run_task")
+@mock.patch("takeoff.deploy.load_yaml")
+def test_main_writes_trace(m_load_yaml, m_run_task, _, __, tmp_path):
+    from takeoff.deploy import main
+
+    m_load_yaml.side_effect = lambda s: {"steps": [{"task": "build_artifact"}]} if s == "deployment" else {}
+    path = str(tmp_path / "trace.json")
+    try:
+        main(trace_file=path)
+    finally:
+        Tracer().enabled = False
+
+    with open(path) as f:
+        events = json.load(f)["traceEvents"]
+    assert [(_["name"], _["cat"]) for _ in events if _["ph"] == "X"] == [("build_artifact", "step")]
+    m_run_task.assert_called_once()
+    Tracer().clear()
@@ -1,7 +1,14 @@
 import os
 import re
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
 
+import mock
 import pytest
+from git import Actor, Repo
 
 from takeoff import util as victim
 
@@ -74,3 +81,241 @@ def test_ensure_base64_non_encoded():
 def test_ensure_base64_encoded():
     result = victim.ensure_base64("c29tZXRoaW5n")
     assert result == "c29tZXRoaW5n"
+
+
+class HttpError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"status {status_code}")
+        self.response = mock.Mock(status_code=status_code, headers=headers or {})
+
+
+@mock.patch("takeoff.util.time.sleep")
+def test_call_with_retries_retries_throttled_calls(m_sleep):
+    func = mock.Mock(side_effect=[HttpError(429), HttpError(503, {"Retry-After": "3"}), "result"])
+
+    assert victim.call_with_retries(func, backoff_seconds=1) == "result"
+    assert func.call_count == 3
+    m_sleep.assert_has_calls([mock.call(1.0), mock.call(3.0)])
+
+
+@mock.patch("takeoff.util.time.sleep")
+def test_call_with_retries_retry_after_http_date(m_sleep):
+    retry_at = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    func = mock.Mock(side_effect=[HttpError(503, {"Retry-After": retry_at}), "result"])
+
+    assert victim.call_with_retries(func, backoff_seconds=1) == "result"
+    [delay] = [_[0][0] for _ in m_sleep.call_args_list]
+    assert 28 <= delay <= 30
+
+
+@mock.patch("takeoff.util.time.sleep")
+def test_call_with_retries_retry_after_in_the_past(m_sleep):
+    func = mock.Mock(side_effect=[HttpError(503, {"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"}), "result"])
+
+    assert victim.call_with_retries(func, backoff_seconds=1) == "result"
+    m_sleep.assert_called_once_with(0.0)
+
+
+@mock.patch("takeoff.util.time.sleep")
+def test_call_with_retries_invalid_retry_after(m_sleep):
+    func = mock.Mock(side_effect=[HttpError(503, {"Retry-After": "soon"}), "result"])
+
+    assert victim.call_with_retries(func, backoff_seconds=1) == "result"
+    m_sleep.assert_called_once_with(1.0)
+
+
+@mock.patch("takeoff.util.time.sleep")
+def test_call_with_retries_does_not_retry_client_errors(m_sleep):
+    func = mock.Mock(side_effect=HttpError(404))
+
+    with pytest.raises(HttpError):
+        victim.call_with_retries(func)
+    func.assert_called_once()
+    m_sleep.assert_not_called()
+
+
+@mock.patch("takeoff.util.time.sleep")
+def test_call_with_retries_gives_up(m_sleep):
+    func = mock.Mock(side_effect=HttpError(500))
+
+    with pytest.raises(HttpError):
+        victim.call_with_retries(func, max_attempts=3)
+    assert func.call_count == 3
+
+
+PLUGIN_PATH = os.path.dirname(os.path.realpath(__file__))
+
+
+@mock.patch("takeoff.util.DEFAULT_TAKEOFF_PLUGIN_PREFIX", "_takeoff_")
+def test_plugin_registry_scans_once():
+    victim.invalidate_takeoff_plugins()
+    sys.path.append(PLUGIN_PATH)
+    try:
+        with mock.patch("takeoff.util.pkgutil.iter_modules", wraps=victim.pkgutil.iter_modules) as m:
+            registry = victim.takeoff_plugin_registry()
+            assert victim.takeoff_plugin_registry() is registry
+            assert victim.load_takeoff_plugins() is registry.plugins
+        m.assert_called_once()
+        assert "_takeoff_custom" in registry.plugins
+        assert registry.hook("deploy_env_logic") is registry.plugins["_takeoff_custom"].deploy_env_logic
+        assert registry.hook("get_keyvault_name") is None
+    finally:
+        sys.path.remove(PLUGIN_PATH)
+
+
+@mock.patch("takeoff.util.DEFAULT_TAKEOFF_PLUGIN_PREFIX", "_takeoff_")
+def test_plugin_registry_rescans_on_path_change():
+    victim.invalidate_takeoff_plugins()
+    before = victim.takeoff_plugin_registry()
+    assert "_takeoff_custom" not in before.plugins
+
+    sys.path.append(PLUGIN_PATH)
+    try:
+        assert "_takeoff_custom" in victim.takeoff_plugin_registry().plugins
+    finally:
+        sys.path.remove(PLUGIN_PATH)
+
+
+@mock.patch("takeoff.util.DEFAULT_TAKEOFF_PLUGIN_PREFIX", "_takeoff_")
+def test_invalidate_plugin_registry():
+    registry = victim.takeoff_plugin_registry()
+    victim.invalidate_takeoff_plugins()
+    assert victim.takeoff_plugin_registry() is not registry
+
+
+@pytest.fixture
+def tagged_repo(tmp_path):
+    repo = Repo.init(str(tmp_path))
+    author = Actor("takeoff", "takeoff@example.com")
+    with repo.config_writer() as config:
+        config.set_value("user", "name", author.name)
+        config.set_value("user", "email", author.email)
+    first = repo.index.commit("first", author=author, committer=author)
+    repo.create_tag("0.1.0", ref=first)
+    repo.create_tag("release/0.1.0", ref=first, message="annotated")
+    repo.create_tag("0.1.1", ref=first, message="packed and annotated")
+    repo.git.pack_refs("--all")
+    repo.create_tag("unpacked", ref=first, message="loose and annotated")
+    second = repo.index.commit("second", author=author, committer=author)
+    repo.create_tag("1.0.0", ref=second)
+    return repo, first.hexsha, second.hexsha
+
+
+def test_tags_by_commit(tagged_repo):
+    repo, first, second = tagged_repo
+
+    assert victim._tags_by_commit(repo) == {
+        first: ["0.1.0", "0.1.1", "release/0.1.0", "unpacked"],
+        second: ["1.0.0"],
+    }
+
+
+def test_git_info_is_read_once(tagged_repo, monkeypatch):
+    repo, _, second = tagged_repo
+    monkeypatch.chdir(repo.working_dir)
+    monkeypatch.setattr(victim, "_git_info", None)
+
+    with mock.patch("takeoff.util._tags_by_commit", wraps=victim._tags_by_commit) as m:
+        info = victim.get_git_info()
+        assert victim.get_tag() == "1.0.0"
+        assert victim.get_short_hash() == second[:7]
+    m.assert_called_once()
+    assert info == victim.GitInfo(sha=second, short_hash=second[:7], tag="1.0.0")
+    assert victim.get_short_hash(10) == second[:10]
+
+
+def test_output_prefix(capsys):
+    with victim.output_prefix("[a] "):
+        with victim.output_prefix("[b] "):
+            victim.run_shell_command(["echo", "hello"])
+        victim.run_shell_command(["echo", "world"])
+    victim.run_shell_command(["echo", "!"])
+
+    assert capsys.readouterr().out.splitlines() == ["[a] [b] hello", "[a] world", "!"]
+
+
+def test_run_shell_command_output(capsys):
+    code, lines = victim.run_shell_command(["sh", "-c", "echo out; echo err >&2; printf last; exit 3"])
+
+    assert code == 3
+    assert lines == ["out\n", "last\n"]
+    output = capsys.readouterr()
+    assert output.out.splitlines() == ["out", "last"]
+    assert output.err.splitlines() == ["err"]
+
+
+def test_run_shell_command_keeps_tail(monkeypatch):
+    monkeypatch.setattr(victim, "SHELL_OUTPUT_TAIL", 3)
+
+    code, lines = victim.run_shell_command(["seq", "1000"])
+
+    assert code == 0
+    assert lines == ["998\n", "999\n", "1000\n"]
+
+
+def test_run_shell_command_env():
+    code, lines = victim.run_shell_command(["sh", "-c", "echo $TAKEOFF_TEST"], env={"TAKEOFF_TEST": "pony"})
+
+    assert lines == ["pony\n"]
+
+
+def test_run_shell_command_timeout(tmp_path):
+    marker = tmp_path / "marker"
+    start = time.monotonic()
+
+    # the background process keeps the output open, it has to be killed along with the shell
+    code, lines = victim.run_shell_command(
+        ["sh", "-c", f"echo started; (sleep 2; touch {marker}) & sleep 30"], timeout=0.5
+    )
+
+    assert code < 0
+    assert lines == ["started\n"]
+    assert time.monotonic() - start < 5
+    time.sleep(2.5)
+    assert not marker.exists()
+
+
+def test_run_shell_commands(capsys):
+    commands = [["sh", "-c", "sleep 0.5; echo first; exit 1"], ["sh", "-c", "echo second; echo warning >&2"]]
+    start = time.monotonic()
+
+    results = victim.run_shell_commands(commands + commands, max_concurrency=4)
+
+    assert time.monotonic() - start < 1.5
+    assert results == [(1, ["first\n"]), (0, ["second\n"])] * 2
+    captured = capsys.readouterr()
+    output = captured.out.splitlines()
+    assert sorted(output) == ["[sh 1] first", "[sh 2] second", "[sh 3] first", "[sh 4] second"]
+    assert sorted(captured.err.splitlines()) == ["[sh 2] warning", "[sh 4] warning"]
+    # the fast commands do not wait for the slow ones
+    assert output.index("[sh 2] second") < output.index("[sh 1] first")
+
+
+def test_run_shell_commands_concurrency_limit():
+    commands = [["sleep", "0.3"]] * 4
+    start = time.monotonic()
+
+    with victim.output_prefix("[x] "):
+        results = victim.run_shell_commands(commands, max_concurrency=2, prefixes=["a"] * 4)
+
+    assert [_[0] for _ in results] == [0] * 4
+    assert time.monotonic() - start >= 0.6
+
+
+def test_run_shell_commands_from_worker_thread(capsys):
+    results = []
+
+    def run():
+        with victim.output_prefix("[step] "):
+            results.extend(victim.run_shell_commands([["echo", "a"], ["echo", "b"]], prefixes=["1 ", "2 "]))
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+
+    assert results == [(0, ["a\n"]), (0, ["b\n"])]
+    assert sorted(capsys.readouterr().out.splitlines()) == ["[step] 1 a", "[step] 2 b"]
+
+
+def test_run_shell_commands_without_commands():
+    assert victim.run_shell_commands([]) == []